@@ -0,0 +1,202 @@
+"""
+Library usage reports for staff.
+
+Every figure is aggregated by Postgres with `annotate`/`aggregate` and
+window functions over `BorrowRecord` and `PaymentRecord`, so archived
+history is included. `usage_report` combines them and is cached per time
+bucket of `ANALYTICS_CACHE_BUCKET` seconds, so dashboards refreshing within
+a bucket share one computation.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import (
+    Avg,
+    BigIntegerField,
+    Count,
+    DecimalField,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    Func,
+    Q,
+    Sum,
+    ValueRange,
+    Window,
+)
+from django.db.models.functions import Rank
+
+from borrow_service.models import BorrowRecord
+from payments_service.models import Payment, PaymentRecord
+
+
+class OverGroups(Func):
+    """
+    An aggregate over the rows of a grouped query, e.g.
+    `SUM(COUNT(id)) OVER (...)`, which Django's aggregates refuse to nest.
+    """
+    window_compatible = True
+
+
+class DaysBefore(ValueRange):
+    """
+    A frame of the rows dated up to `days` calendar days before the current
+    one, `RANGE BETWEEN INTERVAL 'n days' PRECEDING AND CURRENT ROW`, which
+    counts missing days where a row frame would skip them.
+    """
+
+    def __init__(self, days: int):
+        super().__init__(start=-days, end=0)
+
+    def window_frame_start_end(self, connection, start, end):
+        preceding = f"INTERVAL '{-start} days' {connection.ops.PRECEDING}"
+        return preceding, connection.ops.CURRENT_ROW
+
+
+def borrows_in(since: datetime.date, until: datetime.date):
+    return BorrowRecord.objects.filter(borrow_date__range=(since, until))
+
+
+def borrows_per_day(since: datetime.date, until: datetime.date) -> list:
+    """
+    Borrows started on each day with a running total and the average over
+    the 7 calendar days up to it. Days without borrows are left out of the
+    rows but count as zero in the average.
+    """
+    daily = Count("id")
+    rows = list(
+        borrows_in(since, until)
+        .values("borrow_date")
+        .annotate(borrows=daily)
+        # Annotated after the grouping, or Django groups by the windows too.
+        .annotate(
+            running_total=Window(
+                OverGroups(daily, function="SUM", output_field=BigIntegerField()),
+                order_by=F("borrow_date").asc(),
+            ),
+            week_total=Window(
+                OverGroups(daily, function="SUM", output_field=BigIntegerField()),
+                order_by=F("borrow_date").asc(),
+                frame=DaysBefore(6),
+            ),
+        )
+        .order_by("borrow_date")
+    )
+    for row in rows:
+        row["moving_average"] = row.pop("week_total") / 7
+    return rows
+
+
+def most_borrowed_books(since: datetime.date, until: datetime.date, limit: int = 10) -> list:
+    """
+    The books borrowed most often, ranked with ties sharing a rank.
+    """
+    borrows = Count("id")
+    return list(
+        borrows_in(since, until)
+        .values("book_id", title=F("book__title"), author=F("book__author"))
+        .annotate(
+            borrows=borrows,
+            rank=Window(Rank(), order_by=borrows.desc()),
+        )
+        .order_by("rank", "book_id")[:limit]
+    )
+
+
+def revenue_by_type(since: datetime.date, until: datetime.date) -> list:
+    """
+    Paid amounts per `Payment.Type` with each type's share of the total.
+    """
+    revenue = Sum("money_to_pay")
+    return list(
+        PaymentRecord.objects.filter(
+            status=Payment.Status.PAID,
+            created_at__date__range=(since, until),
+        )
+        .values("type")
+        .annotate(
+            payments=Count("id"),
+            revenue=revenue,
+            total=Window(
+                OverGroups(
+                    revenue,
+                    function="SUM",
+                    output_field=DecimalField(max_digits=12, decimal_places=2),
+                )
+            ),
+        )
+        .order_by("type")
+    )
+
+
+def overdue_rates(since: datetime.date, until: datetime.date, today: datetime.date) -> dict:
+    """
+    How many of the borrows started in the period were returned late or are
+    still out past their due date.
+    """
+    return borrows_in(since, until).aggregate(
+        borrows=Count("id"),
+        returned_late=Count(
+            "id", filter=Q(actual_return_date__gt=F("expected_return_date"))
+        ),
+        overdue=Count(
+            "id",
+            filter=Q(
+                actual_return_date__isnull=True, expected_return_date__lt=today
+            ),
+        ),
+    )
+
+
+def average_borrow_duration(since: datetime.date, until: datetime.date) -> datetime.timedelta | None:
+    return borrows_in(since, until).filter(
+        actual_return_date__isnull=False
+    ).aggregate(
+        duration=Avg(
+            ExpressionWrapper(
+                F("actual_return_date") - F("borrow_date"),
+                output_field=DurationField(),
+            )
+        )
+    )["duration"]
+
+
+def build_report(since: datetime.date, until: datetime.date, today: datetime.date) -> dict:
+    revenue = revenue_by_type(since, until)
+    for row in revenue:
+        total = row.pop("total")
+        row["share"] = round(row["revenue"] / total, 4) if total else 0
+    rates = overdue_rates(since, until, today)
+    late = rates["returned_late"] + rates["overdue"]
+    rates["overdue_rate"] = round(late / rates["borrows"], 4) if rates["borrows"] else 0
+    duration = average_borrow_duration(since, until)
+    return {
+        "since": since,
+        "until": until,
+        "borrows_per_day": borrows_per_day(since, until),
+        "most_borrowed_books": most_borrowed_books(
+            since, until, settings.ANALYTICS_TOP_BOOKS
+        ),
+        "revenue_by_type": revenue,
+        "overdue": rates,
+        "average_borrow_days": (
+            round(duration.total_seconds() / 86400, 2) if duration is not None else None
+        ),
+    }
+
+
+def usage_report(since: datetime.date, until: datetime.date) -> tuple[dict, bool]:
+    """
+    The report of a period, from the cache entry of the current time bucket
+    when there is one. Returns the report and whether it was cached.
+    """
+    bucket = int(time.time() // settings.ANALYTICS_CACHE_BUCKET)
+    key = f"analytics:report:{bucket}:{since}:{until}"
+    report = cache.get(key)
+    if report is not None:
+        return report, True
+    report = build_report(since, until, datetime.date.today())
+    cache.set(key, report, settings.ANALYTICS_CACHE_BUCKET)
+    return report, False
@@ -0,0 +1,59 @@
+import datetime
+
+from django.conf import settings
+from rest_framework import serializers
+
+
+class ReportPeriodSerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        until = attrs.get("until") or datetime.date.today()
+        since = attrs.get("since") or until - datetime.timedelta(days=29)
+        if since > until:
+            raise serializers.ValidationError("since must not be after until")
+        if (until - since).days >= settings.ANALYTICS_MAX_DAYS:
+            raise serializers.ValidationError(
+                f"The period can span at most {settings.ANALYTICS_MAX_DAYS} days"
+            )
+        return {"since": since, "until": until}
+
+
+class BorrowsPerDaySerializer(serializers.Serializer):
+    borrow_date = serializers.DateField()
+    borrows = serializers.IntegerField()
+    running_total = serializers.IntegerField()
+    moving_average = serializers.FloatField()
+
+
+class BookRankSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    title = serializers.CharField()
+    author = serializers.CharField()
+    borrows = serializers.IntegerField()
+    rank = serializers.IntegerField()
+
+
+class RevenueSerializer(serializers.Serializer):
+    type = serializers.CharField()
+    payments = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+    share = serializers.DecimalField(max_digits=5, decimal_places=4)
+
+
+class OverdueSerializer(serializers.Serializer):
+    borrows = serializers.IntegerField()
+    returned_late = serializers.IntegerField()
+    overdue = serializers.IntegerField()
+    overdue_rate = serializers.FloatField()
+
+
+class UsageReportSerializer(serializers.Serializer):
+    since = serializers.DateField()
+    until = serializers.DateField()
+    borrows_per_day = BorrowsPerDaySerializer(many=True)
+    most_borrowed_books = BookRankSerializer(many=True)
+    revenue_by_type = RevenueSerializer(many=True)
+    overdue = OverdueSerializer()
+    average_borrow_days = serializers.FloatField(allow_null=True)
@@ -0,0 +1,148 @@
+import datetime
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from book_service.models import Book
+from borrow_service.archive import archive_history
+from borrow_service.models import Borrow
+from payments_service.models import Payment
+
+usage_url = reverse("analytics_service:usage")
+
+
+def create_book(title) -> Book:
+    return Book.objects.create(
+        title=title,
+        author="123",
+        cover="HARD",
+        inventory=100,
+        daily_fee=10
+    )
+
+
+class TestUsageReport(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = get_user_model().objects.create_user(
+            "admin@gmail.com", "test123", is_staff=True
+        )
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com", "test123"
+        )
+        self.client.force_authenticate(self.staff)
+        self.today = datetime.date.today()
+        self.popular = create_book("popular")
+        self.other = create_book("other")
+
+    def borrow(self, book, days_ago, days_kept=None, due_in=7) -> Borrow:
+        borrowed = self.today - datetime.timedelta(days=days_ago)
+        returned = None
+        if days_kept is not None:
+            returned = borrowed + datetime.timedelta(days=days_kept)
+        borrow = Borrow.objects.create(
+            book=book,
+            user=self.user,
+            expected_return_date=borrowed + datetime.timedelta(days=due_in),
+            actual_return_date=returned,
+        )
+        Borrow.objects.filter(pk=borrow.pk).update(borrow_date=borrowed)
+        return borrow
+
+    def pay(self, borrow, amount, type="PAYMENT", status="PAID") -> None:
+        Payment.objects.create(
+            status=status, type=type, borrowing=borrow, money_to_pay=amount
+        )
+
+    def test_only_staff_can_read_analytics(self):
+        self.client.force_authenticate(self.user)
+        res = self.client.get(usage_url)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_aggregates_the_period(self):
+        self.pay(self.borrow(self.popular, 3, days_kept=2), 20)
+        self.pay(self.borrow(self.popular, 3, days_kept=10), 30)
+        late = self.borrow(self.other, 1, days_kept=None, due_in=-1)
+        self.pay(late, 4, type="FINE", status="PENDING")
+        self.pay(self.borrow(self.other, 1, days_kept=None), 10, type="FINE")
+        self.borrow(self.popular, 60, days_kept=1)
+
+        res = self.client.get(usage_url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                (row["borrows"], row["running_total"], row["moving_average"])
+                for row in res.data["borrows_per_day"]
+            ],
+            [(2, 2, 2 / 7), (2, 4, 4 / 7)],
+        )
+        self.assertEqual(
+            [
+                (row["title"], row["borrows"], row["rank"])
+                for row in res.data["most_borrowed_books"]
+            ],
+            [("popular", 2, 1), ("other", 2, 1)],
+        )
+        self.assertEqual(
+            [
+                (row["type"], row["payments"], row["revenue"], row["share"])
+                for row in res.data["revenue_by_type"]
+            ],
+            [("FINE", 1, "10.00", "0.1667"), ("PAYMENT", 2, "50.00", "0.8333")],
+        )
+        self.assertEqual(
+            res.data["overdue"],
+            {"borrows": 4, "returned_late": 1, "overdue": 1, "overdue_rate": 0.5},
+        )
+        self.assertEqual(res.data["average_borrow_days"], 6.0)
+
+    def test_archived_history_is_included(self):
+        self.borrow(self.popular, 500, days_kept=2)
+        archive_history(self.today - datetime.timedelta(days=365))
+
+        res = self.client.get(
+            usage_url,
+            {
+                "since": self.today - datetime.timedelta(days=600),
+                "until": self.today - datetime.timedelta(days=300),
+            },
+        )
+
+        self.assertEqual(res.data["overdue"]["borrows"], 1)
+        self.assertEqual(res.data["most_borrowed_books"][0]["title"], "popular")
+
+    def test_report_is_cached_per_time_bucket(self):
+        self.borrow(self.popular, 1)
+
+        res = self.client.get(usage_url)
+        self.assertEqual(res["X-Cache"], "MISS")
+        self.borrow(self.popular, 1)
+        with self.assertNumQueries(0):
+            res = self.client.get(usage_url)
+        self.assertEqual(res["X-Cache"], "HIT")
+        self.assertEqual(res.data["overdue"]["borrows"], 1)
+
+        next_bucket = time.time() + settings.ANALYTICS_CACHE_BUCKET
+        with patch("analytics_service.reports.time.time", return_value=next_bucket):
+            res = self.client.get(usage_url)
+        self.assertEqual(res["X-Cache"], "MISS")
+        self.assertEqual(res.data["overdue"]["borrows"], 2)
+
+    def test_rejects_invalid_periods(self):
+        res = self.client.get(
+            usage_url, {"since": self.today, "until": self.today - datetime.timedelta(days=1)}
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(
+            usage_url, {"since": self.today - datetime.timedelta(days=400)}
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from analytics_service.views import usage
+
+urlpatterns = [
+    path("analytics/usage/", usage, name="usage"),
+]
+
+app_name = "analytics_service"
@@ -0,0 +1,33 @@
+from drf_spectacular.utils import extend_schema
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from analytics_service.reports import usage_report
+from analytics_service.serializers import (
+    ReportPeriodSerializer,
+    UsageReportSerializer,
+)
+
+
+@extend_schema(
+    summary="library usage over a period, staff only",
+    parameters=[ReportPeriodSerializer],
+    responses={200: UsageReportSerializer},
+)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def usage(request: Request) -> Response:
+    """
+    Borrows per day, the most borrowed books, revenue by payment type,
+    overdue rates and the average borrow duration between `since` and
+    `until`, the last 30 days by default.
+    """
+    period = ReportPeriodSerializer(data=request.query_params)
+    period.is_valid(raise_exception=True)
+    report, cached = usage_report(**period.validated_data)
+    return Response(
+        UsageReportSerializer(report).data,
+        headers={"X-Cache": "HIT" if cached else "MISS"},
+    )
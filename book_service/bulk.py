@@ -0,0 +1,276 @@
+"""
+Bulk import and export of the book catalogue.
+
+Imports stream CSV or JSONL in batches. Each batch is validated in one pass,
+COPYed into a temporary staging table and merged into `Book` with two
+set-based statements keyed by (title, author, cover). Exports stream the
+table back out without loading it into memory.
+
+Catalogue files count every copy a book has, while `Book.inventory` only
+counts the copies on the shelf. Copies out on loan, held for a pending
+payment or held for a waitlisted patron are subtracted on import and added
+back on export.
+"""
+import csv
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from book_service.cache import invalidate_catalogue
+from book_service.models import Book
+from borrow_service.models import Borrow, WaitlistEntry
+
+IMPORT_FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+EXPORT_FIELDS = ("id",) + IMPORT_FIELDS
+FORMATS = ("csv", "jsonl")
+
+MAX_DAILY_FEE = Decimal("999.99")
+COVERS = frozenset(Book.Cover.values)
+
+
+class RowError(NamedTuple):
+    line: int
+    message: str
+
+
+def detect_format(path: str, default: str = "csv") -> str:
+    for fmt in FORMATS:
+        if path.endswith(f".{fmt}"):
+            return fmt
+    return default
+
+
+def read_rows(stream, fmt: str):
+    """
+    Yields (line number, row dict) pairs from a CSV or JSONL text stream.
+    Rows JSONL cannot parse are yielded as RowError.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError as exc:
+            yield line, RowError(line, f"invalid JSON: {exc.msg}")
+            continue
+        if not isinstance(row, dict):
+            yield line, RowError(line, "expected a JSON object")
+            continue
+        yield line, row
+
+
+def off_shelf_copies() -> str:
+    """
+    SQL counting the copies of `book` that are not on the shelf: those of
+    unreturned borrows, including holds awaiting payment, and those held
+    for waitlisted patrons.
+    """
+    quote = connection.ops.quote_name
+    return f"""(
+        (
+            SELECT count(*) FROM {quote(Borrow._meta.db_table)} AS borrow
+            WHERE borrow.book_id = book.id
+                AND borrow.actual_return_date IS NULL
+        ) + (
+            SELECT count(*) FROM {quote(WaitlistEntry._meta.db_table)} AS entry
+            WHERE entry.book_id = book.id
+                AND entry.status = '{WaitlistEntry.Status.HELD}'
+        )
+    )"""
+
+
+def validate_batch(rows: list) -> tuple[list, list]:
+    """
+    Checks a batch of rows against the Book constraints.
+    Returns rows ready for COPY as (line, title, author, cover, inventory,
+    daily_fee) tuples, and the RowErrors of the rejected ones.
+    """
+    valid, errors = [], []
+    for line, row in rows:
+        if isinstance(row, RowError):
+            errors.append(row)
+            continue
+        title = str(row.get("title") or "").strip()
+        author = str(row.get("author") or "").strip()
+        cover = str(row.get("cover") or "").strip().upper()
+        problems = []
+        if not title or len(title) > 100:
+            problems.append("title must have 1 to 100 characters")
+        if not author or len(author) > 255:
+            problems.append("author must have 1 to 255 characters")
+        if cover not in COVERS:
+            problems.append(f"cover must be one of {', '.join(sorted(COVERS))}")
+        try:
+            inventory = int(str(row.get("inventory", "")).strip())
+        except ValueError:
+            inventory = None
+        if inventory is None or inventory < 0:
+            problems.append("inventory must be a non-negative integer")
+        try:
+            daily_fee = Decimal(str(row.get("daily_fee", "")).strip())
+        except InvalidOperation:
+            daily_fee = None
+        if daily_fee is None or not Decimal(0) <= daily_fee <= MAX_DAILY_FEE:
+            problems.append(f"daily_fee must be between 0 and {MAX_DAILY_FEE}")
+        elif daily_fee != daily_fee.quantize(Decimal("0.01")):
+            problems.append("daily_fee must have at most 2 decimal places")
+
+        if problems:
+            errors.append(RowError(line, "; ".join(problems)))
+        else:
+            valid.append((line, title, author, cover, inventory, daily_fee))
+    return valid, errors
+
+
+def merge_batch(valid: list) -> dict:
+    """
+    COPYs validated rows into a staging table and upserts them into Book.
+    Within a batch the last row for a key wins. Existing books get the
+    imported stock less their copies off the shelf; those whose shelf count
+    and fee already match are left untouched.
+    """
+    table = connection.ops.quote_name(Book._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Imports are serialized so two of them cannot insert the same book.
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('book_import'))")
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS book_import ("
+            " line integer, title varchar(100), author varchar(255),"
+            " cover varchar(4), inventory integer, daily_fee numeric(5, 2)"
+            ")"
+        )
+        cursor.execute("TRUNCATE book_import")
+        with cursor.copy(
+            "COPY book_import (line, title, author, cover, inventory, daily_fee)"
+            " FROM STDIN"
+        ) as copy:
+            for row in valid:
+                copy.write_row(row)
+        # Borrows and returns of the matched books wait until the merge
+        # commits, and the merge sees every one committed before.
+        cursor.execute(
+            f"""
+            SELECT book.id FROM {table} AS book
+            JOIN book_import AS incoming
+                ON book.title = incoming.title
+                AND book.author = incoming.author
+                AND book.cover = incoming.cover
+            ORDER BY book.id
+            FOR UPDATE OF book
+            """
+        )
+        cursor.execute(
+            f"""
+            WITH incoming AS (
+                SELECT DISTINCT ON (title, author, cover)
+                    title, author, cover, inventory, daily_fee
+                FROM book_import
+                ORDER BY title, author, cover, line DESC
+            ), matched AS (
+                SELECT
+                    book.id,
+                    greatest(incoming.inventory - {off_shelf_copies()}, 0)
+                        AS inventory,
+                    incoming.daily_fee
+                FROM {table} AS book
+                JOIN incoming
+                    ON book.title = incoming.title
+                    AND book.author = incoming.author
+                    AND book.cover = incoming.cover
+            ), updated AS (
+                UPDATE {table} AS book
+                SET inventory = matched.inventory, daily_fee = matched.daily_fee
+                FROM matched
+                WHERE book.id = matched.id
+                    AND (book.inventory, book.daily_fee)
+                        IS DISTINCT FROM (matched.inventory, matched.daily_fee)
+                RETURNING 1
+            ), inserted AS (
+                INSERT INTO {table} (title, author, cover, inventory, daily_fee)
+                SELECT title, author, cover, inventory, daily_fee
+                FROM incoming
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} AS book
+                    WHERE book.title = incoming.title
+                        AND book.author = incoming.author
+                        AND book.cover = incoming.cover
+                )
+                RETURNING 1
+            )
+            SELECT
+                (SELECT count(*) FROM incoming),
+                (SELECT count(*) FROM updated),
+                (SELECT count(*) FROM inserted)
+            """
+        )
+        incoming, updated, inserted = cursor.fetchone()
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": max(incoming - updated - inserted, 0),
+    }
+
+
+def import_books(stream, fmt: str, batch_size: int = 10000, dry_run: bool = False, on_batch=None) -> dict:
+    """
+    Imports a catalogue stream batch by batch. `on_batch(totals, errors)` is
+    called after every batch with the running totals and that batch's
+    rejected rows. With `dry_run` rows are only validated.
+    """
+    totals = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0}
+    rows = read_rows(stream, fmt)
+    while batch := list(itertools.islice(rows, batch_size)):
+        valid, errors = validate_batch(batch)
+        totals["read"] += len(batch)
+        totals["rejected"] += len(errors)
+        if valid and not dry_run:
+            for key, count in merge_batch(valid).items():
+                totals[key] += count
+        if on_batch is not None:
+            on_batch(totals, errors)
+
+    if not dry_run and (totals["inserted"] or totals["updated"]):
+        invalidate_catalogue()
+    return totals
+
+
+def export_books(stream, fmt: str, chunk_size: int = 10000) -> int:
+    """
+    Writes the catalogue to a text stream ordered by id and returns the
+    number of books written, counting every copy of a book in its
+    inventory. CSV is produced by COPY, JSONL from a server-side cursor.
+    """
+    table = connection.ops.quote_name(Book._meta.db_table)
+    query = (
+        f"SELECT book.id, book.title, book.author, book.cover,"
+        f" book.inventory + {off_shelf_copies()} AS inventory, book.daily_fee"
+        f" FROM {table} AS book ORDER BY book.id"
+    )
+    if fmt == "csv":
+        with connection.cursor() as cursor:
+            with cursor.copy(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+            ) as copy:
+                for data in copy:
+                    stream.write(bytes(data).decode())
+            return cursor.rowcount
+
+    written = 0
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(query)
+        while rows := cursor.fetchmany(chunk_size):
+            for row in rows:
+                book = dict(zip(EXPORT_FIELDS, row))
+                stream.write(json.dumps(book, cls=DjangoJSONEncoder) + "\n")
+            written += len(rows)
+    return written
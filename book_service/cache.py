@@ -0,0 +1,151 @@
+import hashlib
+import json
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+CATALOGUE_VERSION_KEY = "books:catalogue:version"
+HITS_KEY = "books:cache:hits"
+MISSES_KEY = "books:cache:misses"
+
+
+def catalogue_version() -> int:
+    """
+    Returns the current catalogue version, a nanosecond timestamp of the last
+    change that also serves as the Last-Modified time of cached responses.
+    """
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def invalidate_catalogue() -> None:
+    """
+    Invalidates every cached book response. The version is bumped right away
+    and again on commit, so a response cached from a not yet committed state
+    never outlives the transaction.
+    """
+    cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+    transaction.on_commit(
+        lambda: cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+    )
+
+
+def increment(key: str) -> None:
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+
+
+def cache_stats() -> dict:
+    return {
+        "hits": cache.get(HITS_KEY, 0),
+        "misses": cache.get(MISSES_KEY, 0),
+    }
+
+
+def response_cache_key(request, version: int, action: str, **kwargs) -> str:
+    params = urlencode(sorted(request.query_params.items()))
+    lookup = urlencode(sorted(kwargs.items()))
+    digest = hashlib.md5(
+        f"{request.get_host()}|{action}|{lookup}|{params}".encode()
+    ).hexdigest()
+    return f"books:response:{version}:{digest}"
+
+
+def build_entry(data, version: int) -> dict:
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+    return {
+        "data": data,
+        "etag": quote_etag(hashlib.md5(body).hexdigest()),
+        "last_modified": version // 1_000_000_000,
+        "refresh_at": time.time() + settings.BOOK_CACHE_TTL * 0.8,
+    }
+
+
+def get_or_build(key: str, version: int, build) -> tuple[dict, bool]:
+    """
+    Read-through lookup with stampede protection. Only the request holding
+    the lock rebuilds an entry; the rest serve the stale entry while it is
+    refreshed early, or wait for the lock holder when there is none yet.
+    """
+    lock_key = f"{key}:lock"
+    entry = cache.get(key)
+    if entry is not None:
+        if entry["refresh_at"] > time.time():
+            return entry, True
+        if not cache.add(lock_key, 1, settings.BOOK_CACHE_LOCK_TIMEOUT):
+            return entry, True
+    elif not cache.add(lock_key, 1, settings.BOOK_CACHE_LOCK_TIMEOUT):
+        deadline = time.monotonic() + settings.BOOK_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry, True
+
+    try:
+        entry = build_entry(build(), version)
+        cache.set(key, entry, settings.BOOK_CACHE_TTL)
+    finally:
+        cache.delete(lock_key)
+    return entry, False
+
+
+def is_not_modified(request, entry: dict) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return entry["etag"] in [tag.strip() for tag in if_none_match.split(",")]
+    if_modified_since = parse_http_date_safe(
+        request.headers.get("If-Modified-Since", "")
+    )
+    return if_modified_since is not None and (
+        entry["last_modified"] <= if_modified_since
+    )
+
+
+class CachedReadMixin:
+    """
+    Serves `list` and `retrieve` from the cache, keyed by the catalogue
+    version and the query parameters, with ETag/Last-Modified headers.
+    """
+    def cached_response(self, request, build, **kwargs) -> Response:
+        version = catalogue_version()
+        key = response_cache_key(request, version, self.action, **kwargs)
+        entry, hit = get_or_build(key, version, build)
+        increment(HITS_KEY if hit else MISSES_KEY)
+
+        headers = {
+            "ETag": entry["etag"],
+            "Last-Modified": http_date(entry["last_modified"]),
+            "X-Cache": "HIT" if hit else "MISS",
+        }
+        if is_not_modified(request, entry):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(entry["data"], headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get("stream") == "true":
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(
+            request,
+            lambda: super(CachedReadMixin, self).list(request, *args, **kwargs).data,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs).data,
+            **kwargs,
+        )
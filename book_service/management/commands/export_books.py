@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management import BaseCommand
+
+from book_service.bulk import FORMATS, detect_format, export_books
+
+
+class Command(BaseCommand):
+    help = "Stream the book catalogue to a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default="-", help="Output file, or - for stdout"
+        )
+        parser.add_argument("--format", choices=FORMATS)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or detect_format(path)
+        if path == "-":
+            export_books(sys.stdout, fmt)
+            return
+
+        with open(path, "w", newline="", encoding="utf-8") as stream:
+            written = export_books(stream, fmt)
+        self.stdout.write(self.style.SUCCESS(f"Exported {written} books to {path}"))
@@ -0,0 +1,70 @@
+import sys
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from book_service.bulk import FORMATS, detect_format, import_books
+
+
+class Command(BaseCommand):
+    help = (
+        "Import books from a CSV or JSONL file with title, author, cover, "
+        "inventory and daily_fee columns. Books are matched by title, author "
+        "and cover: known ones get their inventory and fee updated, new ones "
+        "are created"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only validate the rows"
+        )
+        parser.add_argument(
+            "--max-errors", type=int, default=20,
+            help="How many rejected rows to print",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or detect_format(path)
+        started = time.perf_counter()
+        printed_errors = 0
+
+        def report(totals, errors):
+            nonlocal printed_errors
+            for error in errors:
+                if printed_errors < options["max_errors"]:
+                    self.stderr.write(f"line {error.line}: {error.message}")
+                printed_errors += 1
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{totals['read']} rows read ({totals['read'] / elapsed:.0f}/s): "
+                f"{totals['inserted']} inserted, {totals['updated']} updated, "
+                f"{totals['unchanged']} unchanged, {totals['rejected']} rejected"
+            )
+
+        try:
+            if path == "-":
+                totals = self.run(sys.stdin, fmt, options, report)
+            else:
+                with open(path, newline="", encoding="utf-8") as stream:
+                    totals = self.run(stream, fmt, options, report)
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        message = f"Imported {totals['inserted'] + totals['updated']} books"
+        if options["dry_run"]:
+            message = f"Validated {totals['read'] - totals['rejected']} books"
+        style = self.style.WARNING if totals["rejected"] else self.style.SUCCESS
+        self.stdout.write(style(f"{message}, {totals['rejected']} rows rejected"))
+
+    def run(self, stream, fmt, options, report):
+        return import_books(
+            stream,
+            fmt,
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            on_batch=report,
+        )
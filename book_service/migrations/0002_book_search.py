@@ -0,0 +1,61 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:11
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """
+    Fuzzy matching needs the pg_trgm contrib extension. It ships with the
+    official Postgres images, but the migration still works without it.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS book_title_trgm_idx "
+            "ON book_service_book USING gin (title gin_trgm_ops)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS book_author_trgm_idx "
+            "ON book_service_book USING gin (author gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX IF EXISTS book_title_trgm_idx")
+        cursor.execute("DROP INDEX IF EXISTS book_author_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.SearchVector(
+                    "title", "author", config="english"
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="book_search_vector_idx"
+            ),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
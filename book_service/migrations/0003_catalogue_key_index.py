@@ -0,0 +1,19 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0002_book_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["title", "author", "cover"], name="book_catalogue_key_idx"
+            ),
+        ),
+    ]
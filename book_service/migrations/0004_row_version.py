@@ -0,0 +1,44 @@
+# Generated by Django 5.0.8 on 2026-10-18 20:22
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0003_catalogue_key_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_default=django.db.models.functions.datetime.Now()
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="version",
+            field=models.PositiveIntegerField(db_default=1, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION bump_row_version() RETURNS trigger AS $$
+            BEGIN
+                NEW.version := OLD.version + 1;
+                NEW.updated_at := now();
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP FUNCTION bump_row_version()",
+        ),
+        migrations.RunSQL(
+            "CREATE TRIGGER book_service_book_version"
+            " BEFORE UPDATE ON book_service_book"
+            " FOR EACH ROW EXECUTE FUNCTION bump_row_version()",
+            "DROP TRIGGER book_service_book_version ON book_service_book",
+        ),
+    ]
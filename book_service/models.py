@@ -1,8 +1,12 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from rest_framework.exceptions import ValidationError
 
+from library_service.versioning import VersionedModel
 
-class Book(models.Model):
+
+class Book(VersionedModel):
     class Cover(models.TextChoices):
         HARD = "HARD"
         SOFT = "SOFT"
@@ -12,6 +16,19 @@ class Book(models.Model):
     cover = models.CharField(max_length=4, choices=Cover.choices)
     inventory = models.IntegerField()
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2)
+    search_vector = models.GeneratedField(
+        expression=SearchVector("title", "author", config="english"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            models.Index(
+                fields=["title", "author", "cover"], name="book_catalogue_key_idx"
+            ),
+        ]
 
     def clean(self):
         if self.daily_fee < 0:
@@ -1,9 +1,10 @@
 from rest_framework import serializers
 
 from book_service.models import Book
+from library_service.serializers import TimedSerializerMixin
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ("id", "title", "author", "cover", "inventory", "daily_fee")
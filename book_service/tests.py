@@ -1,11 +1,31 @@
+import datetime
+import io
+import json
+import threading
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from book_service.bulk import export_books, import_books
 from book_service.models import Book
 from book_service.serializers import BookSerializer
+from book_service.views import trigram_available
+from borrow_service.models import Borrow, WaitlistEntry
+from borrow_service.reservations import take_copy
+from library_service import metrics
+from library_service.db.base import close_pools, pool_stats
 
 books_url = reverse("book_service:book-list")
 
@@ -26,6 +46,7 @@ def detail_url(book_id):
 
 class TestUnauthenticatedUserBooks(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_unauthenticated_user(self):
@@ -35,6 +56,7 @@ class TestUnauthenticatedUserBooks(TestCase):
 
 class TestAuthenticatedUserBook(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             "test123@gmail.com",
@@ -54,6 +76,32 @@ class TestAuthenticatedUserBook(TestCase):
         res = self.client.get(books_url)
         self.assertEqual(len(res.data), 3)
 
+    def test_list_books_cursor_pagination(self):
+        books = [create_book(pk) for pk in range(5)]
+
+        res = self.client.get(books_url, {"page_size": 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]],
+            [books[0].id, books[1].id]
+        )
+
+        res = self.client.get(res.data["next"])
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]],
+            [books[2].id, books[3].id]
+        )
+
+    def test_list_books_streaming(self):
+        books = [create_book(pk) for pk in range(3)]
+
+        res = self.client.get(books_url, {"stream": "true"})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+
+        data = json.loads(b"".join(res.streaming_content))
+        self.assertEqual(data, BookSerializer(books, many=True).data)
+
     def test_retrieve_book_details(self):
         book = create_book(1)
 
@@ -80,6 +128,7 @@ class TestAuthenticatedUserBook(TestCase):
 
 class TestAdminUserBook(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = get_user_model().objects.create_superuser(
             "test123@gmail.com",
@@ -100,3 +149,329 @@ class TestAdminUserBook(TestCase):
         res = self.client.post(books_url, data, format='json')
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+
+class TestBookCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = create_book(1)
+
+    def test_second_read_is_served_from_cache(self):
+        res = self.client.get(books_url)
+        self.assertEqual(res["X-Cache"], "MISS")
+
+        with self.assertNumQueries(0):
+            res = self.client.get(books_url)
+        self.assertEqual(res["X-Cache"], "HIT")
+        self.assertEqual(len(res.data), 1)
+
+    def test_conditional_get_returns_not_modified(self):
+        res = self.client.get(detail_url(self.book.id))
+
+        res = self.client.get(
+            detail_url(self.book.id), HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(
+            detail_url(self.book.id), HTTP_IF_MODIFIED_SINCE=res["Last-Modified"]
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_book_change_invalidates_cache(self):
+        self.client.get(detail_url(self.book.id))
+
+        self.book.title = "new title"
+        self.book.save()
+
+        res = self.client.get(detail_url(self.book.id))
+        self.assertEqual(res["X-Cache"], "MISS")
+        self.assertEqual(res.data["title"], "new title")
+
+    def test_inventory_change_invalidates_cache(self):
+        self.client.get(books_url)
+
+        take_copy(self.book.id)
+
+        res = self.client.get(books_url)
+        self.assertEqual(res["X-Cache"], "MISS")
+        self.assertEqual(res.data[0]["inventory"], 99)
+
+    def test_cache_stats_for_admin(self):
+        self.client.get(books_url)
+        self.client.get(books_url)
+        admin = get_user_model().objects.create_superuser(
+            "admin@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(admin)
+
+        res = self.client.get(reverse("book_service:book-cache-stats"))
+
+        self.assertEqual(res.data, {"hits": 1, "misses": 1})
+
+
+class TestBookSearch(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.dune = Book.objects.create(
+            title="Dune", author="Frank Herbert", cover="HARD", inventory=3, daily_fee=2
+        )
+        self.children = Book.objects.create(
+            title="Children of Dune", author="Frank Herbert", cover="SOFT", inventory=0, daily_fee=1
+        )
+        self.hobbit = Book.objects.create(
+            title="The Hobbit", author="J. R. R. Tolkien", cover="SOFT", inventory=5, daily_fee=3
+        )
+
+    def test_search_title_and_author(self):
+        res = self.client.get(books_url, {"search": "herbert"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["count"], 2)
+        self.assertEqual(
+            {book["id"] for book in res.data["results"]},
+            {self.dune.id, self.children.id}
+        )
+
+    def test_filters_are_paginated(self):
+        res = self.client.get(books_url, {"cover": "soft", "available": "true"})
+
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]], [self.hobbit.id]
+        )
+        self.assertIsNone(res.data["next"])
+
+    def test_daily_fee_range(self):
+        res = self.client.get(books_url, {"min_daily_fee": "1.5", "max_daily_fee": "2.5"})
+
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]], [self.dune.id]
+        )
+
+    def test_invalid_filter(self):
+        res = self.client.get(books_url, {"cover": "paper"})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fuzzy_search(self):
+        if not trigram_available():
+            self.skipTest("pg_trgm extension is not available")
+
+        res = self.client.get(books_url, {"search": "hobit", "fuzzy": "true"})
+
+        self.assertEqual(
+            [book["id"] for book in res.data["results"]], [self.hobbit.id]
+        )
+
+
+class TestRequestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+        self.client = APIClient()
+        create_book(1)
+
+    def test_book_list_is_recorded(self):
+        self.client.get(books_url)
+
+        res = self.client.get(reverse("metrics"))
+        body = res.content.decode()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        labels = '{view="book_service:book-list",method="GET"}'
+        self.assertIn(f"http_request_duration_seconds_count{labels} 1", body)
+        self.assertIn(f"http_request_db_queries_sum{labels} 1", body)
+        self.assertIn(f"http_request_serializer_duration_seconds_count{labels} 1", body)
+
+    async def test_async_requests_are_recorded(self):
+        await self.async_client.get(books_url)
+
+        labels = '{view="book_service:book-list",method="GET"}'
+        body = metrics.render_metrics()
+        self.assertIn(f"http_request_duration_seconds_count{labels} 1", body)
+        self.assertIn(f"http_request_db_queries_sum{labels} 1", body)
+
+    def test_asgi_handler_chain_is_not_adapted(self):
+        # The development-only debug toolbar is sync-only and left out.
+        production = [m for m in settings.MIDDLEWARE if "debug_toolbar" not in m]
+        with override_settings(DEBUG=True, MIDDLEWARE=production):
+            with self.assertNoLogs("django.request", "DEBUG"):
+                ASGIHandler()
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.get(books_url)
+
+        self.assertNotIn("book_service:book-list", metrics.render_metrics())
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_require_token(self):
+        res = self.client.get(reverse("metrics"))
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        res = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class TestConnectionReuse(TransactionTestCase):
+    """
+    Requests go through the real WSGI handler, which closes or keeps the
+    connection at the end of each request like a production server does.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.handler = WSGIHandler()
+        connection.close()
+
+    def request_books(self):
+        cache.clear()
+        environ = {
+            "PATH_INFO": books_url,
+            "HTTP_HOST": "testserver",
+        }
+        setup_testing_defaults(environ)
+        response = self.handler(environ, lambda status, headers: None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+
+    def test_connection_is_kept_between_requests(self):
+        with patch.dict(connection.settings_dict, {"CONN_MAX_AGE": 60}):
+            self.request_books()
+            backend_pid = connection.connection.info.backend_pid
+            self.request_books()
+
+            self.assertEqual(connection.connection.info.backend_pid, backend_pid)
+
+    def test_connection_is_closed_after_request_without_max_age(self):
+        with patch.dict(connection.settings_dict, {"CONN_MAX_AGE": 0}):
+            self.request_books()
+
+            self.assertIsNone(connection.connection)
+
+    def test_pool_is_shared_by_request_threads(self):
+        backend_pids = []
+
+        def record_backend(sender, connection, **kwargs):
+            backend_pids.append(connection.connection.info.backend_pid)
+
+        connection_created.connect(record_backend)
+        try:
+            with patch.dict(connection.settings_dict, {"CONN_MAX_AGE": 0}), \
+                    patch.dict(connection.settings_dict["OPTIONS"], {
+                        "pool": {"min_size": 1, "max_size": 2},
+                    }):
+                for _ in range(3):
+                    thread = threading.Thread(target=self.request_books)
+                    thread.start()
+                    thread.join()
+                stats = pool_stats()["default"]
+                exposition = metrics.render_metrics()
+        finally:
+            connection_created.disconnect(record_backend)
+            close_pools()
+
+        self.assertEqual(len(backend_pids), 3)
+        self.assertEqual(len(set(backend_pids)), 1)
+        self.assertEqual(stats["pool_size"], 1)
+        self.assertIn('db_pool_size{alias="default"} 1', exposition)
+
+
+class TestBulkImportExport(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_import_upserts_by_title_author_and_cover(self):
+        Book.objects.create(
+            title="Dune", author="Herbert", cover="HARD", inventory=1, daily_fee=1
+        )
+        Book.objects.create(
+            title="Emma", author="Austen", cover="SOFT", inventory=4, daily_fee=2
+        )
+        csv_data = io.StringIO(
+            "title,author,cover,inventory,daily_fee\n"
+            "Dune,Herbert,HARD,7,1.50\n"
+            "Dune,Herbert,SOFT,3,1.00\n"
+            "Emma,Austen,soft,4,2\n"
+            "Ulysses,Joyce,HARD,2,0.75\n"
+            "Ulysses,Joyce,HARD,5,0.75\n"
+        )
+
+        totals = import_books(csv_data, "csv", batch_size=2)
+
+        self.assertEqual(totals, {
+            "read": 5, "inserted": 2, "updated": 2, "unchanged": 1, "rejected": 0,
+        })
+        dune = Book.objects.get(title="Dune", cover="HARD")
+        self.assertEqual((dune.inventory, str(dune.daily_fee)), (7, "1.50"))
+        self.assertEqual(Book.objects.get(title="Ulysses").inventory, 5)
+        self.assertEqual(Book.objects.count(), 4)
+        self.assertTrue(Book.objects.filter(search_vector="joyce").exists())
+
+    def test_invalid_rows_are_rejected_with_line_numbers(self):
+        jsonl = io.StringIO(
+            '{"title": "Dune", "author": "Herbert", "cover": "HARD", "inventory": 1, "daily_fee": 1}\n'
+            '{"title": "", "author": "Herbert", "cover": "PAPER", "inventory": -1, "daily_fee": "x"}\n'
+            "not json\n"
+        )
+        rejected = []
+
+        totals = import_books(
+            jsonl, "jsonl", on_batch=lambda totals, errors: rejected.extend(errors)
+        )
+
+        self.assertEqual((totals["inserted"], totals["rejected"]), (1, 2))
+        self.assertEqual([error.line for error in rejected], [2, 3])
+        self.assertIn("cover must be one of", rejected[0].message)
+        self.assertIn("inventory", rejected[0].message)
+
+    def test_import_keeps_copies_off_the_shelf(self):
+        book = create_book(1)
+        user = get_user_model().objects.create_user("reader@gmail.com", "reader123")
+        today = datetime.date.today()
+        for returned in (None, None, today):
+            Borrow.objects.create(
+                book=book, user=user, expected_return_date=today,
+                actual_return_date=returned,
+            )
+        WaitlistEntry.objects.create(book=book, user=user, status="HELD")
+        csv_data = io.StringIO(
+            "title,author,cover,inventory,daily_fee\n"
+            f"{book.title},{book.author},{book.cover},10,{book.daily_fee}\n"
+        )
+
+        import_books(csv_data, "csv")
+
+        # Two copies are on loan and one is held for the waitlist.
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 7)
+        exported = io.StringIO()
+        export_books(exported, "jsonl")
+        self.assertEqual(json.loads(exported.getvalue())["inventory"], 10)
+
+    def test_export_round_trips_through_import(self):
+        for pk in range(3):
+            create_book(pk)
+
+        for fmt in ("csv", "jsonl"):
+            exported = io.StringIO()
+            self.assertEqual(export_books(exported, fmt), 3)
+            exported.seek(0)
+            totals = import_books(exported, fmt)
+            self.assertEqual((totals["read"], totals["unchanged"]), (3, 3))
+
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_import_command_reports_progress(self):
+        out = io.StringIO()
+        with patch("sys.stdin", io.StringIO(
+            "title,author,cover,inventory,daily_fee\nDune,Herbert,HARD,7,1.50\n"
+        )):
+            call_command("import_books", "-", stdout=out)
+
+        self.assertIn("1 inserted", out.getvalue())
+        self.assertTrue(Book.objects.filter(title="Dune").exists())
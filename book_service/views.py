@@ -1,14 +1,56 @@
-from drf_spectacular.utils import extend_schema_view, extend_schema
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Q
+from django.http import Http404
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
+from book_service.cache import CachedReadMixin, cache_stats
 from book_service.models import Book
 from book_service.serializers import BookSerializer
 from book_service.permissions import ReadOnlyOrAdminPermission
+from library_service.pagination import (
+    IdCursorPagination,
+    SearchPagination,
+    StreamingListMixin,
+)
+
+FILTER_PARAMS = ("cover", "available", "min_daily_fee", "max_daily_fee")
+
+
+@lru_cache
+def trigram_available() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def parse_fee(value: str) -> Decimal:
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise Http404("daily fee filters must be numbers")
 
 
 @extend_schema_view(
     list=extend_schema(
-        summary="get list of books, allowed to everyone",
+        summary="get list of books, allowed to everyone. "
+                "Pass `page_size`/`cursor` to paginate or `stream=true` to stream",
+        parameters=[
+            OpenApiParameter("search", OpenApiTypes.STR, description="full-text search in title and author"),
+            OpenApiParameter("fuzzy", OpenApiTypes.BOOL, description="also match misspelled titles and authors"),
+            OpenApiParameter("cover", OpenApiTypes.STR, enum=Book.Cover.values),
+            OpenApiParameter("available", OpenApiTypes.BOOL, description="only books in stock"),
+            OpenApiParameter("min_daily_fee", OpenApiTypes.DECIMAL),
+            OpenApiParameter("max_daily_fee", OpenApiTypes.DECIMAL),
+        ],
     ),
     retrieve=extend_schema(
         summary="retrieve book, allowed to everyone"
@@ -26,11 +68,76 @@ from book_service.permissions import ReadOnlyOrAdminPermission
         summary="delete book, allowed to admins only",
     ),
 )
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CachedReadMixin, StreamingListMixin, viewsets.ModelViewSet):
     """
        A viewset for viewing and editing book instances.
        This viewset provides `list`, `retrieve`, `create`, `update`, and `destroy` actions for Book objects.
+       List and detail responses are served from the cache with ETag/Last-Modified headers.
        """
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = (ReadOnlyOrAdminPermission,)
+    pagination_class = IdCursorPagination
+
+    @property
+    def paginator(self):
+        """
+        Searches are ranked and paginated by offset; filtered lists are always
+        paginated by cursor so a filter never transfers the whole catalogue.
+        """
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params if self.request else {}
+            if params.get("search"):
+                self._paginator = SearchPagination()
+            else:
+                self._paginator = IdCursorPagination()
+                self._paginator.required = any(param in params for param in FILTER_PARAMS)
+        return self._paginator
+
+    def get_queryset(self):
+        """
+        Filters books by the `search`, `cover`, `available`, `min_daily_fee`
+        and `max_daily_fee` query parameters. Searches use the GIN-indexed
+        search vector, plus trigram similarity when `fuzzy=true`.
+        """
+        queryset = Book.objects.defer("search_vector")
+        if self.action != "list":
+            return queryset
+
+        params = self.request.query_params
+        search = params.get("search")
+        if search:
+            query = SearchQuery(search, config="english", search_type="websearch")
+            condition = Q(search_vector=query)
+            if params.get("fuzzy") == "true" and trigram_available():
+                condition |= Q(title__trigram_similar=search)
+                condition |= Q(author__trigram_similar=search)
+            queryset = queryset.filter(condition).annotate(
+                rank=SearchRank("search_vector", query)
+            ).order_by("-rank", "id")
+
+        cover = params.get("cover")
+        if cover is not None:
+            if cover.upper() not in Book.Cover.values:
+                raise Http404("You can pass only HARD or SOFT to cover query parameter")
+            queryset = queryset.filter(cover=cover.upper())
+
+        available = params.get("available")
+        if available == "true":
+            queryset = queryset.filter(inventory__gt=0)
+        elif available == "false":
+            queryset = queryset.filter(inventory=0)
+        elif available is not None:
+            raise Http404("You can pass only true or false to available query parameter")
+
+        if "min_daily_fee" in params:
+            queryset = queryset.filter(daily_fee__gte=parse_fee(params["min_daily_fee"]))
+        if "max_daily_fee" in params:
+            queryset = queryset.filter(daily_fee__lte=parse_fee(params["max_daily_fee"]))
+
+        return queryset
+
+    @extend_schema(summary="book cache hit/miss counters, allowed to admins only")
+    @action(detail=False, methods=["get"], url_path="cache-stats", permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(cache_stats())
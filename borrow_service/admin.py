@@ -1,5 +1,23 @@
 from django.contrib import admin
 
-from borrow_service.models import Borrow
+from borrow_service.models import Borrow, Reservation, WaitlistEntry
 
-admin.site.register(Borrow)
+
+@admin.register(Borrow)
+class BorrowAdmin(admin.ModelAdmin):
+    list_display = (
+        "id", "user", "book", "expected_return_date", "actual_return_date",
+        "accrued_fine",
+    )
+    list_select_related = ("user", "book")
+    readonly_fields = ("accrued_fine", "fine_accrued_on")
+
+
+admin.site.register(Reservation)
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "book", "user", "status", "created_at", "held_until")
+    list_filter = ("status",)
+    list_select_related = ("user", "book")
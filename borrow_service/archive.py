@@ -0,0 +1,140 @@
+"""
+Archiving of borrowing history.
+
+Borrows returned before a horizon, `HISTORY_AFTER_DAYS` ago by default, are
+moved with their payments out of the hot tables into history tables
+partitioned by year, a batch per transaction. Borrows with a payment still
+pending stay until it is settled. `BorrowRecord` and `PaymentRecord` read
+hot and archived rows together, for clients that pass `include_history`.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from borrow_service.models import Borrow, Reservation
+from payments_service.models import Payment
+
+BORROW_HISTORY = "borrow_service_borrow_history"
+PAYMENT_HISTORY = "payments_service_payment_history"
+
+BORROW_COLUMNS = (
+    "id, borrow_date, expected_return_date, actual_return_date, book_id,"
+    " user_id, accrued_fine, fine_accrued_on, version, updated_at"
+)
+PAYMENT_COLUMNS = (
+    "id, status, type, session_url, session_id, money_to_pay, borrowing_id,"
+    " user_id, created_at, version, updated_at"
+)
+
+
+def include_history(request) -> bool:
+    return request.query_params.get("include_history") == "true"
+
+
+def ensure_partitions(cursor, table: str, first_year: int, last_year: int) -> None:
+    """
+    Creates the yearly partitions of a history table that are missing.
+    """
+    quote = connection.ops.quote_name
+    for year in range(first_year, last_year + 1):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote(f'{table}_y{year}')}"
+            f" PARTITION OF {quote(table)}"
+            f" FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+
+
+def archive_batch(before: datetime.date, batch_size: int) -> dict:
+    """
+    Moves up to `batch_size` borrows returned before `before`, oldest first,
+    and all their payments in one transaction. Borrows locked by a running
+    request are skipped and picked up by a later run.
+    """
+    quote = connection.ops.quote_name
+    borrow = quote(Borrow._meta.db_table)
+    payment = quote(Payment._meta.db_table)
+    reservation = quote(Reservation._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT id, actual_return_date FROM {borrow} AS borrow
+            WHERE actual_return_date < %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM {payment} AS payment
+                    WHERE payment.borrowing_id = borrow.id
+                        AND payment.status = 'PENDING'
+                )
+            ORDER BY actual_return_date, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            [before, batch_size],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return {"borrows": 0, "payments": 0}
+        ids = [borrow_id for borrow_id, _ in rows]
+        ensure_partitions(cursor, BORROW_HISTORY, rows[0][1].year, rows[-1][1].year)
+
+        cursor.execute(
+            f"SELECT min(created_at), max(created_at) FROM {payment}"
+            " WHERE borrowing_id = ANY(%s)",
+            [ids],
+        )
+        first, last = cursor.fetchone()
+        if first is not None:
+            # Partition bounds are in the connection's time zone, UTC.
+            ensure_partitions(cursor, PAYMENT_HISTORY, first.year, last.year)
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {payment} AS payment
+                USING {borrow} AS borrow
+                WHERE borrow.id = payment.borrowing_id
+                    AND payment.borrowing_id = ANY(%s)
+                RETURNING payment.*, borrow.user_id
+            )
+            INSERT INTO {quote(PAYMENT_HISTORY)} ({PAYMENT_COLUMNS})
+            SELECT {PAYMENT_COLUMNS} FROM moved
+            """,
+            [ids],
+        )
+        payments = cursor.rowcount
+        cursor.execute(f"DELETE FROM {reservation} WHERE borrow_id = ANY(%s)", [ids])
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {borrow} WHERE id = ANY(%s) RETURNING *
+            )
+            INSERT INTO {quote(BORROW_HISTORY)} ({BORROW_COLUMNS})
+            SELECT {BORROW_COLUMNS} FROM moved
+            """,
+            [ids],
+        )
+        borrows = cursor.rowcount
+    return {"borrows": borrows, "payments": payments}
+
+
+def archive_history(before: datetime.date = None, batch_size: int = None) -> dict:
+    """
+    Archives everything returned before `before` batch by batch. Returns
+    how many borrows and payments were moved, in how many batches.
+    """
+    if before is None:
+        before = timezone.localdate() - datetime.timedelta(
+            days=settings.HISTORY_AFTER_DAYS
+        )
+    batch_size = batch_size or settings.HISTORY_BATCH_SIZE
+    stats = {"borrows": 0, "payments": 0, "batches": 0}
+    while True:
+        moved = archive_batch(before, batch_size)
+        if not moved["borrows"]:
+            break
+        stats["borrows"] += moved["borrows"]
+        stats["payments"] += moved["payments"]
+        stats["batches"] += 1
+        if moved["borrows"] < batch_size:
+            break
+    return stats
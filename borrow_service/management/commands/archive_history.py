@@ -0,0 +1,32 @@
+import datetime
+import time
+
+from django.core.management import BaseCommand
+
+from borrow_service.archive import archive_history
+
+
+class Command(BaseCommand):
+    help = (
+        "Move borrows returned before the history horizon, and their payments, "
+        "from the hot tables into the yearly history partitions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before", type=datetime.date.fromisoformat,
+            help="Archive borrows returned before this date (default: "
+                 "HISTORY_AFTER_DAYS ago)",
+        )
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = archive_history(options["before"], options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {stats['borrows']} borrows and {stats['payments']} "
+                f"payments in {stats['batches']} batches, {elapsed:.2f}s"
+            )
+        )
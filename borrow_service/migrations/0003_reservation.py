@@ -0,0 +1,67 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0001_initial"),
+        ("borrow_service", "0002_alter_borrow_borrow_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Reservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("HELD", "Held"),
+                            ("CONFIRMED", "Confirmed"),
+                            ("RELEASED", "Released"),
+                        ],
+                        default="HELD",
+                        max_length=20,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("expires_at", models.DateTimeField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="book_service.book",
+                    ),
+                ),
+                (
+                    "borrow",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reservation",
+                        to="borrow_service.borrow",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "HELD")),
+                        fields=["expires_at"],
+                        name="reservation_held_expiry_idx",
+                    )
+                ],
+            },
+        ),
+    ]
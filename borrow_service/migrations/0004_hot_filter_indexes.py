@@ -0,0 +1,46 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0001_initial"),
+        ("borrow_service", "0003_reservation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrow",
+            index=models.Index(fields=["user", "id"], name="borrow_user_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="borrow",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["user", "id"],
+                name="borrow_active_user_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrow",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["expected_return_date"],
+                name="borrow_active_due_idx",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="borrow",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.8 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0004_hot_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrow",
+            name="accrued_fine",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name="borrow",
+            name="fine_accrued_on",
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
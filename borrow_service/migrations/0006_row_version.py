@@ -0,0 +1,33 @@
+# Generated by Django 5.0.8 on 2026-10-18 20:22
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0004_row_version"),
+        ("borrow_service", "0005_accrued_fine"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrow",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_default=django.db.models.functions.datetime.Now()
+            ),
+        ),
+        migrations.AddField(
+            model_name="borrow",
+            name="version",
+            field=models.PositiveIntegerField(db_default=1, editable=False),
+        ),
+        migrations.RunSQL(
+            "CREATE TRIGGER borrow_service_borrow_version"
+            " BEFORE UPDATE ON borrow_service_borrow"
+            " FOR EACH ROW EXECUTE FUNCTION bump_row_version()",
+            "DROP TRIGGER borrow_service_borrow_version ON borrow_service_borrow",
+        ),
+    ]
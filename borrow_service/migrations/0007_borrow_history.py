@@ -0,0 +1,89 @@
+# Generated by Django 5.0.8 on 2026-10-18 20:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+COLUMNS = (
+    "id, borrow_date, expected_return_date, actual_return_date, book_id,"
+    " user_id, accrued_fine, fine_accrued_on, version, updated_at"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_service", "0004_row_version"),
+        ("borrow_service", "0006_row_version"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Partitions by year of return are created by the archiving job as
+        # it needs them. No foreign keys, so archived rows never block
+        # deletes of the hot tables.
+        migrations.RunSQL(
+            """
+            CREATE TABLE borrow_service_borrow_history (
+                id bigint NOT NULL,
+                borrow_date date NOT NULL,
+                expected_return_date date NOT NULL,
+                actual_return_date date NOT NULL,
+                book_id bigint NOT NULL,
+                user_id bigint NOT NULL,
+                accrued_fine numeric(10, 2) NOT NULL,
+                fine_accrued_on date,
+                version integer NOT NULL,
+                updated_at timestamp with time zone NOT NULL,
+                archived_at timestamp with time zone NOT NULL DEFAULT now(),
+                PRIMARY KEY (id, actual_return_date)
+            ) PARTITION BY RANGE (actual_return_date);
+            CREATE INDEX borrow_history_user_idx
+                ON borrow_service_borrow_history (user_id, id);
+            """,
+            "DROP TABLE borrow_service_borrow_history",
+        ),
+        migrations.RunSQL(
+            f"""
+            CREATE VIEW borrow_service_borrow_record AS
+                SELECT {COLUMNS}, false AS archived FROM borrow_service_borrow
+                UNION ALL
+                SELECT {COLUMNS}, true FROM borrow_service_borrow_history
+            """,
+            "DROP VIEW borrow_service_borrow_record",
+        ),
+        migrations.CreateModel(
+            name="BorrowRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("borrow_date", models.DateField()),
+                ("expected_return_date", models.DateField()),
+                ("actual_return_date", models.DateField(blank=True, null=True)),
+                ("accrued_fine", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("fine_accrued_on", models.DateField(blank=True, null=True)),
+                ("version", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField()),
+                ("archived", models.BooleanField()),
+            ],
+            options={
+                "db_table": "borrow_service_borrow_record",
+                "managed": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="borrow",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", False)),
+                fields=["actual_return_date"],
+                name="borrow_returned_idx",
+            ),
+        ),
+    ]
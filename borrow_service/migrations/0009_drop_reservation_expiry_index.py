@@ -0,0 +1,17 @@
+# Generated by Django 5.0.8 on 2026-10-18 21:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0008_waitlist"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="reservation",
+            name="reservation_held_expiry_idx",
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.8 on 2026-10-18 21:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0009_drop_reservation_expiry_index"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="reservation",
+            name="expires_at",
+        ),
+    ]
@@ -1,15 +1,140 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Q
 
 from book_service.models import Book
+from library_service.versioning import VersionedModel
 
 
-class Borrow(models.Model):
+class Borrow(VersionedModel):
     borrow_date = models.DateField(auto_now_add=True)
     expected_return_date = models.DateField()
     actual_return_date = models.DateField(null=True, blank=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_index=False
+    )
+    accrued_fine = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fine_accrued_on = models.DateField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="borrow_user_idx"),
+            models.Index(
+                fields=["user", "id"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrow_active_user_idx",
+            ),
+            models.Index(
+                fields=["expected_return_date"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrow_active_due_idx",
+            ),
+            models.Index(
+                fields=["actual_return_date"],
+                condition=Q(actual_return_date__isnull=False),
+                name="borrow_returned_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.borrow_date} - {self.user} - {self.actual_return_date}"
+
+
+class Reservation(models.Model):
+    """
+    A copy of a book held for a borrow while its payment is pending.
+    The copy is taken off the shelf when the hold is placed and is either
+    confirmed by a successful payment or put back when the hold is released.
+    Holds of payments left pending past `PAYMENT_HOLD_TTL` are released by
+    the expired payment sweep.
+    """
+    class Status(models.TextChoices):
+        HELD = "HELD"
+        CONFIRMED = "CONFIRMED"
+        RELEASED = "RELEASED"
+
+    borrow = models.OneToOneField(
+        Borrow, on_delete=models.CASCADE, related_name="reservation"
+    )
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.HELD
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.book} - {self.status}"
+
+
+class WaitlistEntry(models.Model):
+    """
+    A patron queued for a book that is out of stock. Returned copies go to
+    the oldest waiting entry, which holds the copy until `held_until`; the
+    patron borrows it through the usual checkout, otherwise it passes on.
+    """
+    class Status(models.TextChoices):
+        WAITING = "WAITING"
+        HELD = "HELD"
+        FULFILLED = "FULFILLED"
+        EXPIRED = "EXPIRED"
+        CANCELLED = "CANCELLED"
+
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "user"],
+                condition=Q(status__in=["WAITING", "HELD"]),
+                name="waitlist_one_open_entry",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["book", "id"],
+                condition=Q(status="WAITING"),
+                name="waitlist_waiting_idx",
+            ),
+            models.Index(
+                fields=["held_until"],
+                condition=Q(status="HELD"),
+                name="waitlist_held_expiry_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.book} - {self.user} - {self.status}"
+
+
+class BorrowRecord(models.Model):
+    """
+    Read-only view of every borrow: the hot `Borrow` table together with the
+    history partitions returned borrows are archived into, flagged by
+    `archived`. Only queried when a client asks for its history.
+    """
+    borrow_date = models.DateField()
+    expected_return_date = models.DateField()
+    actual_return_date = models.DateField(null=True, blank=True)
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, related_name="+")
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.DO_NOTHING, related_name="+"
+    )
+    accrued_fine = models.DecimalField(max_digits=10, decimal_places=2)
+    fine_accrued_on = models.DateField(null=True, blank=True)
+    version = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = "borrow_service_borrow_record"
 
     def __str__(self):
         return f"{self.borrow_date} - {self.user} - {self.actual_return_date}"
@@ -0,0 +1,237 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from book_service.cache import invalidate_catalogue
+from book_service.models import Book
+from borrow_service.models import Borrow, Reservation, WaitlistEntry
+from notifications_service.views import queue_telegram_message
+from user_service.summary import adjust_summary
+
+
+def take_copies(book_id: int, count: int = 1) -> bool:
+    """
+    Takes copies of a book off the shelf with a single conditional UPDATE.
+    Returns False when fewer copies are left, so inventory never goes negative.
+    """
+    taken = Book.objects.filter(
+        pk=book_id, inventory__gte=count
+    ).update(inventory=F("inventory") - count) == 1
+    if taken:
+        invalidate_catalogue()
+    return taken
+
+
+def take_copy(book_id: int) -> bool:
+    return take_copies(book_id)
+
+
+def held_message(holds: list) -> str:
+    return "\n".join(
+        f"{email}\nhas `{title}` on hold till "
+        f"{timezone.localtime(held_until):%Y-%m-%d %H:%M}"
+        for email, title, held_until in holds
+    )
+
+
+def allocate_copies(book_id: int, count: int) -> int:
+    """
+    Puts up to `count` copies of a book on hold for the patrons waiting
+    longest with a single locked UPDATE and notifies them. Entries locked by
+    a concurrent cancellation are skipped. Returns how many copies were
+    allocated; the caller owns the rest.
+    """
+    quote = connection.ops.quote_name
+    entry = quote(WaitlistEntry._meta.db_table)
+    user = quote(get_user_model()._meta.db_table)
+    book = quote(Book._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH next AS (
+                SELECT id FROM {entry}
+                WHERE book_id = %(book_id)s AND status = 'WAITING'
+                ORDER BY id
+                LIMIT %(count)s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {entry} AS entry
+            SET status = 'HELD', held_until = %(held_until)s
+            FROM next, {user} AS account, {book} AS book
+            WHERE entry.id = next.id
+                AND account.id = entry.user_id
+                AND book.id = entry.book_id
+            RETURNING account.email, book.title, entry.held_until
+            """,
+            {
+                "book_id": book_id,
+                "count": count,
+                "held_until": timezone.now() + settings.WAITLIST_HOLD_TTL,
+            },
+        )
+        holds = cursor.fetchall()
+    if holds:
+        queue_telegram_message(held_message(holds))
+    return len(holds)
+
+
+def claim_held_copy(book_id: int, user_id: int) -> bool:
+    """
+    Turns the user's live hold on a book into the copy of a new borrow.
+    """
+    return WaitlistEntry.objects.filter(
+        book_id=book_id,
+        user_id=user_id,
+        status=WaitlistEntry.Status.HELD,
+        held_until__gt=timezone.now(),
+    ).update(status=WaitlistEntry.Status.FULFILLED) == 1
+
+
+def put_back_copies(book_id: int, count: int = 1) -> None:
+    """
+    Hands copies of a book to the patrons waiting for it and puts the rest
+    back on the shelf with a single UPDATE.
+    """
+    count -= allocate_copies(book_id, count)
+    if count:
+        Book.objects.filter(pk=book_id).update(inventory=F("inventory") + count)
+        invalidate_catalogue()
+
+
+def reserve_book(book_id: int, **borrow_fields) -> Borrow | None:
+    """
+    Holds a copy of the book for a new borrow until its payment completes,
+    the copy the user holds from the waitlist if any. Returns None when the
+    book is out of stock.
+    """
+    with transaction.atomic():
+        claimed = claim_held_copy(book_id, borrow_fields["user"].pk)
+        if not claimed and not take_copy(book_id):
+            return None
+        borrow = Borrow.objects.create(book_id=book_id, **borrow_fields)
+        Reservation.objects.create(borrow=borrow, book_id=book_id)
+        adjust_summary(borrow.user_id, active=1, lifetime=1)
+    return borrow
+
+
+def reserve_books(book_ids: list[int], **borrow_fields) -> list[Borrow] | None:
+    """
+    Holds one copy per listed book for new borrows, all or nothing: returns
+    None and holds nothing when any of them is out of stock. A book may be
+    listed more than once. Copies the user holds from the waitlist are used
+    first.
+    """
+    user_id = borrow_fields["user"].pk
+    with transaction.atomic():
+        # Books are updated in id order so concurrent batches cannot deadlock.
+        for book_id, count in sorted(Counter(book_ids).items()):
+            count -= claim_held_copy(book_id, user_id)
+            if count and not take_copies(book_id, count):
+                transaction.set_rollback(True)
+                return None
+        borrows = Borrow.objects.bulk_create(
+            Borrow(book_id=book_id, **borrow_fields) for book_id in book_ids
+        )
+        Reservation.objects.bulk_create(
+            Reservation(borrow=borrow, book_id=borrow.book_id) for borrow in borrows
+        )
+        adjust_summary(borrows[0].user_id, active=len(borrows), lifetime=len(borrows))
+    return borrows
+
+
+def confirm_holds(borrows: list[Borrow]) -> int:
+    """
+    Turns the holds of a batch of paid borrows into confirmed reservations
+    with one UPDATE. Borrows created before holds existed take their copies
+    at this point, one UPDATE per book. Returns the number of confirmed holds.
+    """
+    borrow_ids = [borrow.pk for borrow in borrows]
+    with transaction.atomic():
+        confirmed = Reservation.objects.filter(
+            borrow_id__in=borrow_ids, status=Reservation.Status.HELD
+        ).update(status=Reservation.Status.CONFIRMED)
+        if confirmed < len(borrow_ids):
+            reserved = set(
+                Reservation.objects.filter(borrow_id__in=borrow_ids)
+                .values_list("borrow_id", flat=True)
+            )
+            unreserved = Counter(
+                borrow.book_id for borrow in borrows if borrow.pk not in reserved
+            )
+            for book_id, count in sorted(unreserved.items()):
+                take_copies(book_id, count)
+    return confirmed
+
+
+def release_holds(borrows: list[Borrow]) -> int:
+    """
+    Releases the pending holds of a batch of borrows with one UPDATE and puts
+    their copies back with one UPDATE per book. Returns the number released.
+    """
+    with transaction.atomic():
+        held = list(
+            Reservation.objects.select_for_update()
+            .filter(
+                borrow_id__in=[borrow.pk for borrow in borrows],
+                status=Reservation.Status.HELD,
+            )
+            .values_list("id", "book_id")
+        )
+        Reservation.objects.filter(
+            id__in=[reservation_id for reservation_id, _ in held]
+        ).update(status=Reservation.Status.RELEASED)
+        for book_id, count in sorted(Counter(book_id for _, book_id in held).items()):
+            put_back_copies(book_id, count)
+    return len(held)
+
+
+def return_copy(borrow: Borrow, return_date) -> bool:
+    """
+    Marks a borrow as returned and puts its copy back on the shelf.
+    Returns False if the borrow has already been returned.
+    """
+    with transaction.atomic():
+        returned = Borrow.objects.filter(
+            pk=borrow.pk, actual_return_date__isnull=True
+        ).update(actual_return_date=return_date)
+        if returned:
+            put_back_copies(borrow.book_id)
+            adjust_summary(
+                borrow.user_id,
+                active=-1,
+                overdue=-int(borrow.expected_return_date < return_date),
+            )
+    borrow.actual_return_date = return_date
+    return bool(returned)
+
+
+def return_copies(borrows: list[Borrow], return_date) -> list[int]:
+    """
+    Marks a batch of borrows as returned with one UPDATE and puts their copies
+    back with one UPDATE per book. Returns the ids of the borrows that were
+    still out; already returned ones are skipped.
+    """
+    with transaction.atomic():
+        returning = list(
+            Borrow.objects.select_for_update()
+            .filter(pk__in=[borrow.pk for borrow in borrows], actual_return_date__isnull=True)
+            .values_list("id", "book_id", "user_id", "expected_return_date")
+        )
+        returned_ids = [row[0] for row in returning]
+        Borrow.objects.filter(pk__in=returned_ids).update(actual_return_date=return_date)
+        for book_id, count in sorted(Counter(row[1] for row in returning).items()):
+            put_back_copies(book_id, count)
+        returned_by_user = Counter(row[2] for row in returning)
+        overdue_by_user = Counter(row[2] for row in returning if row[3] < return_date)
+        for user_id, count in returned_by_user.items():
+            adjust_summary(user_id, active=-count, overdue=-overdue_by_user[user_id])
+    returned = set(returned_ids)
+    for borrow in borrows:
+        if borrow.pk in returned:
+            borrow.actual_return_date = return_date
+    return returned_ids
+
@@ -1,11 +1,18 @@
+import datetime
+
+from django.conf import settings
 from rest_framework import serializers
 
+from book_service.models import Book
 from book_service.serializers import BookSerializer
-from borrow_service.models import Borrow
+from borrow_service.models import Borrow, WaitlistEntry
+from library_service.serializers import EagerLoadingMixin, TimedSerializerMixin
 
 
-class BorrowListSerializer(serializers.ModelSerializer):
+class BorrowListSerializer(TimedSerializerMixin, EagerLoadingMixin, serializers.ModelSerializer):
     book_title = serializers.CharField(source="book.title")
+    select_related_fields = ("book",)
+    deferred_fields = ("book__search_vector",)
 
     class Meta:
         model = Borrow
@@ -19,9 +26,11 @@ class BorrowListSerializer(serializers.ModelSerializer):
         )
 
 
-class BorrowRetrieveSerializer(serializers.ModelSerializer):
+class BorrowRetrieveSerializer(TimedSerializerMixin, EagerLoadingMixin, serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     user = serializers.StringRelatedField(read_only=True)
+    select_related_fields = ("book", "user")
+    deferred_fields = ("book__search_vector",)
 
     class Meta:
         model = Borrow
@@ -35,10 +44,60 @@ class BorrowRetrieveSerializer(serializers.ModelSerializer):
         )
 
 
-class BorrowCreateSerializer(serializers.ModelSerializer):
+class BorrowCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Borrow
         fields = ("book", "expected_return_date")
 
     def create(self, validated_data):
         return Borrow.objects.create(**validated_data)
+
+
+class BorrowBulkCreateSerializer(serializers.Serializer):
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.BULK_BORROW_LIMIT,
+    )
+    expected_return_date = serializers.DateField()
+
+    def validate_books(self, book_ids):
+        books = Book.objects.defer("search_vector").in_bulk(set(book_ids))
+        missing = sorted(set(book_ids) - set(books))
+        if missing:
+            raise serializers.ValidationError(f"Unknown books: {missing}")
+        self.context["books"] = books
+        return book_ids
+
+    def validate_expected_return_date(self, value):
+        if value <= datetime.date.today():
+            raise serializers.ValidationError("Expected return date must be in the future")
+        return value
+
+
+class BorrowBulkReturnSerializer(serializers.Serializer):
+    borrows = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.BULK_BORROW_LIMIT,
+    )
+
+
+class WaitlistEntrySerializer(TimedSerializerMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    book_title = serializers.CharField(source="book.title", read_only=True)
+    position = serializers.IntegerField(read_only=True, allow_null=True)
+    select_related_fields = ("book",)
+    deferred_fields = ("book__search_vector",)
+
+    class Meta:
+        model = WaitlistEntry
+        fields = (
+            "id",
+            "book",
+            "book_title",
+            "status",
+            "position",
+            "created_at",
+            "held_until",
+        )
+        read_only_fields = ("status", "created_at", "held_until")
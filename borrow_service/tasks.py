@@ -0,0 +1,45 @@
+import logging
+import time
+
+from celery import shared_task
+from django.conf import settings
+
+from borrow_service.archive import archive_history as archive
+from borrow_service.fines import accrue_fines
+from borrow_service.waitlist import expire_waitlist_holds as expire_holds
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def accrue_overdue_fines() -> dict:
+    """
+    Stores the current fine of every overdue active borrow.
+    """
+    started = time.monotonic()
+    stats = accrue_fines(chunk_size=settings.FINE_ACCRUAL_CHUNK_SIZE)
+    stats["duration_s"] = round(time.monotonic() - started, 3)
+    logger.info("Fine accrual: %s", stats)
+    return stats
+
+
+@shared_task
+def archive_history() -> dict:
+    """
+    Moves borrows returned before the history horizon to the history tables.
+    """
+    started = time.monotonic()
+    stats = archive()
+    stats["duration_s"] = round(time.monotonic() - started, 3)
+    logger.info("History archiving: %s", stats)
+    return stats
+
+
+@shared_task
+def expire_waitlist_holds() -> dict:
+    """
+    Passes waitlist holds nobody claimed in time on to the next patrons.
+    """
+    stats = expire_holds()
+    logger.info("Waitlist holds: %s", stats)
+    return stats
@@ -1,18 +1,46 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from book_service.models import Book
-from borrow_service.models import Borrow
+from borrow_service.archive import archive_history
+from borrow_service.fines import accrue_fines
+from borrow_service.models import Borrow, BorrowRecord, Reservation, WaitlistEntry
+from borrow_service.reservations import (
+    reserve_book,
+    return_copy,
+)
+from borrow_service.waitlist import expire_waitlist_holds
+from library_service.benchmark import compare, run_benchmark
+from library_service.testing import QueryBudgetMixin
+from notifications_service.models import Notification
+from payments_service.gateway import FakeStripeGateway
+from payments_service.models import Payment, PaymentRecord
+from payments_service.tasks import create_combined_checkout_session
+from user_service.models import BorrowingSummary
+from user_service.summary import rebuild_summaries
 
 borrows_url = reverse("borrow_service:borrows")
+bulk_borrow_url = reverse("borrow_service:borrows-bulk")
+bulk_return_url = reverse("borrow_service:borrows-bulk-return")
+waitlist_url = reverse("borrow_service:waitlist")
 
 
 def create_borrow(book, user) -> Borrow:
-    time = timezone.now()
+    time = timezone.localdate()
     return Borrow.objects.create(
         borrow_date=time,
         expected_return_date=time,
@@ -88,3 +116,667 @@ class TestAuthenticatedUserBorrow(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         res = self.client.get(url3)
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestBorrowQueryBudget(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.borrows = []
+
+    def seed(self, size):
+        for _ in range(size):
+            book = create_book(len(self.borrows))
+            self.borrows.append(create_borrow(book, self.user))
+
+    def test_list_borrows(self):
+        self.assertQueryBudget(1, lambda: self.client.get(borrows_url), self.seed)
+
+    def test_retrieve_borrow(self):
+        self.assertQueryBudget(
+            1, lambda: self.client.get(detail_url(self.borrows[-1].pk)), self.seed
+        )
+
+
+class TestConditionalReads(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = create_book(1)
+        self.borrow = create_borrow(self.book, self.user)
+
+    def conditional_get(self, url, etag, **params):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        return res, len(queries)
+
+    def test_every_update_bumps_the_row_version(self):
+        self.assertEqual(self.borrow.version, 1)
+
+        Borrow.objects.filter(pk=self.borrow.pk).update(actual_return_date=None)
+        self.book.inventory = 99
+        self.book.save()
+
+        self.borrow.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(self.borrow.version, 2)
+        self.assertEqual(self.book.version, 2)
+
+    def test_unchanged_borrow_is_not_modified(self):
+        url = detail_url(self.borrow.pk)
+        res = self.client.get(url)
+        etag = res["ETag"]
+
+        res, queries = self.conditional_get(url, etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+        self.assertEqual(queries, 1)
+
+        # The response renders the book, so its stock changes the borrow too.
+        Book.objects.filter(pk=self.book.pk).update(inventory=99)
+        res, _ = self.conditional_get(url, etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["book"]["inventory"], 99)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_unchanged_list_page_is_not_modified(self):
+        create_borrow(create_book(2), self.user)
+        res = self.client.get(borrows_url, {"page_size": 1})
+        etag = res["ETag"]
+
+        res, queries = self.conditional_get(borrows_url, etag, page_size=1)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(queries, 1)
+        # Another page has another ETag.
+        res, _ = self.conditional_get(borrows_url, etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 2)
+
+        list_etag = res["ETag"]
+        create_borrow(self.book, self.user)
+        res, _ = self.conditional_get(borrows_url, list_etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 3)
+
+
+class TestReservations(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.book = create_book(1)
+        self.return_date = datetime.date.today() + datetime.timedelta(days=3)
+
+    def test_reserve_book_takes_copy(self):
+        borrow = reserve_book(
+            self.book.id, user=self.user, expected_return_date=self.return_date
+        )
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 99)
+        self.assertEqual(borrow.reservation.status, Reservation.Status.HELD)
+
+    def test_reserve_out_of_stock_book(self):
+        Book.objects.filter(pk=self.book.pk).update(inventory=0)
+
+        borrow = reserve_book(
+            self.book.id, user=self.user, expected_return_date=self.return_date
+        )
+
+        self.assertIsNone(borrow)
+        self.assertFalse(Borrow.objects.exists())
+
+    def test_return_copy_only_once(self):
+        borrow = create_borrow(self.book, self.user)
+        Borrow.objects.filter(pk=borrow.pk).update(actual_return_date=None)
+
+        self.assertTrue(return_copy(borrow, datetime.date.today()))
+        self.assertFalse(return_copy(borrow, datetime.date.today()))
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 101)
+
+
+class TestConcurrentReservations(TransactionTestCase):
+    def test_parallel_borrows_never_oversell(self):
+        user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        book = create_book(1)
+        Book.objects.filter(pk=book.pk).update(inventory=25)
+        return_date = datetime.date.today() + datetime.timedelta(days=3)
+
+        def borrow_book(_):
+            try:
+                return reserve_book(
+                    book.id, user=user, expected_return_date=return_date
+                ) is not None
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(borrow_book, range(300)))
+
+        book.refresh_from_db()
+        self.assertEqual(results.count(True), 25)
+        self.assertEqual(book.inventory, 0)
+        self.assertEqual(Reservation.objects.filter(book=book).count(), 25)
+
+
+class TestHotFilterQueryPlans(TestCase):
+    """
+    Seeds a large, mostly returned borrow history and asserts that the hot
+    list and report filters are answered from their indexes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"user{i}@gmail.com") for i in range(200)
+        )
+        books = [create_book(pk) for pk in range(20)]
+        today = datetime.date.today()
+        borrows = Borrow.objects.bulk_create(
+            Borrow(
+                expected_return_date=today + datetime.timedelta(days=i % 30 - 15),
+                actual_return_date=None if i % 50 == 0 else today,
+                book=books[i % len(books)],
+                user=users[i % len(users)],
+            )
+            for i in range(20000)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                status="PENDING" if borrow.actual_return_date is None else "PAID",
+                type="PAYMENT",
+                borrowing=borrow,
+                session_id=f"cs_{borrow.id}",
+                money_to_pay=2,
+            )
+            for borrow in borrows
+        )
+        cls.user = users[0]
+        cls.borrow = borrows[0]
+        cls.payment = Payment.objects.get(borrowing=cls.borrow)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "ANALYZE borrow_service_borrow, payments_service_payment"
+            )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_active_borrows_of_user(self):
+        self.assertUsesIndex(
+            Borrow.objects.filter(
+                user=self.user, actual_return_date__isnull=True
+            ).order_by("id"),
+            "borrow_active_user_idx",
+        )
+
+    def test_borrows_of_user(self):
+        self.assertUsesIndex(
+            Borrow.objects.filter(user=self.user).order_by("id"),
+            "borrow_user_idx",
+        )
+
+    def test_borrows_due_for_daily_report(self):
+        self.assertUsesIndex(
+            Borrow.objects.filter(
+                expected_return_date__lte=datetime.date.today() + datetime.timedelta(days=1),
+                actual_return_date__isnull=True,
+            ),
+            "borrow_active_due_idx",
+        )
+
+    def test_payments_of_borrow_by_status(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(borrowing=self.borrow, status="PENDING"),
+            "payment_borrowing_status_idx",
+        )
+
+    def test_pending_payments_of_checkout_session(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(
+                Q(pk=self.payment.pk)
+                | Q(session_id=self.payment.session_id, status="PENDING")
+            ),
+            "payment_pending_session_idx",
+        )
+
+    def test_pending_payments_of_webhook_batch(self):
+        sessions = Payment.objects.filter(status="PENDING").values_list(
+            "session_id", flat=True
+        )[:50]
+        self.assertUsesIndex(
+            Payment.objects.filter(session_id__in=list(sessions), status="PENDING"),
+            "payment_pending_session_idx",
+        )
+
+
+class TestLifecycleBenchmark(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_runs_every_step_of_the_lifecycle(self):
+        report = run_benchmark(
+            users=2, books=3, borrows=4, payments=4, lifecycles=3, concurrency=1
+        )
+
+        self.assertEqual(report["lifecycles"], 3)
+        self.assertEqual(report["steps"]["borrow-create"]["count"], 3)
+        self.assertEqual(report["steps"]["fine-success"]["count"], 3)
+        self.assertEqual(report["steps"]["worker:checkout-session"]["count"], 6)
+        self.assertGreater(report["throughput_rps"], 0)
+        self.assertGreaterEqual(report["telegram_messages"], 1)
+        self.assertEqual(Borrow.objects.filter(actual_return_date__isnull=True).count(), 0)
+        self.assertEqual(Payment.objects.filter(status="PAID").count(), 4 + 6)
+
+    def test_compare_flags_regressions(self):
+        baseline = {
+            "throughput_rps": 100,
+            "steps": {"borrow-create": {
+                "p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "mean_queries": 9,
+            }},
+        }
+        report = {
+            "throughput_rps": 95,
+            "steps": {"borrow-create": {
+                "p50_ms": 11, "p95_ms": 40, "p99_ms": 30, "mean_queries": 10,
+            }},
+        }
+
+        regressed = {
+            row["metric"] for row in compare(report, baseline, tolerance=20)
+            if row["regressed"]
+        }
+
+        self.assertEqual(
+            regressed, {"borrow-create p95_ms", "borrow-create mean_queries"}
+        )
+
+
+@override_settings(PAYMENT_GATEWAY="payments_service.gateway.FakeStripeGateway")
+class TestBulkBorrowing(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.books = [create_book(pk) for pk in range(3)]
+        self.due = datetime.date.today() + datetime.timedelta(days=5)
+
+    def bulk_borrow(self, book_ids):
+        with patch(
+            "payments_service.views.create_combined_checkout_session.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                bulk_borrow_url,
+                {"books": book_ids, "expected_return_date": self.due},
+                format="json",
+            )
+        return res, delay
+
+    def test_bulk_borrow_shares_one_checkout(self):
+        book_ids = [book.id for book in self.books] + [self.books[0].id]
+
+        res, delay = self.bulk_borrow(book_ids)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        payment_ids = [payment["id"] for payment in res.data]
+        self.assertEqual(len(payment_ids), 4)
+        delay.assert_called_once_with(payment_ids)
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].inventory, 98)
+
+        session_id = create_combined_checkout_session(payment_ids)
+        self.assertEqual(
+            set(Payment.objects.values_list("session_id", flat=True)), {session_id}
+        )
+        session = next(
+            entry for entry in FakeStripeGateway.sessions.values()
+            if entry["session"].id == session_id
+        )
+        self.assertEqual(len(session["line_items"]), 4)
+
+        res = self.client.get(
+            reverse("payment_service:payments-success", args=[payment_ids[0]])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Payment.objects.filter(status="PAID").count(), 4)
+        self.assertEqual(
+            Reservation.objects.filter(status=Reservation.Status.CONFIRMED).count(), 4
+        )
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertIn("has borrowed 4 books", Notification.objects.get().text)
+
+    def test_bulk_borrow_is_all_or_nothing(self):
+        self.books[2].inventory = 0
+        self.books[2].save()
+
+        res, delay = self.bulk_borrow([book.id for book in self.books])
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        delay.assert_not_called()
+        self.assertFalse(Borrow.objects.exists())
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].inventory, 100)
+
+    def test_bulk_borrow_rejects_unknown_books(self):
+        res, _ = self.bulk_borrow([self.books[0].id, 999999])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_return_returns_on_time_and_fines_late_borrows(self):
+        today = datetime.date.today()
+        on_time = [
+            Borrow.objects.create(book=book, user=self.user, expected_return_date=self.due)
+            for book in self.books[:2]
+        ]
+        late = [
+            Borrow.objects.create(
+                book=self.books[2], user=self.user,
+                expected_return_date=today - datetime.timedelta(days=days),
+            )
+            for days in (1, 3)
+        ]
+
+        with patch(
+            "payments_service.views.create_combined_checkout_session.delay"
+        ) as delay, patch(
+            "notifications_service.views.deliver_notifications.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                bulk_return_url,
+                {"borrows": [borrow.id for borrow in on_time + late]},
+                format="json",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(res.data["returned"]), 2)
+        fine_ids = [fine["id"] for fine in res.data["fines"]]
+        self.assertEqual(
+            [fine["money_to_pay"] for fine in res.data["fines"]], ["2.00", "6.00"]
+        )
+        delay.assert_called_once_with(fine_ids)
+        self.assertEqual(
+            Borrow.objects.filter(actual_return_date=today).count(), 2
+        )
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].inventory, 101)
+
+        create_combined_checkout_session(fine_ids)
+        res = self.client.get(reverse("payment_service:fine-success", args=[fine_ids[0]]))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Borrow.objects.filter(actual_return_date__isnull=True).exists())
+        self.books[2].refresh_from_db()
+        self.assertEqual(self.books[2].inventory, 102)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_bulk_return_of_someone_elses_borrow(self):
+        other = get_user_model().objects.create_user("other@gmail.com", "other123")
+        borrow = Borrow.objects.create(
+            book=self.books[0], user=other, expected_return_date=self.due
+        )
+
+        res = self.client.post(bulk_return_url, {"borrows": [borrow.id]}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestFineAccrual(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = create_book(1)
+        self.today = datetime.date.today()
+
+    def borrow(self, days_overdue, returned=False) -> Borrow:
+        return Borrow.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_return_date=self.today - datetime.timedelta(days=days_overdue),
+            actual_return_date=self.today if returned else None,
+        )
+
+    def fines(self, *borrows) -> list:
+        return [
+            (borrow.accrued_fine, borrow.fine_accrued_on)
+            for borrow in Borrow.objects.filter(pk__in=[b.pk for b in borrows]).order_by("id")
+        ]
+
+    def test_accrues_overdue_active_borrows_in_chunks(self):
+        late = self.borrow(3)
+        later = self.borrow(1)
+        on_time = self.borrow(0)
+        returned = self.borrow(5, returned=True)
+
+        stats = accrue_fines(self.today, chunk_size=1)
+
+        self.assertEqual(stats, {"borrows": 2, "chunks": 2})
+        self.assertEqual(
+            self.fines(late, later, on_time, returned),
+            [
+                (Decimal("6.00"), self.today),
+                (Decimal("2.00"), self.today),
+                (Decimal("0.00"), None),
+                (Decimal("0.00"), None),
+            ],
+        )
+        self.assertEqual(accrue_fines(self.today)["borrows"], 0)
+
+        tomorrow = self.today + datetime.timedelta(days=1)
+        self.assertEqual(accrue_fines(tomorrow)["borrows"], 3)
+        self.assertEqual(self.fines(late)[0], (Decimal("8.00"), tomorrow))
+
+    def test_return_charges_the_accrued_fine(self):
+        late = self.borrow(3)
+        accrue_fines(self.today)
+        Borrow.objects.filter(pk=late.pk).update(accrued_fine=5)
+
+        with patch("payments_service.views.create_checkout_session.delay"):
+            res = self.client.post(
+                reverse("borrow_service:return_borrowed_book", args=[late.id])
+            )
+
+        self.assertEqual(res.data["money_to_pay"], "5.00")
+
+
+class TestHistoryArchive(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = create_book(1)
+        self.today = datetime.date.today()
+        self.horizon = self.today - datetime.timedelta(days=365)
+
+    def borrow(self, returned_days_ago, payment_status="PAID") -> Borrow:
+        returned = self.today - datetime.timedelta(days=returned_days_ago)
+        borrow = Borrow.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_return_date=returned,
+            actual_return_date=returned,
+        )
+        Reservation.objects.create(
+            borrow=borrow,
+            book=self.book,
+            status=Reservation.Status.CONFIRMED,
+        )
+        payment = Payment.objects.create(
+            status=payment_status,
+            type="PAYMENT",
+            borrowing=borrow,
+            money_to_pay=10,
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=returned_days_ago)
+        )
+        return borrow
+
+    def test_moves_old_returned_borrows_in_batches(self):
+        old = self.borrow(800)
+        older = self.borrow(1200)
+        pending = self.borrow(900, payment_status="PENDING")
+        recent = self.borrow(30)
+
+        stats = archive_history(self.horizon, batch_size=1)
+
+        self.assertEqual(stats, {"borrows": 2, "payments": 2, "batches": 2})
+        self.assertEqual(
+            set(Borrow.objects.values_list("id", flat=True)), {pending.id, recent.id}
+        )
+        self.assertFalse(Reservation.objects.filter(borrow__in=[old.id, older.id]).exists())
+        self.assertEqual(
+            list(
+                BorrowRecord.objects.order_by("id").values_list("id", "archived")
+            ),
+            [(old.id, True), (older.id, True), (pending.id, False), (recent.id, False)],
+        )
+        archived = PaymentRecord.objects.get(borrowing=old.id)
+        self.assertEqual((archived.user_id, archived.archived), (self.user.id, True))
+        self.assertEqual(archive_history(self.horizon)["borrows"], 0)
+
+    def test_history_is_read_only_when_asked(self):
+        old = self.borrow(800)
+        recent = self.borrow(30)
+        archive_history(self.horizon)
+
+        res = self.client.get(borrows_url, {"page_size": 10})
+        self.assertEqual([row["id"] for row in res.data["results"]], [recent.id])
+        res = self.client.get(
+            borrows_url, {"include_history": "true", "page_size": 10}
+        )
+        self.assertEqual(
+            [row["id"] for row in res.data["results"]], [old.id, recent.id]
+        )
+
+        self.assertEqual(self.client.get(detail_url(old.id)).status_code, 404)
+        res = self.client.get(detail_url(old.id), {"include_history": "true"})
+        self.assertEqual(res.data["book"]["title"], self.book.title)
+
+        payments_url = reverse("payment_service:payments-list")
+        res = self.client.get(
+            payments_url, {"include_history": "true", "page_size": 10}
+        )
+        self.assertEqual(
+            [row["borrowing"] for row in res.data["results"]], [old.id, recent.id]
+        )
+
+    def test_summary_keeps_counting_archived_borrows(self):
+        self.borrow(800)
+        self.borrow(30)
+        archive_history(self.horizon)
+
+        rebuild_summaries([self.user.id])
+
+        summary = BorrowingSummary.objects.get(user=self.user)
+        self.assertEqual(summary.lifetime_borrows, 2)
+
+
+class TestWaitlist(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        users = get_user_model().objects
+        self.reader = users.create_user("reader@gmail.com", "test123")
+        self.first = users.create_user("first@gmail.com", "test123")
+        self.second = users.create_user("second@gmail.com", "test123")
+        self.book = create_book(1)
+        Book.objects.filter(pk=self.book.pk).update(inventory=1)
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.borrow = reserve_book(
+            self.book.id, user=self.reader, expected_return_date=self.tomorrow
+        )
+
+    def join(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(waitlist_url, {"book": self.book.id})
+
+    def entry(self, user) -> WaitlistEntry:
+        return WaitlistEntry.objects.filter(user=user).latest("id")
+
+    def inventory(self) -> int:
+        return Book.objects.get(pk=self.book.pk).inventory
+
+    def test_returned_copy_is_held_for_the_longest_waiting(self):
+        self.assertEqual(self.join(self.first).data["position"], 1)
+        res = self.join(self.second)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((res.data["status"], res.data["position"]), ("WAITING", 2))
+        self.assertEqual(self.join(self.second).data["id"], res.data["id"])
+
+        return_copy(self.borrow, datetime.date.today())
+
+        self.assertEqual(self.inventory(), 0)
+        self.assertEqual(self.entry(self.first).status, WaitlistEntry.Status.HELD)
+        self.assertIn("first@gmail.com", Notification.objects.latest("id").text)
+        res = self.client.get(waitlist_url)
+        self.assertEqual((res.data[0]["status"], res.data[0]["position"]), ("WAITING", 1))
+
+        self.assertIsNone(
+            reserve_book(self.book.id, user=self.second, expected_return_date=self.tomorrow)
+        )
+        self.assertIsNotNone(
+            reserve_book(self.book.id, user=self.first, expected_return_date=self.tomorrow)
+        )
+        self.assertEqual(self.entry(self.first).status, WaitlistEntry.Status.FULFILLED)
+
+    def test_unclaimed_hold_passes_on_then_goes_back_on_the_shelf(self):
+        self.join(self.first)
+        self.join(self.second)
+        return_copy(self.borrow, datetime.date.today())
+
+        later = timezone.now() + settings.WAITLIST_HOLD_TTL
+        self.assertEqual(expire_waitlist_holds(later), {"expired": 1, "allocated": 0})
+        self.assertEqual(self.entry(self.first).status, WaitlistEntry.Status.EXPIRED)
+        self.assertEqual(self.entry(self.second).status, WaitlistEntry.Status.HELD)
+
+        self.client.force_authenticate(self.second)
+        res = self.client.delete(
+            reverse("borrow_service:waitlist-leave", args=[self.entry(self.second).id])
+        )
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.inventory(), 1)
+
+    def test_joining_with_copies_on_the_shelf_holds_one(self):
+        Book.objects.filter(pk=self.book.pk).update(inventory=1)
+
+        res = self.join(self.first)
+
+        self.assertEqual(res.data["status"], "HELD")
+        self.assertEqual(self.inventory(), 0)
+
+    def test_restocked_copies_go_to_waiting_patrons(self):
+        self.join(self.first)
+        Book.objects.filter(pk=self.book.pk).update(inventory=3)
+
+        self.assertEqual(expire_waitlist_holds(), {"expired": 0, "allocated": 1})
+        self.assertEqual(self.entry(self.first).status, WaitlistEntry.Status.HELD)
+        self.assertEqual(self.inventory(), 2)
@@ -3,13 +3,21 @@ from django.urls import path
 from borrow_service.views import (
     BorrowListView,
     BorrowRetrieveView,
+    WaitlistView,
+    bulk_borrow,
+    bulk_return,
+    leave_book_waitlist,
     return_borrowed_book
 )
 
 urlpatterns = [
     path("borrows/", BorrowListView.as_view(), name="borrows"),
     path("borrows/<int:pk>/", BorrowRetrieveView.as_view(), name="borrows"),
+    path("borrows/bulk/", bulk_borrow, name="borrows-bulk"),
+    path("borrows/bulk/return/", bulk_return, name="borrows-bulk-return"),
     path("borrow/<int:borrow_id>/return/", return_borrowed_book, name="return_borrowed_book"),
+    path("waitlist/", WaitlistView.as_view(), name="waitlist"),
+    path("waitlist/<int:entry_id>/", leave_book_waitlist, name="waitlist-leave"),
 ]
 
 app_name = "borrow_service"
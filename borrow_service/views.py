@@ -1,24 +1,55 @@
 import datetime
 
-from django.conf import settings
+from adrf.decorators import api_view as async_api_view
+from adrf.generics import GenericAPIView as AsyncGenericAPIView
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.http import Http404
-from drf_spectacular.utils import extend_schema_view, extend_schema
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema_view, extend_schema
 from rest_framework import mixins, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.generics import GenericAPIView, get_object_or_404
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from book_service.models import Book
-from borrow_service.models import Borrow
+from borrow_service.archive import include_history
+from borrow_service.fines import fine_for
+from borrow_service.models import Borrow, BorrowRecord, WaitlistEntry
+from borrow_service.reservations import (
+    reserve_book,
+    reserve_books,
+    return_copies,
+    return_copy,
+)
 from borrow_service.serializers import (
     BorrowListSerializer,
-    BorrowRetrieveSerializer, BorrowCreateSerializer
+    BorrowRetrieveSerializer, BorrowCreateSerializer,
+    BorrowBulkCreateSerializer,
+    BorrowBulkReturnSerializer,
+    WaitlistEntrySerializer,
 )
-from notifications_service.views import send_message_to_telegram_group
+from borrow_service.waitlist import OPEN, join_waitlist, leave_waitlist, with_positions
+from library_service.pagination import IdCursorPagination, StreamingListMixin
+from library_service.versioning import ConditionalReadMixin
+from notifications_service.views import queue_telegram_message
 from payments_service.models import Payment
-from payments_service.views import create_payment_session, create_fine_session
+from payments_service.serializers import PaymentListSerializer
+from payments_service.settlement import returned_message
+from payments_service.views import schedule_checkout, start_checkout
+from user_service.summary import adjust_summary
+
+OUT_OF_STOCK = "No such books available, join the waitlist to get the next copy"
+
+HISTORY_PARAMETER = OpenApiParameter(
+    "include_history",
+    OpenApiTypes.BOOL,
+    description="Also read borrows that were moved to the history tables",
+)
 
 
 @extend_schema_view(
@@ -30,9 +61,11 @@ from payments_service.views import create_payment_session, create_fine_session
     ),
 )
 class BorrowListView(
+    ConditionalReadMixin,
+    StreamingListMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
-    GenericAPIView
+    AsyncGenericAPIView
 ):
     """
         A view for listing and creating borrow instances.
@@ -40,18 +73,25 @@ class BorrowListView(
         This view handles two actions:
             - Listing all the borrow records for the authenticated user.
             - Creating a new borrow instance for an authenticated user.
+
+        Its handlers are async, so under ASGI they run on the event loop and
+        only the database work is handed to a thread.
     """
     queryset = Borrow.objects.all()
     serializer = BorrowListSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
+    etag_fields = ("version", "book__version")
 
     def get_queryset(self):
         """
         Retrieves the queryset of borrow records. If the user is not an admin,
         it returns only the records associated with the user. It can be further filtered
-        by the `is_active` query parameter to show active or inactive borrow records.
+        by the `is_active` query parameter to show active or inactive borrow records,
+        and with `include_history=true` archived borrows are listed too.
         """
-        queryset = Borrow.objects.all().select_related("book")
+        model = BorrowRecord if include_history(self.request) else Borrow
+        queryset = BorrowListSerializer.setup_eager_loading(model.objects.all())
         if not self.request.user.is_staff:
             queryset = queryset.filter(user=self.request.user)
         else:
@@ -83,36 +123,49 @@ class BorrowListView(
 
     @extend_schema(
         summary="list all your borrows",
+        parameters=[HISTORY_PARAMETER],
         responses={200: BorrowListSerializer(many=True)}
     )
-    def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.list)(request, *args, **kwargs)
 
     @extend_schema(
-        summary="create new borrow",
-        responses={200: BorrowCreateSerializer(many=True)}
+        summary="create new borrow, the Stripe checkout is prepared in the background",
+        responses={202: PaymentListSerializer(many=False)}
     )
-    def post(self, request, *args, **kwargs):
-        book = Book.objects.get(pk=request.data["book"])
-        if book.inventory > 0:
-            serializer = BorrowCreateSerializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.validated_data["user"] = request.user
-            borrow = serializer.save()
-            year, month, day = map(int, request.data["expected_return_date"].split("-"))
-            date = datetime.date(year, month, day)
+    async def post(self, request, *args, **kwargs):
+        serializer = BorrowCreateSerializer(data=request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        return await sync_to_async(self.reserve)(
+            request.user,
+            serializer.validated_data["book"],
+            serializer.validated_data["expected_return_date"],
+        )
+
+    def reserve(self, user, book, expected_return_date) -> Response:
+        """
+        Holds a copy of the book and creates its pending payment in one
+        transaction, then schedules the checkout.
+        """
+        with transaction.atomic():
+            borrow = reserve_book(
+                book.id,
+                user=user,
+                expected_return_date=expected_return_date,
+            )
+            if borrow is None:
+                raise Http404(OUT_OF_STOCK)
             payment = Payment.objects.create(
                 status="PENDING",
                 type="PAYMENT",
                 borrowing=borrow,
-                money_to_pay=(date - datetime.date.today()).days * book.daily_fee
+                money_to_pay=(expected_return_date - datetime.date.today()).days * book.daily_fee
             )
-            return create_payment_session(payment)
-
-        raise Http404("No such books available")
+        return start_checkout(payment)
 
 
 class BorrowRetrieveView(
+    ConditionalReadMixin,
     mixins.RetrieveModelMixin,
     GenericAPIView
 ):
@@ -122,15 +175,23 @@ class BorrowRetrieveView(
     """
     serializer_class = BorrowRetrieveSerializer
     permission_classes = (IsAuthenticated,)
+    etag_fields = ("version", "book__version", "user__email")
+
+    def get_queryset(self):
+        model = BorrowRecord if include_history(self.request) else Borrow
+        return self.get_serializer_class().setup_eager_loading(
+            model.objects.filter(user=self.request.user)
+        )
 
     def get_object(self):
         try:
-            return Borrow.objects.filter(user=self.request.user).get(id=self.kwargs["pk"])
+            return self.get_queryset().get(id=self.kwargs["pk"])
         except Exception:
             raise Http404
 
     @extend_schema(
         summary="retrieve one of your borrows",
+        parameters=[HISTORY_PARAMETER],
         responses={200: BorrowCreateSerializer(many=True)}
     )
     def get(self, request, *args, **kwargs):
@@ -141,39 +202,224 @@ class BorrowRetrieveView(
     summary="return one of books that you taken",
     responses={200: BorrowCreateSerializer(many=True)}
 )
-@api_view(["GET", "POST"])
+@async_api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
-def return_borrowed_book(request: Request, borrow_id: int) -> Response:
+async def return_borrowed_book(request: Request, borrow_id: int) -> Response:
     """
     Handles the return process for a borrowed book.
     It checks whether the borrow instance belongs to the authenticated user and calculates
     potential fines if the book is returned late. It updates the borrow record with the actual
     return date and sends a notification to a Telegram group.
     """
-    borrow = get_object_or_404(Borrow, id=borrow_id)
-    if borrow.user != request.user:
+    borrow = await aget_object_or_404(
+        BorrowRetrieveSerializer.setup_eager_loading(Borrow.objects.all()),
+        id=borrow_id,
+    )
+    if borrow.user_id != request.user.id:
         raise Http404("You do not have such borrow")
+    if borrow.actual_return_date is not None:
+        raise ValidationError("This book has already been returned")
 
     today_date = datetime.date.today()
 
     if borrow.expected_return_date < today_date:
-        payment = Payment.objects.create(
+        return await sync_to_async(fine_borrow)(borrow, today_date)
+    await sync_to_async(return_borrow)(borrow, today_date)
+    serializer = BorrowRetrieveSerializer(borrow)
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+def fine_borrow(borrow: Borrow, today_date: datetime.date) -> Response:
+    """
+    Creates the pending fine of a late return, once, and schedules its checkout.
+    """
+    with transaction.atomic():
+        payment, created = Payment.objects.get_or_create(
             status="PENDING",
             type="FINE",
             borrowing=borrow,
-            money_to_pay=
-            settings.FINE_MULTIPLIER * (
-                    today_date - borrow.expected_return_date
-            ).days
+            defaults={"money_to_pay": fine_for(borrow, today_date)}
         )
-        return create_fine_session(payment)
-    book = borrow.book
-    book.inventory += 1
-    book.save()
-    borrow.actual_return_date = today_date
-    borrow.save()
-    serializer = BorrowRetrieveSerializer(borrow)
-    send_message_to_telegram_group(
-        f"{request.user.email}\nhas returned book: `{book.title}`\nexpected return date is : {borrow.expected_return_date}\nactual return date is : {borrow.actual_return_date}"
+        if created:
+            adjust_summary(borrow.user_id, unpaid_fines=payment.money_to_pay)
+    return start_checkout(payment)
+
+
+def return_borrow(borrow: Borrow, today_date: datetime.date) -> None:
+    with transaction.atomic():
+        return_copy(borrow, today_date)
+        queue_telegram_message(
+            f"{borrow.user.email}\nhas returned book: `{borrow.book.title}`\nexpected return date is : {borrow.expected_return_date}\nactual return date is : {borrow.actual_return_date}"
+        )
+
+
+@extend_schema(
+    summary="borrow several books at once with a single Stripe checkout",
+    request=BorrowBulkCreateSerializer,
+    responses={202: PaymentListSerializer(many=True)}
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def bulk_borrow(request: Request) -> Response:
+    """
+    Reserves a copy of every listed book in one transaction, all or nothing,
+    and prepares one Stripe checkout with a line item per book.
+    """
+    serializer = BorrowBulkCreateSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    books = serializer.context["books"]
+    expected_return_date = serializer.validated_data["expected_return_date"]
+    days = (expected_return_date - datetime.date.today()).days
+    with transaction.atomic():
+        borrows = reserve_books(
+            serializer.validated_data["books"],
+            user=request.user,
+            expected_return_date=expected_return_date,
+        )
+        if borrows is None:
+            raise Http404(OUT_OF_STOCK)
+        payments = Payment.objects.bulk_create(
+            Payment(
+                status="PENDING",
+                type="PAYMENT",
+                borrowing=borrow,
+                money_to_pay=days * books[borrow.book_id].daily_fee,
+            )
+            for borrow in borrows
+        )
+        location = schedule_checkout(payments)
+    return Response(
+        PaymentListSerializer(payments, many=True).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": location},
     )
-    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+@extend_schema(
+    summary="return several books at once, late ones share one fine checkout",
+    request=BorrowBulkReturnSerializer,
+    responses={202: BorrowRetrieveSerializer(many=True)}
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def bulk_return(request: Request) -> Response:
+    """
+    Returns every listed borrow that is on time in one transaction and sends
+    a single notification. Overdue borrows get fines paid through one
+    combined Stripe checkout and are returned once it succeeds.
+    """
+    serializer = BorrowBulkReturnSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    borrow_ids = set(serializer.validated_data["borrows"])
+    borrows = list(
+        BorrowRetrieveSerializer.setup_eager_loading(
+            Borrow.objects.filter(user=request.user, id__in=borrow_ids)
+        ).order_by("id")
+    )
+    if len(borrows) != len(borrow_ids):
+        raise Http404("You do not have such borrow")
+    if any(borrow.actual_return_date is not None for borrow in borrows):
+        raise ValidationError("Some of these books have already been returned")
+
+    today_date = datetime.date.today()
+    on_time = [borrow for borrow in borrows if borrow.expected_return_date >= today_date]
+    late = [borrow for borrow in borrows if borrow.expected_return_date < today_date]
+    headers = {}
+    with transaction.atomic():
+        if on_time:
+            return_copies(on_time, today_date)
+            queue_telegram_message(returned_message(on_time))
+        fines = []
+        if late:
+            pending = {
+                payment.borrowing_id: payment
+                for payment in Payment.objects.filter(
+                    status="PENDING", type="FINE", borrowing__in=late
+                )
+            }
+            created = Payment.objects.bulk_create(
+                Payment(
+                    status="PENDING",
+                    type="FINE",
+                    borrowing=borrow,
+                    money_to_pay=fine_for(borrow, today_date),
+                )
+                for borrow in late
+                if borrow.id not in pending
+            )
+            if created:
+                adjust_summary(
+                    request.user.id,
+                    unpaid_fines=sum(fine.money_to_pay for fine in created),
+                )
+            fines = list(pending.values()) + created
+            fines.sort(key=lambda fine: fine.id)
+            # Fines that already have a checkout keep it, so nothing is
+            # charged twice.
+            without_checkout = [fine for fine in fines if not fine.session_id]
+            if without_checkout:
+                headers["Location"] = schedule_checkout(without_checkout)
+            else:
+                headers["Location"] = reverse(
+                    "payment_service:payments-checkout", args=[fines[0].id]
+                )
+    return Response(
+        {
+            "returned": BorrowRetrieveSerializer(on_time, many=True).data,
+            "fines": PaymentListSerializer(fines, many=True).data,
+        },
+        status=status.HTTP_202_ACCEPTED,
+        headers=headers,
+    )
+
+
+class WaitlistView(mixins.ListModelMixin, GenericAPIView):
+    """
+    A view for listing the authenticated user's open waitlist entries and
+    joining the waitlist of a book that is out of stock. Returned copies are
+    put on hold for the patrons waiting longest, who are notified, so
+    clients do not need to poll for availability.
+    """
+    serializer_class = WaitlistEntrySerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return with_positions(
+            WaitlistEntrySerializer.setup_eager_loading(
+                WaitlistEntry.objects.filter(
+                    user=self.request.user, status__in=OPEN
+                ).order_by("id")
+            )
+        )
+
+    @extend_schema(
+        summary="list your places on waitlists and your held copies",
+        responses={200: WaitlistEntrySerializer(many=True)}
+    )
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+    @extend_schema(
+        summary="join the waitlist of a book, a copy on the shelf is held for you at once",
+        responses={201: WaitlistEntrySerializer(many=False)}
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = WaitlistEntrySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        entry = join_waitlist(serializer.validated_data["book"].id, request.user.id)
+        entry = self.get_queryset().get(pk=entry.pk)
+        return Response(
+            WaitlistEntrySerializer(entry).data, status=status.HTTP_201_CREATED
+        )
+
+
+@extend_schema(
+    summary="leave a waitlist, a copy held for you passes on to the next patron",
+    responses={204: None}
+)
+@api_view(["DELETE"])
+@permission_classes([IsAuthenticated])
+def leave_book_waitlist(request: Request, entry_id: int) -> Response:
+    if not leave_waitlist(entry_id, request.user.id):
+        raise Http404("You are not on such waitlist")
+    return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,129 @@
+"""
+Waitlists for books that are out of stock.
+
+Copies coming back through `put_back_copies`, from returns, abandoned
+checkouts and expired holds alike, first go to the patrons waiting longest
+for the book: `allocate_copies` locks their entries and puts the copies on
+hold for `WAITLIST_HOLD_TTL` in one statement, and they are told through
+the notification outbox. Only copies nobody waits for go back on the
+shelf. A hold is claimed by borrowing the book, or passes on to the next
+patron when it runs out.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from book_service.models import Book
+from borrow_service.models import WaitlistEntry
+from borrow_service.reservations import (
+    allocate_copies,
+    put_back_copies,
+    take_copies,
+    take_copy,
+)
+
+OPEN = (WaitlistEntry.Status.WAITING, WaitlistEntry.Status.HELD)
+
+
+def join_waitlist(book_id: int, user_id: int) -> WaitlistEntry:
+    """
+    Queues the user for a book, or returns their open entry for it. A book
+    with copies on the shelf is put on hold for them right away.
+    """
+    entry = WaitlistEntry.objects.filter(
+        book_id=book_id, user_id=user_id, status__in=OPEN
+    ).first()
+    if entry is not None:
+        return entry
+    try:
+        with transaction.atomic():
+            if take_copy(book_id):
+                return WaitlistEntry.objects.create(
+                    book_id=book_id,
+                    user_id=user_id,
+                    status=WaitlistEntry.Status.HELD,
+                    held_until=timezone.now() + settings.WAITLIST_HOLD_TTL,
+                )
+            return WaitlistEntry.objects.create(book_id=book_id, user_id=user_id)
+    except IntegrityError:
+        # A concurrent request of the same user queued them first.
+        return WaitlistEntry.objects.get(
+            book_id=book_id, user_id=user_id, status__in=OPEN
+        )
+
+
+def leave_waitlist(entry_id: int, user_id: int) -> bool:
+    """
+    Cancels an open entry of the user. A copy they held passes on to the
+    next patron. Returns False when there is no such open entry.
+    """
+    with transaction.atomic():
+        entry = (
+            WaitlistEntry.objects.select_for_update()
+            .filter(pk=entry_id, user_id=user_id, status__in=OPEN)
+            .first()
+        )
+        if entry is None:
+            return False
+        WaitlistEntry.objects.filter(pk=entry.pk).update(
+            status=WaitlistEntry.Status.CANCELLED
+        )
+        if entry.status == WaitlistEntry.Status.HELD:
+            put_back_copies(entry.book_id)
+    return True
+
+
+def with_positions(queryset):
+    """
+    Annotates waiting entries with their place in the queue of their book,
+    counted on the partial index of waiting entries.
+    """
+    ahead = (
+        WaitlistEntry.objects.filter(
+            book=OuterRef("book"),
+            status=WaitlistEntry.Status.WAITING,
+            id__lte=OuterRef("id"),
+        )
+        .values("book")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return queryset.annotate(position=Subquery(ahead))
+
+
+def expire_waitlist_holds(now=None) -> dict:
+    """
+    Expires the holds nobody claimed in time and passes their copies on.
+    Copies that reached the shelf while patrons were waiting, e.g. added by
+    staff or an import, are allocated to them as well.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = list(
+            WaitlistEntry.objects.select_for_update(skip_locked=True)
+            .filter(status=WaitlistEntry.Status.HELD, held_until__lte=now)
+            .values_list("id", "book_id")
+        )
+        WaitlistEntry.objects.filter(
+            id__in=[entry_id for entry_id, _ in expired]
+        ).update(status=WaitlistEntry.Status.EXPIRED)
+        for book_id, count in sorted(Counter(book_id for _, book_id in expired).items()):
+            put_back_copies(book_id, count)
+
+    allocated = 0
+    waiting = WaitlistEntry.objects.filter(
+        book=OuterRef("pk"), status=WaitlistEntry.Status.WAITING
+    )
+    stocked = Book.objects.filter(Exists(waiting), inventory__gt=0)
+    for book_id in stocked.values_list("id", flat=True):
+        with transaction.atomic():
+            # The book row stays locked, so the copies are still there to take.
+            book = Book.objects.select_for_update().only("inventory").get(pk=book_id)
+            taken = allocate_copies(book_id, book.inventory)
+            if taken:
+                take_copies(book_id, taken)
+                allocated += taken
+    return {"expired": len(expired), "allocated": allocated}
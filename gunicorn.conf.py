@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for the production profile.
+
+`SERVER_INTERFACE=wsgi` (default) runs `library_service.wsgi` on threaded
+workers, `SERVER_INTERFACE=asgi` runs `library_service.asgi` on uvicorn
+workers. Worker counts can be tuned with `WEB_CONCURRENCY` and
+`WEB_THREADS`.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+if os.environ.get("SERVER_INTERFACE", "wsgi") == "asgi":
+    wsgi_app = "library_service.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "library_service.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.environ.get("WEB_THREADS", 4))
+
+# Recycle workers now and then so a slow leak cannot grow forever; the
+# jitter keeps them from restarting all at once.
+max_requests = 2000
+max_requests_jitter = 200
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
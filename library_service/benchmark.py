@@ -0,0 +1,674 @@
+"""
+Load-test harness for the borrow-to-payment lifecycle.
+
+Virtual patrons drive the real URL routes concurrently: list books, borrow
+one, pay for it, return it and pay the fine of an overdue borrow. Stripe is
+replaced by `FakeStripeGateway` and Telegram by `TelegramStubServer`. Celery
+tasks are published to an in-memory broker and the harness runs them itself
+in place of a worker, so each request is measured on its own.
+"""
+import asyncio
+import datetime
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+import requests as http_requests
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from book_service.models import Book
+from borrow_service.models import Borrow
+from borrow_service.reservations import reserve_book
+from library_service.celery import app as celery_app
+from notifications_service.models import Notification
+from notifications_service.tasks import deliver_notifications
+from notifications_service.telegram_stub import TelegramStubServer
+from payments_service.gateway import FakeStripeGateway
+from payments_service.models import Payment
+from payments_service.tasks import create_checkout_session, process_event_batch
+from payments_service.webhooks import receive_event, sign_payload
+
+PERCENTILES = (50, 95, 99)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values: list, pct: int) -> float:
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+def latency_percentiles(seconds: list) -> dict:
+    latencies = [elapsed * 1000 for elapsed in seconds]
+    return {
+        f"p{pct}_ms": round(percentile(latencies, pct), 2) for pct in PERCENTILES
+    }
+
+
+class Recorder:
+    """
+    Collects the latency and query count of every measured step.
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples.setdefault(name, []).append((elapsed, len(queries)))
+
+    def summary(self, wall_time: float, lifecycles: int) -> dict:
+        steps = {}
+        for name, samples in sorted(self.samples.items()):
+            queries = [count for _, count in samples]
+            steps[name] = {
+                "count": len(samples),
+                **latency_percentiles([elapsed for elapsed, _ in samples]),
+                "mean_queries": round(sum(queries) / len(queries), 2),
+                "max_queries": max(queries),
+            }
+        requests = sum(
+            step["count"] for name, step in steps.items()
+            if not name.startswith("worker:")
+        )
+        return {
+            "lifecycles": lifecycles,
+            "wall_time_s": round(wall_time, 3),
+            "throughput_rps": round(requests / wall_time, 2),
+            "lifecycles_per_s": round(lifecycles / wall_time, 2),
+            "steps": steps,
+        }
+
+
+def seed(users: int, books: int, borrows: int, payments: int, overdue: int) -> dict:
+    """
+    Bulk-creates the benchmark dataset: returned `borrows` with `payments`
+    paid payments as history, and `overdue` active borrows that are returned
+    late during the run, one per lifecycle.
+    """
+    today = datetime.date.today()
+    password = make_password("benchmark")
+    user_objs = get_user_model().objects.bulk_create(
+        get_user_model()(email=f"bench-user-{i}@example.com", password=password)
+        for i in range(users)
+    )
+    book_objs = Book.objects.bulk_create(
+        Book(
+            title=f"Benchmark book {i}",
+            author=f"Benchmark author {i % 50}",
+            cover=Book.Cover.HARD if i % 2 else Book.Cover.SOFT,
+            inventory=overdue + 10,
+            daily_fee=1,
+        )
+        for i in range(books)
+    )
+    history = Borrow.objects.bulk_create(
+        Borrow(
+            book=book_objs[i % books],
+            user=user_objs[i % users],
+            expected_return_date=today - datetime.timedelta(days=7),
+            actual_return_date=today - datetime.timedelta(days=7),
+        )
+        for i in range(borrows)
+    )
+    if history:
+        Payment.objects.bulk_create(
+            Payment(
+                status=Payment.Status.PAID,
+                type=Payment.Type.PAYMENT,
+                borrowing=history[i % borrows],
+                money_to_pay=7,
+            )
+            for i in range(payments)
+        )
+    late = Borrow.objects.bulk_create(
+        Borrow(
+            book=book_objs[i % books],
+            user=user_objs[i % users],
+            expected_return_date=today - datetime.timedelta(days=3),
+        )
+        for i in range(overdue)
+    )
+    return {
+        "users": user_objs,
+        "book_ids": [book.id for book in book_objs],
+        "overdue": late,
+    }
+
+
+def expect(response, expected_status: int, step: str):
+    if response.status_code != expected_status:
+        raise BenchmarkError(
+            f"{step} answered {response.status_code} instead of "
+            f"{expected_status}: {getattr(response, 'data', response.content)}"
+        )
+    return response
+
+
+def run_lifecycle(index: int, dataset: dict, recorder: Recorder) -> None:
+    """
+    One patron's journey through the API, as a client would make it.
+    """
+    rng = random.Random(index)
+    overdue_borrow = dataset["overdue"][index]
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(overdue_borrow.user)}"
+    )
+
+    with recorder.step("books-list"):
+        expect(client.get(reverse("book_service:book-list")), status.HTTP_200_OK, "books-list")
+
+    with recorder.step("borrow-create"):
+        response = expect(
+            client.post(
+                reverse("borrow_service:borrows"),
+                {
+                    "book": rng.choice(dataset["book_ids"]),
+                    "expected_return_date": datetime.date.today() + datetime.timedelta(days=7),
+                },
+            ),
+            status.HTTP_202_ACCEPTED,
+            "borrow-create",
+        )
+    payment_id = response.data["id"]
+    borrow_id = response.data["borrowing"]
+
+    with recorder.step("worker:checkout-session"):
+        create_checkout_session(payment_id)
+
+    with recorder.step("payment-checkout"):
+        expect(
+            client.get(reverse("payment_service:payments-checkout", args=[payment_id])),
+            status.HTTP_302_FOUND,
+            "payment-checkout",
+        )
+
+    with recorder.step("payment-success"):
+        expect(
+            client.get(reverse("payment_service:payments-success", args=[payment_id])),
+            status.HTTP_201_CREATED,
+            "payment-success",
+        )
+
+    with recorder.step("borrow-return"):
+        expect(
+            client.get(reverse("borrow_service:return_borrowed_book", args=[borrow_id])),
+            status.HTTP_202_ACCEPTED,
+            "borrow-return",
+        )
+
+    with recorder.step("fine-create"):
+        response = expect(
+            client.get(
+                reverse("borrow_service:return_borrowed_book", args=[overdue_borrow.id])
+            ),
+            status.HTTP_202_ACCEPTED,
+            "fine-create",
+        )
+    fine_id = response.data["id"]
+
+    with recorder.step("worker:checkout-session"):
+        create_checkout_session(fine_id)
+
+    with recorder.step("fine-success"):
+        expect(
+            client.get(reverse("payment_service:fine-success", args=[fine_id])),
+            status.HTTP_202_ACCEPTED,
+            "fine-success",
+        )
+
+
+def drain_notifications(recorder: Recorder) -> None:
+    while Notification.objects.filter(status=Notification.Status.PENDING).exists():
+        with recorder.step("worker:deliver-notifications"):
+            metrics = deliver_notifications()
+        if not metrics["notifications_sent"]:
+            raise BenchmarkError(f"Notifications are not being delivered: {metrics}")
+
+
+@contextmanager
+def fake_upstreams(telegram_latency: float = 0.0):
+    """
+    Points Stripe, Telegram and the Celery broker at local stand-ins.
+    """
+    broker_url = celery_app.conf.broker_write_url
+    celery_app.conf.broker_write_url = "memory://"
+    try:
+        with TelegramStubServer(latency=telegram_latency) as telegram:
+            with override_settings(
+                PAYMENT_GATEWAY="payments_service.gateway.FakeStripeGateway",
+                TELEGRAM_API_URL=telegram.url,
+            ):
+                yield telegram
+    finally:
+        celery_app.conf.broker_write_url = broker_url
+
+
+def run_benchmark(
+    users: int = 50,
+    books: int = 200,
+    borrows: int = 1000,
+    payments: int = 1000,
+    lifecycles: int = 200,
+    concurrency: int = 8,
+    telegram_latency: float = 0.0,
+) -> dict:
+    """
+    Seeds the dataset and runs `lifecycles` patron journeys on `concurrency`
+    threads. With a concurrency of 1 everything runs on the calling thread,
+    which lets tests run the harness inside a transaction.
+    """
+    if users < 1 or books < 1:
+        raise BenchmarkError("The benchmark needs at least one user and one book")
+
+    dataset = seed(users, books, borrows, payments, overdue=lifecycles)
+    recorder = Recorder()
+
+    def worker(indexes):
+        try:
+            for index in indexes:
+                run_lifecycle(index, dataset, recorder)
+        finally:
+            if concurrency > 1:
+                connections.close_all()
+
+    with fake_upstreams(telegram_latency) as telegram:
+        started = time.perf_counter()
+        if concurrency == 1:
+            worker(range(lifecycles))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [
+                    executor.submit(worker, range(offset, lifecycles, concurrency))
+                    for offset in range(concurrency)
+                ]
+                for future in futures:
+                    future.result()
+        wall_time = time.perf_counter() - started
+        drain_notifications(recorder)
+        telegram_messages = len(telegram.messages)
+
+    report = recorder.summary(wall_time, lifecycles)
+    report["config"] = {
+        "users": users,
+        "books": books,
+        "borrows": borrows,
+        "payments": payments,
+        "concurrency": concurrency,
+        "telegram_latency": telegram_latency,
+    }
+    report["telegram_messages"] = telegram_messages
+    return report
+
+
+def run_http_benchmark(
+    base_url: str,
+    paths: list,
+    total_requests: int = 2000,
+    concurrency: int = 16,
+    token: str = None,
+    warmup: int = 200,
+) -> dict:
+    """
+    Sends `total_requests` GETs, spread round-robin over `paths`, to a running
+    server from `concurrency` threads with keep-alive sessions. Used to
+    compare serving profiles, so nothing is seeded or faked. The first
+    `warmup` requests let workers boot and fill their caches and are not
+    measured.
+    """
+    latencies = {path: [] for path in paths}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(indexes, measured=True):
+        session = http_requests.Session()
+        if token:
+            session.headers["Authorization"] = f"Bearer {token}"
+        with session:
+            for index in indexes:
+                path = paths[index % len(paths)]
+                started = time.perf_counter()
+                response = session.get(f"{base_url.rstrip('/')}{path}")
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if response.status_code >= 400:
+                        errors.append((path, response.status_code))
+                    if measured:
+                        latencies[path].append(elapsed)
+
+    def run(count, measured):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(worker, range(offset, count, concurrency), measured)
+                for offset in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+
+    run(warmup, measured=False)
+    started = time.perf_counter()
+    run(total_requests, measured=True)
+    wall_time = time.perf_counter() - started
+
+    if errors:
+        raise BenchmarkError(f"{len(errors)} requests failed, first: {errors[0]}")
+    return {
+        "requests": total_requests,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(total_requests / wall_time, 2),
+        "steps": {
+            path: {"count": len(samples), **latency_percentiles(samples)}
+            for path, samples in latencies.items()
+        },
+        "config": {"base_url": base_url, "concurrency": concurrency},
+    }
+
+
+def pending_session_events() -> list[str]:
+    """
+    One `checkout.session.completed` event, as Stripe would send it, for
+    every checkout session with pending payments in the database.
+    """
+    session_ids = (
+        Payment.objects.filter(status=Payment.Status.PENDING)
+        .exclude(session_id="")
+        .order_by("session_id")
+        .values_list("session_id", flat=True)
+        .distinct()
+    )
+    return [
+        json.dumps({
+            "id": f"evt_replay_{session_id}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {
+                "object": {
+                    "id": session_id,
+                    "object": "checkout.session",
+                    "payment_status": "paid",
+                },
+            },
+        })
+        for session_id in session_ids
+    ]
+
+
+def replay_webhook_events(
+    events: list,
+    secret: str,
+    base_url: str = None,
+    concurrency: int = 8,
+    batch_size: int = 500,
+) -> dict:
+    """
+    Signs captured webhook events and delivers them, then drains the inbox.
+    With `base_url` the events are POSTed to a running server from
+    `concurrency` threads and a worker is expected to process them;
+    otherwise they are stored in-process and the inbox is drained here, so
+    ingestion and processing throughput are measured separately. Replayed
+    event ids are deduplicated like real redeliveries.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def deliver(payload):
+        headers = {"Stripe-Signature": sign_payload(payload, secret)}
+        started = time.perf_counter()
+        if base_url is None:
+            receive_event(payload.encode(), headers["Stripe-Signature"], schedule=False)
+        else:
+            response = http_requests.post(
+                f"{base_url.rstrip('/')}{reverse('payment_service:stripe-webhook')}",
+                data=payload,
+                headers={**headers, "Content-Type": "application/json"},
+            )
+            if response.status_code >= 400:
+                with lock:
+                    errors.append(response.status_code)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    if base_url is None:
+        for payload in events:
+            deliver(payload)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(deliver, events))
+    ingest_time = time.perf_counter() - started
+    if errors:
+        raise BenchmarkError(f"{len(errors)} deliveries failed, first: {errors[0]}")
+
+    report = {
+        "events": len(events),
+        "ingest_time_s": round(ingest_time, 3),
+        "ingest_rps": round(len(events) / ingest_time, 2) if ingest_time else 0,
+        "ingest": latency_percentiles(latencies),
+    }
+    if base_url is not None:
+        return report
+
+    totals = {"events": 0, "ignored": 0, "payments_settled": 0, "payments_discarded": 0}
+    started = time.perf_counter()
+    # Notifications queued by settled sessions go to the in-memory broker.
+    with fake_upstreams():
+        while True:
+            metrics = process_event_batch(batch_size)
+            for key in totals:
+                totals[key] += metrics[key]
+            if metrics["events"] < batch_size:
+                break
+    process_time = time.perf_counter() - started
+    report.update(
+        process_time_s=round(process_time, 3),
+        process_rps=round(totals["events"] / process_time, 2) if process_time else 0,
+        processed=totals,
+    )
+    return report
+
+
+def seed_checkouts(count: int) -> list[str]:
+    """
+    Holds `count` copies for one patron and opens a fake checkout session
+    for each, returning the success urls Stripe would redirect to.
+    """
+    user = get_user_model().objects.create_user(
+        f"latency-bench-{time.time_ns()}@example.com", "benchmark"
+    )
+    book = Book.objects.create(
+        title="Latency benchmark book",
+        author="Benchmark author",
+        cover=Book.Cover.HARD,
+        inventory=count,
+        daily_fee=1,
+    )
+    due = datetime.date.today() + datetime.timedelta(days=7)
+    urls = []
+    for _ in range(count):
+        borrow = reserve_book(book.id, user=user, expected_return_date=due)
+        payment = Payment.objects.create(
+            status=Payment.Status.PENDING,
+            type=Payment.Type.PAYMENT,
+            borrowing=borrow,
+            money_to_pay=7,
+        )
+        create_checkout_session(payment.id)
+        urls.append(reverse("payment_service:payments-success", args=[payment.id]))
+    return urls
+
+
+def pay_on_threads(urls: list, threads: int) -> list:
+    """
+    Follows the success urls from a pool of `threads`, like a threaded WSGI
+    worker: each thread is blocked while its request waits for Stripe.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(chunk):
+        client = Client()
+        try:
+            for url in chunk:
+                started = time.perf_counter()
+                response = client.get(url)
+                elapsed = time.perf_counter() - started
+                expect(response, status.HTTP_201_CREATED, "payment-success")
+                with lock:
+                    latencies.append(elapsed)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, [urls[offset::threads] for offset in range(threads)]))
+    return latencies
+
+
+async def pay_on_event_loop(urls: list, concurrency: int) -> list:
+    """
+    Follows the success urls through the ASGI handler on one event loop
+    with up to `concurrency` requests in flight. Each request gets its own
+    sync thread, as under Django's ASGI handler.
+    """
+    client = AsyncClient()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def pay(url):
+        async with semaphore, ThreadSensitiveContext():
+            started = time.perf_counter()
+            response = await client.get(url)
+            latencies.append(time.perf_counter() - started)
+            # The test client skips the request_finished cleanup.
+            await sync_to_async(connections.close_all)()
+        expect(response, status.HTTP_201_CREATED, "payment-success")
+
+    await asyncio.gather(*(pay(url) for url in urls))
+    return latencies
+
+
+def run_latency_benchmark(
+    requests: int = 200,
+    threads: int = 4,
+    concurrency: int = 32,
+    stripe_latency: float = 0.3,
+) -> dict:
+    """
+    Pays `requests` checkout sessions through the async success view with
+    `stripe_latency` seconds injected into every Stripe call, once from a
+    pool of `threads` and once from a single event loop. `in_flight` is the
+    mean number of requests served at the same time, i.e. the concurrency a
+    worker gets out of its `threads` threads or out of its event loop.
+    """
+    if requests < 1 or threads < 1 or concurrency < 1:
+        raise BenchmarkError("The benchmark needs at least one request and worker")
+
+    def summary(latencies, wall_time):
+        return {
+            "requests": len(latencies),
+            "wall_time_s": round(wall_time, 3),
+            "throughput_rps": round(len(latencies) / wall_time, 2),
+            "in_flight": round(sum(latencies) / wall_time, 2),
+            **latency_percentiles(latencies),
+        }
+
+    modes = {}
+    with fake_upstreams():
+        urls = seed_checkouts(2 * requests)
+        latency, FakeStripeGateway.latency = FakeStripeGateway.latency, stripe_latency
+        try:
+            started = time.perf_counter()
+            latencies = pay_on_threads(urls[:requests], threads)
+            modes["threads"] = summary(latencies, time.perf_counter() - started)
+
+            # The loop gets a thread of its own, as in an ASGI server, so no
+            # sync context of the caller leaks into it.
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                latencies = executor.submit(
+                    asyncio.run, pay_on_event_loop(urls[requests:], concurrency)
+                ).result()
+            modes["asyncio"] = summary(latencies, time.perf_counter() - started)
+        finally:
+            FakeStripeGateway.latency = latency
+        drain_notifications(Recorder())
+
+    return {
+        "modes": modes,
+        "gain": round(
+            modes["asyncio"]["throughput_rps"] / modes["threads"]["throughput_rps"], 2
+        ),
+        "config": {
+            "requests": requests,
+            "threads": threads,
+            "concurrency": concurrency,
+            "stripe_latency": stripe_latency,
+        },
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """
+    Compares a report with a stored baseline. Latencies may drift by
+    `tolerance` percent and throughput may drop by as much, while query
+    counts are deterministic and must not grow at all.
+    """
+    rows = []
+
+    def add(metric, before, after, higher_is_worse=True, allowed=tolerance):
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change if higher_is_worse else -change
+        rows.append({
+            "metric": metric,
+            "baseline": before,
+            "current": after,
+            "change_pct": round(change, 1),
+            "regressed": worse > allowed,
+        })
+
+    add("throughput_rps", baseline["throughput_rps"], report["throughput_rps"], higher_is_worse=False)
+    for name, step in report["steps"].items():
+        before = baseline["steps"].get(name)
+        if before is None:
+            continue
+        for pct in PERCENTILES:
+            add(f"{name} p{pct}_ms", before[f"p{pct}_ms"], step[f"p{pct}_ms"])
+        add(f"{name} mean_queries", before["mean_queries"], step["mean_queries"], allowed=0)
+    return rows
+
+
+def load_baseline(path) -> dict:
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(report: dict, path) -> None:
+    with open(path, "w") as baseline_file:
+        json.dump(report, baseline_file, indent=2)
+        baseline_file.write("\n")
@@ -0,0 +1,129 @@
+"""
+PostgreSQL backend with an optional psycopg 3 connection pool.
+
+Set `OPTIONS["pool"]` to a dict of `psycopg_pool.ConnectionPool` arguments
+(or `True` for the defaults) to enable it. Closing a pooled connection hands
+it back to the pool instead of disconnecting, so the short-lived thread
+connections of threaded servers and Celery tasks still reuse the same
+Postgres sessions. Without the option it behaves like the stock backend.
+"""
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from psycopg_pool import ConnectionPool
+
+from library_service.metrics import register_collector
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_stats() -> dict:
+    """
+    Gauges of every pool opened by this process, by database alias.
+    """
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {
+        alias: pool.get_stats()
+        for (pid, alias, _), pool in pools
+        if pid == os.getpid()
+    }
+
+
+def collect_pool_metrics() -> list[str]:
+    gauges = {
+        "pool_size": "Connections currently managed by the pool.",
+        "pool_available": "Idle connections ready in the pool.",
+        "requests_waiting": "Clients waiting for a connection.",
+    }
+    lines = []
+    stats = pool_stats()
+    for name, documentation in gauges.items():
+        metric = f"db_{name}"
+        lines.append(f"# HELP {metric} {documentation}")
+        lines.append(f"# TYPE {metric} gauge")
+        for alias, values in sorted(stats.items()):
+            lines.append(f'{metric}{{alias="{alias}"}} {values.get(name, 0)}')
+    return lines
+
+
+register_collector(collect_pool_metrics)
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def pool_options(self):
+        options = self.settings_dict["OPTIONS"].get("pool")
+        # Maintenance connections, e.g. for creating the test database, are
+        # opened directly.
+        if self.alias == NO_DB_ALIAS:
+            return None
+        if options is True:
+            return {}
+        return options or None
+
+    @property
+    def pool(self):
+        options = self.pool_options
+        if options is None:
+            return None
+        if self.settings_dict["CONN_MAX_AGE"] != 0:
+            raise ImproperlyConfigured(
+                "Pooled connections require CONN_MAX_AGE = 0."
+            )
+        # Pools are per process, so forked Celery workers open their own, and
+        # per database name, so the test database gets a separate one.
+        key = (os.getpid(), self.alias, self.settings_dict["NAME"])
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    kwargs=self.get_connection_params(),
+                    name=self.alias,
+                    open=True,
+                    check=ConnectionPool.check_connection,
+                    **options,
+                )
+                # Fill the pool up to min_size before the first checkout, or
+                # the pool grows beyond it while the first clients wait.
+                pool.wait()
+        return pool
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        self.isolation_level = base.IsolationLevel.READ_COMMITTED
+        connection = pool.getconn()
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        if isolation_level is not None:
+            self.isolation_level = base.IsolationLevel(isolation_level)
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        # Return the connection to the pool it came from, which may not be
+        # the current one if the database name has changed since.
+        pool = getattr(self.connection, "_pool", None)
+        if pool is None:
+            return super()._close()
+        connection, self.connection = self.connection, None
+        with self.wrap_database_errors:
+            pool.putconn(connection)
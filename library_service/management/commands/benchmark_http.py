@@ -0,0 +1,64 @@
+from django.core.management import BaseCommand, CommandError
+
+from book_service.models import Book
+from library_service.benchmark import BenchmarkError, run_http_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a running server over HTTP and report latency percentiles and "
+        "throughput, e.g. to compare runserver with the production profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument(
+            "--path", action="append", dest="paths",
+            help="Path to request, may be repeated (default: the book list)",
+        )
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--token", help="JWT access token for protected paths")
+        parser.add_argument(
+            "--warmup", type=int, default=200,
+            help="Unmeasured requests sent first so workers are warm",
+        )
+        parser.add_argument(
+            "--seed-books", type=int, default=0,
+            help="Create this many books in the configured database first",
+        )
+
+    def handle(self, *args, **options):
+        if options["seed_books"]:
+            Book.objects.bulk_create(
+                Book(
+                    title=f"Benchmark book {i}",
+                    author=f"Benchmark author {i % 50}",
+                    cover=Book.Cover.HARD if i % 2 else Book.Cover.SOFT,
+                    inventory=10,
+                    daily_fee=1,
+                )
+                for i in range(options["seed_books"])
+            )
+
+        try:
+            report = run_http_benchmark(
+                options["url"],
+                options["paths"] or ["/api/v1/books/"],
+                total_requests=options["requests"],
+                concurrency=options["concurrency"],
+                token=options["token"],
+                warmup=options["warmup"],
+            )
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"{report['requests']} requests in {report['wall_time_s']}s: "
+            f"{report['throughput_rps']} req/s"
+        )
+        for path, step in report["steps"].items():
+            self.stdout.write(
+                f"{path:<40}{step['count']:>7}{step['p50_ms']:>10}"
+                f"{step['p95_ms']:>10}{step['p99_ms']:>10}"
+            )
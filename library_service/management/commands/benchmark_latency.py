@@ -0,0 +1,71 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from library_service.benchmark import BenchmarkError, run_latency_benchmark
+from library_service.db.base import close_pools
+
+
+class Command(BaseCommand):
+    help = (
+        "Inject latency into Stripe and compare how many payment-success "
+        "requests a worker serves at once from a thread pool and from an "
+        "event loop, against a throwaway test database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--threads", type=int, default=4,
+            help="Threads of the threaded worker",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=32,
+            help="Requests in flight on the event loop",
+        )
+        parser.add_argument(
+            "--stripe-latency", type=float, default=0.3,
+            help="Seconds every fake Stripe call waits before answering",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true",
+            help="Reuse the test database instead of recreating it",
+        )
+
+    def handle(self, *args, **options):
+        # The debug toolbar would dominate the timings.
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"]
+        )
+        try:
+            report = run_latency_benchmark(
+                requests=options["requests"],
+                threads=options["threads"],
+                concurrency=options["concurrency"],
+                stripe_latency=options["stripe_latency"],
+            )
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+        finally:
+            connection.close()
+            close_pools()
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'mode':<10}{'req/s':>10}{'in flight':>11}{'p50 ms':>10}"
+            f"{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        for name, mode in report["modes"].items():
+            self.stdout.write(
+                f"{name:<10}{mode['throughput_rps']:>10}{mode['in_flight']:>11}"
+                f"{mode['p50_ms']:>10}{mode['p95_ms']:>10}{mode['p99_ms']:>10}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"The event loop serves {report['gain']}x the requests of "
+            f"{options['threads']} threads"
+        ))
@@ -0,0 +1,126 @@
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from library_service.benchmark import (
+    BenchmarkError,
+    compare,
+    load_baseline,
+    run_benchmark,
+    save_baseline,
+)
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, "benchmarks", "lifecycle_baseline.json")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the borrow-to-payment lifecycle against a throwaway test "
+        "database and compare the results with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--books", type=int, default=200)
+        parser.add_argument("--borrows", type=int, default=1000)
+        parser.add_argument("--payments", type=int, default=1000)
+        parser.add_argument("--lifecycles", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--telegram-latency", type=float, default=0.0,
+            help="Seconds the fake Telegram API waits before answering",
+        )
+        parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+        parser.add_argument(
+            "--save-baseline", action="store_true",
+            help="Store this run as the new baseline instead of comparing",
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=20.0,
+            help="Allowed latency and throughput drift in percent",
+        )
+        parser.add_argument(
+            "--fail-on-regression", action="store_true",
+            help="Exit with an error when the run is worse than the baseline",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true",
+            help="Reuse the test database instead of recreating it",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"]
+        )
+        try:
+            report = run_benchmark(
+                users=options["users"],
+                books=options["books"],
+                borrows=options["borrows"],
+                payments=options["payments"],
+                lifecycles=options["lifecycles"],
+                concurrency=options["concurrency"],
+                telegram_latency=options["telegram_latency"],
+            )
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        self.print_report(report)
+
+        baseline_path = options["baseline"]
+        if options["save_baseline"]:
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            save_baseline(report, baseline_path)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}"))
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}"))
+            return
+
+        baseline = load_baseline(baseline_path)
+        if baseline["config"] != report["config"]:
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was recorded with {baseline['config']}"
+            ))
+        rows = compare(report, baseline, options["tolerance"])
+        self.print_comparison(rows)
+        regressions = [row["metric"] for row in rows if row["regressed"]]
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(f"Regressed: {', '.join(regressions)}")
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['lifecycles']} lifecycles in {report['wall_time_s']}s: "
+            f"{report['throughput_rps']} req/s, "
+            f"{report['lifecycles_per_s']} lifecycles/s, "
+            f"{report['telegram_messages']} Telegram messages"
+        )
+        self.stdout.write(
+            f"{'step':<30}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'queries':>9}"
+        )
+        for name, step in report["steps"].items():
+            self.stdout.write(
+                f"{name:<30}{step['count']:>7}{step['p50_ms']:>10}"
+                f"{step['p95_ms']:>10}{step['p99_ms']:>10}{step['mean_queries']:>9}"
+            )
+
+    def print_comparison(self, rows):
+        self.stdout.write("\nCompared with the baseline:")
+        for row in rows:
+            line = (
+                f"{row['metric']:<40}{row['baseline']:>10}{row['current']:>10}"
+                f"{row['change_pct']:>+9}%"
+            )
+            style = self.style.ERROR if row["regressed"] else self.style.SUCCESS
+            self.stdout.write(style(line))
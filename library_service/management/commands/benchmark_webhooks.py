@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from library_service.benchmark import (
+    BenchmarkError,
+    pending_session_events,
+    replay_webhook_events,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay captured Stripe webhook events, one JSON event per line, "
+        "and report ingestion and processing throughput"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file of Stripe events")
+        parser.add_argument(
+            "--url",
+            help="POST to a running server instead of storing in-process",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--secret", help="Defaults to STRIPE_WEBHOOK_SECRET")
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.STRIPE_EVENT_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--from-pending", action="store_true",
+            help="First write a completed event for every pending checkout "
+                 "session in the database to the file",
+        )
+
+    def handle(self, *args, **options):
+        secret = options["secret"] or settings.STRIPE_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError("Pass --secret or set STRIPE_WEBHOOK_SECRET")
+        path = options["path"]
+        if options["from_pending"]:
+            with open(path, "w", encoding="utf-8") as stream:
+                stream.writelines(f"{event}\n" for event in pending_session_events())
+
+        with open(path, encoding="utf-8") as stream:
+            events = [line.strip() for line in stream if line.strip()]
+        try:
+            with override_settings(STRIPE_WEBHOOK_SECRET=secret):
+                report = replay_webhook_events(
+                    events,
+                    secret,
+                    base_url=options["url"],
+                    concurrency=options["concurrency"],
+                    batch_size=options["batch_size"],
+                )
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+
+        ingest = report["ingest"]
+        self.stdout.write(
+            f"Ingested {report['events']} events in {report['ingest_time_s']}s: "
+            f"{report['ingest_rps']} events/s "
+            f"(p50 {ingest['p50_ms']}ms, p95 {ingest['p95_ms']}ms)"
+        )
+        if "processed" in report:
+            processed = report["processed"]
+            self.stdout.write(
+                f"Processed {processed['events']} events in {report['process_time_s']}s: "
+                f"{report['process_rps']} events/s, "
+                f"{processed['payments_settled']} payments settled, "
+                f"{processed['payments_discarded']} discarded, "
+                f"{processed['ignored']} events ignored"
+            )
@@ -0,0 +1,151 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """
+    A labelled Prometheus histogram kept in process memory.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self, label_names: tuple) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, (bucket_counts, total, count) in series:
+            label_text = ",".join(
+                f'{name}="{value}"' for name, value in zip(label_names, labels)
+            )
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+LABELS = ("view", "method")
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by URL name."
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries per request.", QUERY_BUCKETS
+)
+DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Time spent in database queries per request."
+)
+SERIALIZER_TIME = Histogram(
+    "http_request_serializer_duration_seconds", "Time spent in serializers per request."
+)
+HISTOGRAMS = (REQUEST_LATENCY, DB_QUERIES, DB_TIME, SERIALIZER_TIME)
+
+_collectors = []
+
+
+def register_collector(collector) -> None:
+    """
+    Registers a callable returning extra exposition lines, e.g. pool gauges.
+    """
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.collect(LABELS))
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+@contextmanager
+def request_timings():
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Adds the time spent in the outermost serializer call to the current
+    request. Nested serializers are not counted twice.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    timings.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_depth -= 1
+        if not timings.serializer_depth:
+            timings.serializer_time += time.perf_counter() - started
+
+
+def metrics_view(request):
+    """
+    Exposes the collected metrics in the Prometheus text format. When
+    METRICS_TOKEN is set the scraper must send it as a bearer token.
+    """
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
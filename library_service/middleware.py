@@ -0,0 +1,72 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from library_service import metrics
+
+
+def watch_queries(timings) -> None:
+    connection.execute_wrappers.append(timings)
+
+
+def unwatch_queries(timings) -> None:
+    connection.execute_wrappers.remove(timings)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, database query count and time, and serializer time of
+    sampled requests, labelled by the resolved URL name. With
+    METRICS_SAMPLE_RATE turned down, unsampled requests only pay for one
+    random() call.
+
+    It runs natively in both modes, so under ASGI the async views below it
+    are not adapted to threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with metrics.request_timings() as timings:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        self.observe(request, timings, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with metrics.request_timings() as timings:
+            # Queries run on the connection of the request's sync thread, not
+            # on the event loop's.
+            await sync_to_async(watch_queries)(timings)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(unwatch_queries)(timings)
+        self.observe(request, timings, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, timings, elapsed: float) -> None:
+        match = request.resolver_match
+        labels = (match.view_name if match else "unresolved", request.method)
+        metrics.REQUEST_LATENCY.observe(labels, elapsed)
+        metrics.DB_QUERIES.observe(labels, timings.queries)
+        metrics.DB_TIME.observe(labels, timings.db_time)
+        metrics.SERIALIZER_TIME.observe(labels, timings.serializer_time)
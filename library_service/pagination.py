@@ -0,0 +1,82 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered by primary key.
+
+    Pagination is opt-in: the full list is returned unless the client passes
+    `cursor` or `page_size`, so existing clients keep working unchanged.
+    Views set `required` to always paginate, e.g. for filtered lists.
+    """
+    ordering = ("id",)
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    required = False
+
+    def is_requested(self, request) -> bool:
+        params = request.query_params
+        return (
+            self.required
+            or self.cursor_query_param in params
+            or self.page_size_query_param in params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Offset pagination for ranked search results, which cannot use a keyset.
+    """
+    default_limit = 20
+    max_limit = 100
+
+
+class StreamingListMixin:
+    """
+    Lets list views write their JSON array incrementally with `?stream=true`.
+
+    Rows are read with `.iterator()` and serialized one by one, so memory
+    stays flat no matter how many rows are exported.
+    """
+    stream_query_param = "stream"
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param) != "true":
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by("id")
+        serializer = self.get_serializer_class()(
+            context=self.get_serializer_context()
+        )
+        return StreamingHttpResponse(
+            self.stream_json_array(queryset, serializer),
+            content_type="application/json",
+        )
+
+    def stream_json_array(self, queryset, serializer):
+        yield "["
+        separator = ""
+        buffer = []
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            buffer.append(
+                separator
+                + json.dumps(serializer.to_representation(obj), cls=JSONEncoder)
+            )
+            separator = ","
+            if len(buffer) >= self.stream_chunk_size:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
+        yield "]"
@@ -0,0 +1,28 @@
+from library_service.metrics import timed_serialization
+
+
+class TimedSerializerMixin:
+    """
+    Reports the time spent serializing to the request metrics.
+    """
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class EagerLoadingMixin:
+    """
+    Lets a serializer declare the relations it renders, so views can load
+    them in the same query instead of one lazy query per row.
+    """
+    select_related_fields = ()
+    deferred_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.deferred_fields:
+            queryset = queryset.defer(*cls.deferred_fields)
+        return queryset
@@ -28,10 +28,22 @@ load_dotenv(dotenv_path=env_path)
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get("SECRET_KEY")
 
+# "development" runs with DEBUG and the debug toolbar, "production" turns
+# both off and serves static files through WhiteNoise.
+DJANGO_ENV = os.environ.get("DJANGO_ENV", "development")
+
+if DJANGO_ENV not in ("development", "production"):
+    raise ValueError(f"Unknown DJANGO_ENV: {DJANGO_ENV}")
+
+PRODUCTION = DJANGO_ENV == "production"
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = not PRODUCTION
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0']
+ALLOWED_HOSTS += [
+    host for host in os.environ.get("ALLOWED_HOSTS", "").split(",") if host
+]
 
 # Application definition
 
@@ -42,21 +54,26 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "book_service",
     "user_service",
     "borrow_service",
     "notifications_service",
     "payments_service",
+    "analytics_service",
+    "library_service",
     "django_celery_beat",
     "rest_framework",
     "rest_framework_simplejwt",
-    "debug_toolbar",
     "drf_spectacular",
 ]
 
+if not PRODUCTION:
+    INSTALLED_APPS.append("debug_toolbar")
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "library_service.middleware.MetricsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -65,6 +82,11 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+if PRODUCTION:
+    MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
+else:
+    MIDDLEWARE.insert(2, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "library_service.urls"
 
 TEMPLATES = [
@@ -90,15 +112,55 @@ WSGI_APPLICATION = "library_service.wsgi.application"
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'library_service.db',
         'NAME': os.environ.get("POSTGRES_DB"),
         'USER': os.environ.get("POSTGRES_USER"),
         'PASSWORD': os.environ.get("POSTGRES_PASSWORD"),
         'HOST': os.environ.get("POSTGRES_HOST"),
         'PORT': os.environ.get("POSTGRES_PORT"),
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE") or 60),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
 
+# DB_POOL_MAX_SIZE switches from persistent per-thread connections to a
+# psycopg pool shared by all threads of a web or Celery worker process.
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE") or 0)
+
+if DB_POOL_MAX_SIZE:
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+        "max_size": DB_POOL_MAX_SIZE,
+        "timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    }
+
+
+CACHE_URL = os.environ.get("CACHE_URL")
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+BOOK_CACHE_TTL = 300
+BOOK_CACHE_LOCK_TIMEOUT = 5
+
+# Staff analytics are recomputed at most once per bucket of this many seconds.
+ANALYTICS_CACHE_BUCKET = 300
+ANALYTICS_MAX_DAYS = 366
+ANALYTICS_TOP_BOOKS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -135,6 +197,17 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = "static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+if PRODUCTION:
+    STORAGES = {
+        "default": {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+        },
+        "staticfiles": {
+            "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+        },
+    }
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -143,7 +216,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "user_service.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
@@ -154,16 +227,56 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": False,
     "UPDATE_LAST_LOGIN": True,
+    "TOKEN_OBTAIN_SERIALIZER": "user_service.serializers.TokenObtainPairWithClaimsSerializer",
 }
 
+AUTH_USER_CACHE_TTL = 60
+
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("CHAT_ID")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = 10
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 10
+NOTIFICATION_CLAIM_TTL = timedelta(minutes=5)
+DAILY_REPORT_CHUNK_SIZE = 2000
 
 CELERY_BEAT_SCHEDULE = {
     "sample_task": {
         "task": "notifications_service.views.daily_list_of_borrowers",
         "schedule": crontab(minute="0", hour="21")
     },
+    "deliver_notifications": {
+        "task": "notifications_service.tasks.deliver_notifications",
+        "schedule": crontab(minute="*"),
+    },
+    "process_stripe_events": {
+        "task": "payments_service.tasks.process_stripe_events",
+        "schedule": crontab(minute="*"),
+    },
+    "sweep_expired_payments": {
+        "task": "payments_service.tasks.sweep_expired_payments",
+        "schedule": crontab(minute="*/5"),
+    },
+    # Just after midnight, so borrows that fell due count as overdue.
+    "accrue_overdue_fines": {
+        "task": "borrow_service.tasks.accrue_overdue_fines",
+        "schedule": crontab(minute="1", hour="0"),
+    },
+    "rebuild_borrowing_summaries": {
+        "task": "user_service.tasks.rebuild_borrowing_summaries",
+        "schedule": crontab(minute="5", hour="0"),
+    },
+    "expire_waitlist_holds": {
+        "task": "borrow_service.tasks.expire_waitlist_holds",
+        "schedule": crontab(minute="*/5"),
+    },
+    "archive_history": {
+        "task": "borrow_service.tasks.archive_history",
+        "schedule": crontab(minute="30", hour="3"),
+    },
 }
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
@@ -174,11 +287,36 @@ CELERY_TASK_TIME_LIMIT = 30 * 60
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY")
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+STRIPE_WEBHOOK_TOLERANCE = 300
+STRIPE_EVENT_BATCH_SIZE = 500
+PAYMENT_GATEWAY = os.environ.get(
+    "PAYMENT_GATEWAY", "payments_service.gateway.StripeGateway"
+)
+PAYMENT_REDIRECT_BASE_URL = os.environ.get(
+    "PAYMENT_REDIRECT_BASE_URL", "http://127.0.0.1:8000"
+)
 
 FINE_MULTIPLIER = 2.0
+FINE_ACCRUAL_CHUNK_SIZE = 1000
+
+# Returned borrows and their payments move to the history tables this long
+# after the return.
+HISTORY_AFTER_DAYS = 365
+HISTORY_BATCH_SIZE = 5000
+
+PAYMENT_HOLD_TTL = timedelta(hours=24)
+# How long a returned copy is held for the next patron on the waitlist.
+WAITLIST_HOLD_TTL = timedelta(hours=24)
+PAYMENT_SWEEP_BATCH_SIZE = 500
+
+BULK_BORROW_LIMIT = 20
 
 INTERNAL_IPS = ["127.0.0.1", ]
 
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 1.0))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library Service Api",
     "DESCRIPTION": "Library service for borrowing book with payment support",
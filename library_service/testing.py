@@ -0,0 +1,31 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Test case helpers that catch N+1 regressions in API endpoints.
+    """
+
+    def assertQueryBudget(self, budget: int, request, seed, sizes=(1, 5, 20)):
+        """
+        Seeds `n` more rows with `seed(n)` for each size, calls `request()`
+        and asserts that the endpoint always runs the same number of queries
+        and no more than `budget`, whatever the number of rows.
+        """
+        counts = []
+        for size in sizes:
+            seed(size)
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertLess(response.status_code, 300, response.content)
+            counts.append(len(queries))
+
+        self.assertEqual(
+            len(set(counts)), 1,
+            f"Query count grows with the number of rows: {dict(zip(sizes, counts))}"
+        )
+        self.assertLessEqual(
+            counts[0], budget,
+            f"{counts[0]} queries exceed the budget of {budget}"
+        )
@@ -14,17 +14,26 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from debug_toolbar.toolbar import debug_toolbar_urls
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from library_service.metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/v1/", include("book_service.urls", namespace="book_service")),
     path("api/v1/", include("user_service.urls", namespace="user_service")),
     path("api/v1/", include("borrow_service.urls", namespace="borrow_service")),
     path("api/v1/", include("payments_service.urls", namespace="payment_service")),
+    path("api/v1/", include("analytics_service.urls", namespace="analytics_service")),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/doc/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
-] + debug_toolbar_urls()
+    path("metrics/", metrics_view, name="metrics"),
+]
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    from debug_toolbar.toolbar import debug_toolbar_urls
+
+    urlpatterns += debug_toolbar_urls()
@@ -1,3 +1,5 @@
 from django.contrib import admin
 
-# Register your models here.
+from notifications_service.models import Notification
+
+admin.site.register(Notification)
@@ -1,3 +1,40 @@
 from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+
+class Notification(models.Model):
+    """
+    A Telegram message waiting in the outbox. Rows are written in the same
+    transaction as the change they announce and delivered by a Celery worker.
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING"
+        SENDING = "SENDING"
+        SENT = "SENT"
+        FAILED = "FAILED"
+
+    text = models.TextField()
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(status="PENDING"),
+                name="notification_pending_idx",
+            ),
+            models.Index(
+                fields=["claimed_at"],
+                condition=Q(status="SENDING"),
+                name="notification_sending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.status} - {self.text[:50]}"
@@ -0,0 +1,126 @@
+import logging
+
+import requests
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from notifications_service import telegram
+from notifications_service.models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce(notifications: list, limit: int) -> list[tuple[str, list[int]]]:
+    """
+    Packs queued notifications into as few Telegram messages as possible.
+    Returns (text, notification ids) pairs; oversized texts are split.
+    """
+    messages = []
+    text, ids = "", []
+    for notification in notifications:
+        if len(notification.text) > limit:
+            if ids:
+                messages.append((text, ids))
+                text, ids = "", []
+            parts = telegram.split_message(notification.text, limit)
+            messages.extend((part, [notification.id]) for part in parts[:-1])
+            text, ids = parts[-1], [notification.id]
+            continue
+        candidate = f"{text}\n\n{notification.text}" if ids else notification.text
+        if len(candidate) > limit:
+            messages.append((text, ids))
+            candidate, ids = notification.text, []
+        text = candidate
+        ids.append(notification.id)
+    if ids:
+        messages.append((text, ids))
+    return messages
+
+
+def claim_batch() -> list:
+    """
+    Marks a batch of pending notifications as SENDING in a short
+    transaction, so they are sent without holding row locks and other
+    workers skip them. Claims older than `NOTIFICATION_CLAIM_TTL`, left by a
+    worker that died mid-send, are queued again first.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        Notification.objects.filter(
+            status=Notification.Status.SENDING,
+            claimed_at__lte=now - settings.NOTIFICATION_CLAIM_TTL,
+        ).update(status=Notification.Status.PENDING)
+        batch = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(status=Notification.Status.PENDING)
+            .order_by("id")[:settings.NOTIFICATION_BATCH_SIZE]
+        )
+        Notification.objects.filter(id__in=[n.id for n in batch]).update(
+            status=Notification.Status.SENDING, claimed_at=now
+        )
+    return batch
+
+
+@shared_task(bind=True, max_retries=None)
+def deliver_notifications(self):
+    """
+    Drains the notification outbox: claims a batch of pending
+    notifications, coalesces them into a few messages and sends them over a
+    pooled session outside any transaction, then records the outcome.
+    Rate limits and errors reschedule the task with backoff, but only
+    delivery errors count towards `NOTIFICATION_MAX_ATTEMPTS`. Delivery
+    metrics are logged and returned.
+    """
+    metrics = {
+        "messages_sent": 0,
+        "notifications_sent": 0,
+        "notifications_failed": 0,
+        "retry_in": None,
+    }
+    batch = claim_batch()
+    messages = coalesce(batch, settings.TELEGRAM_MESSAGE_LIMIT)
+    last_message = {
+        notification_id: index
+        for index, (_, ids) in enumerate(messages)
+        for notification_id in ids
+    }
+    sent_ids = set()
+    delivery_failed = False
+    for index, (text, ids) in enumerate(messages):
+        try:
+            telegram.send_message(text)
+        except telegram.TelegramRateLimited as exc:
+            metrics["retry_in"] = exc.retry_after
+            break
+        except requests.RequestException:
+            logger.exception("Telegram delivery failed")
+            attempts = max(n.attempts for n in batch if n.id not in sent_ids)
+            metrics["retry_in"] = min(2 ** attempts, 300)
+            delivery_failed = True
+            break
+        metrics["messages_sent"] += 1
+        sent_ids.update(i for i in ids if last_message[i] == index)
+
+    unsent = [n for n in batch if n.id not in sent_ids]
+    for notification in unsent:
+        notification.status = Notification.Status.PENDING
+        if delivery_failed:
+            notification.attempts += 1
+            if notification.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                notification.status = Notification.Status.FAILED
+                metrics["notifications_failed"] += 1
+    with transaction.atomic():
+        Notification.objects.filter(id__in=sent_ids).update(
+            status=Notification.Status.SENT, sent_at=timezone.now()
+        )
+        Notification.objects.bulk_update(unsent, ["attempts", "status"])
+    metrics["notifications_sent"] = len(sent_ids)
+
+    logger.info("Notification delivery: %s", metrics)
+    if metrics["retry_in"] is not None:
+        raise self.retry(countdown=metrics["retry_in"])
+    if len(batch) == settings.NOTIFICATION_BATCH_SIZE:
+        self.delay()
+    return metrics
@@ -0,0 +1,68 @@
+import itertools
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+
+
+class TelegramRateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Telegram asked to retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def split_message(text: str, limit: int) -> list[str]:
+    """
+    Splits a message into parts no longer than `limit`, breaking on newlines
+    where possible.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+def pack_lines(lines, limit: int, header: str = "", footer: str = ""):
+    """
+    Lazily packs lines into messages no longer than `limit`. The header opens
+    the first message and the footer closes the last one.
+    """
+    chunk = header
+    for line in itertools.chain(lines, [footer] if footer else []):
+        if chunk and len(chunk) + 1 + len(line) > limit:
+            yield chunk
+            chunk = line
+        else:
+            chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        yield chunk
+
+
+def send_message(text: str) -> requests.Response:
+    """
+    Sends a message to the Telegram group over a pooled HTTP session.
+    Raises `TelegramRateLimited` when Telegram answers 429.
+    """
+    response = _session.post(
+        f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
+        data={
+            "chat_id": settings.TELEGRAM_CHAT_ID,
+            "text": text
+        },
+        timeout=settings.TELEGRAM_TIMEOUT,
+    )
+    if response.status_code == 429:
+        retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        raise TelegramRateLimited(retry_after)
+    response.raise_for_status()
+    return response
@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class TelegramStubServer:
+    """
+    A local HTTP server that answers like the Telegram Bot API `sendMessage`
+    method. Used by tests and benchmarks in place of api.telegram.org.
+
+    `rate_limit_next` makes the next N requests fail with 429 and
+    `latency` delays every answer by that many seconds.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.messages = []
+        self.rate_limit_next = 0
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "TelegramStubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                if stub.latency:
+                    threading.Event().wait(stub.latency)
+                with stub._lock:
+                    if stub.rate_limit_next:
+                        stub.rate_limit_next -= 1
+                        return self._answer(429, {
+                            "ok": False,
+                            "error_code": 429,
+                            "parameters": {"retry_after": 1},
+                        })
+                    stub.messages.append(form.get("text", [""])[0])
+                    message_id = len(stub.messages)
+                self._answer(200, {"ok": True, "result": {"message_id": message_id}})
+
+            def _answer(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,27 +1,194 @@
-from django.test import TestCase
-from unittest.mock import patch, MagicMock
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from datetime import date, timedelta
+from unittest.mock import patch
 
-from django.conf import settings
+import requests
+
+from celery.exceptions import Retry
+from book_service.models import Book
+from borrow_service.fines import accrue_fines
 from borrow_service.models import Borrow
-from notifications_service.views import daily_list_of_borrowers
+from notifications_service.models import Notification
+from notifications_service.tasks import coalesce, deliver_notifications
+from notifications_service.telegram_stub import TelegramStubServer
+from notifications_service.views import daily_list_of_borrowers, queue_telegram_message
 
 
 class DailyListOfBorrowersTestCase(TestCase):
 
-    @patch("requests.post")
-    def test_no_borrowings_due(self, mock_post):
-        with patch("borrow_service.views.Borrow.objects.filter") as mock_filter:
-            mock_filter.return_value = []
+    def test_no_borrowings_due(self):
+        result = daily_list_of_borrowers()
+
+        self.assertEqual(result["message"], "No borrowings overdue today!")
+        self.assertEqual(
+            list(Notification.objects.values_list("text", flat=True)),
+            ["No borrowings overdue today!"]
+        )
 
+    def test_borrowings_grouped_by_user(self):
+        book = Book.objects.create(
+            title="book", author="123", cover="HARD", inventory=10, daily_fee=1
+        )
+        users = [
+            get_user_model().objects.create_user(f"user{i}@gmail.com", "test123")
+            for i in range(2)
+        ]
+        for user in (users[0], users[1], users[1]):
+            Borrow.objects.create(
+                expected_return_date=date.today(), book=book, user=user
+            )
+
+        with CaptureQueriesContext(connection) as queries:
             result = daily_list_of_borrowers()
 
-            self.assertEqual(result["message"], "No borrowings overdue today!")
+        selects = [q for q in queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(result["rows"], 3)
+        self.assertEqual(result["users"], 2)
+        self.assertEqual(
+            result["message"],
+            "list of people that have to return book till tomorrow 23:59:"
+            "\nuser0@gmail.com\nuser1@gmail.com (2 books)\ngood bye!"
+        )
 
-            mock_post.assert_called_once_with(
-                f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
-                data={
-                    "chat_id": settings.TELEGRAM_CHAT_ID,
-                    "text": "No borrowings overdue today!"
-                }
+    def test_report_shows_accrued_fines(self):
+        book = Book.objects.create(
+            title="book", author="123", cover="HARD", inventory=10, daily_fee=1
+        )
+        user = get_user_model().objects.create_user("user0@gmail.com", "test123")
+        for days in (1, 3):
+            Borrow.objects.create(
+                expected_return_date=date.today() - timedelta(days=days),
+                book=book,
+                user=user,
             )
+        accrue_fines()
+
+        result = daily_list_of_borrowers()
+
+        self.assertIn("\nuser0@gmail.com (2 books, fine 8.00)\n", result["message"])
+
+    @override_settings(TELEGRAM_MESSAGE_LIMIT=100)
+    def test_report_split_into_size_bounded_messages(self):
+        book = Book.objects.create(
+            title="book", author="123", cover="HARD", inventory=10, daily_fee=1
+        )
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"user{i:02}@gmail.com") for i in range(20)
+        )
+        for user in users:
+            Borrow.objects.create(
+                expected_return_date=date.today(), book=book, user=user
+            )
+
+        result = daily_list_of_borrowers()
+
+        texts = list(Notification.objects.order_by("id").values_list("text", flat=True))
+        self.assertEqual(len(texts), result["chunks"])
+        self.assertGreater(len(texts), 1)
+        self.assertTrue(all(len(text) <= 100 for text in texts))
+        self.assertEqual(sum(text.count("@gmail.com") for text in texts), 20)
+
+
+class NotificationOutboxTestCase(TestCase):
+    def setUp(self):
+        self.stub = TelegramStubServer().start()
+        self.addCleanup(self.stub.stop)
+        self.settings_override = override_settings(TELEGRAM_API_URL=self.stub.url)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_queue_delivers_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            notification = queue_telegram_message("hello")
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+
+    def test_burst_is_coalesced(self):
+        for i in range(5):
+            Notification.objects.create(text=f"message {i}")
+
+        metrics = deliver_notifications()
+
+        self.assertEqual(metrics["messages_sent"], 1)
+        self.assertEqual(metrics["notifications_sent"], 5)
+        self.assertEqual(len(self.stub.messages), 1)
+        self.assertIn("message 4", self.stub.messages[0])
+        self.assertFalse(
+            Notification.objects.filter(status=Notification.Status.PENDING).exists()
+        )
+
+    def test_rate_limit_keeps_notifications_pending(self):
+        Notification.objects.create(text="hello")
+        self.stub.rate_limit_next = 1
+
+        with self.assertRaises(Retry):
+            deliver_notifications()
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        self.assertEqual(notification.attempts, 0)
+
+        deliver_notifications()
+        self.assertEqual(self.stub.messages, ["hello"])
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_delivery_errors_count_attempts(self):
+        Notification.objects.create(text="hello")
+
+        with patch(
+            "notifications_service.telegram.send_message",
+            side_effect=requests.ConnectionError,
+        ), self.assertLogs("notifications_service.tasks", "ERROR"):
+            for _ in range(2):
+                with self.assertRaises(Retry):
+                    deliver_notifications()
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.FAILED)
+        self.assertEqual(notification.attempts, 2)
+
+    def test_notifications_are_claimed_while_sending(self):
+        Notification.objects.create(text="hello")
+        statuses = []
+
+        def send_message(text):
+            statuses.extend(Notification.objects.values_list("status", flat=True))
+
+        with patch("notifications_service.telegram.send_message", send_message):
+            deliver_notifications()
+
+        self.assertEqual(statuses, [Notification.Status.SENDING])
+        self.assertEqual(Notification.objects.get().status, Notification.Status.SENT)
+
+    def test_stale_claims_are_sent_again(self):
+        Notification.objects.create(
+            text="stale",
+            status=Notification.Status.SENDING,
+            claimed_at=timezone.now() - timedelta(hours=1),
+        )
+        Notification.objects.create(
+            text="in flight",
+            status=Notification.Status.SENDING,
+            claimed_at=timezone.now(),
+        )
+
+        deliver_notifications()
+
+        self.assertEqual(self.stub.messages, ["stale"])
+
+    def test_coalesce_respects_message_limit(self):
+        notifications = [
+            Notification(id=i, text="x" * 30) for i in range(1, 5)
+        ] + [Notification(id=5, text="y" * 70)]
+
+        messages = coalesce(notifications, 64)
+
+        self.assertTrue(all(len(text) <= 64 for text, _ in messages))
+        self.assertEqual(messages[0][1], [1, 2])
+        self.assertEqual(messages[-1][1], [5])
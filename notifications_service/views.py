@@ -1,28 +1,45 @@
+import itertools
+import logging
+import time
 from datetime import date, timedelta
-import requests
 
 from celery import shared_task
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 
 from borrow_service.models import Borrow
+from notifications_service import telegram
+from notifications_service.models import Notification
+from notifications_service.tasks import deliver_notifications
 
+logger = logging.getLogger(__name__)
 
-def send_message_to_telegram_group(message: str):
+
+def queue_telegram_message(message: str) -> Notification:
     """
-    Sends a message to a predefined Telegram group using the Telegram Bot API.
+    Writes a message to the notification outbox as part of the current
+    transaction. A Celery worker delivers it once the transaction commits.
     """
-    bot_token = settings.TELEGRAM_BOT_TOKEN
-    chat_id = settings.TELEGRAM_CHAT_ID
-    message = message
+    notification = Notification.objects.create(text=message)
+    transaction.on_commit(deliver_notifications.delay)
+    return notification
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
 
-    payload = {
-        "chat_id": chat_id,
-        "text": message
-    }
-    return requests.post(url, data=payload)
+def overdue_report_lines(rows):
+    """
+    Groups a stream of (email, accrued fine) rows ordered by user into one
+    report line per user.
+    """
+    for email, borrows in itertools.groupby(rows, key=lambda row: row[0]):
+        count, fine = 0, 0
+        for _, accrued_fine in borrows:
+            count += 1
+            fine += accrued_fine
+        details = [f"{count} books"] if count > 1 else []
+        if fine:
+            details.append(f"fine {fine}")
+        yield f"{email} ({', '.join(details)})" if details else email
 
 
 @shared_task
@@ -31,31 +48,61 @@ def daily_list_of_borrowers():
     Sends a daily list of borrowers who have to return their books by tomorrow
     via a message to a Telegram group. If there are no pending returns, it informs
     the group that no books are overdue.
+
+    Emails and accrued fines are streamed from a single joined query, grouped
+    by user and packed into messages that fit Telegram's size limit, which go
+    out via the outbox.
     """
-    bot_token = settings.TELEGRAM_BOT_TOKEN
-    chat_id = settings.TELEGRAM_CHAT_ID
+    started = time.monotonic()
+    stats = {"rows": 0, "users": 0}
 
-    list_of_borrows = list(Borrow.objects.filter(
+    def counted(rows):
+        for row in rows:
+            stats["rows"] += 1
+            yield row
+
+    rows = Borrow.objects.filter(
         Q(
             expected_return_date__lte=date.today() + timedelta(days=1)
         ) & Q(
             actual_return_date__isnull=True
         )
-    ))
-
-    if not list_of_borrows:
-        message = "No borrowings overdue today!"
-    else:
-        message = "list of people that have to return book till tomorrow 23:59:"
-        for borrower in list_of_borrows:
-            message += f"\n{borrower.user.email}"
-        message += "\ngood bye!"
-
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-
-    payload = {
-        "chat_id": chat_id,
-        "text": message
-    }
-    requests.post(url, data=payload)
-    return {"message": message}
+    ).order_by("user__email").values_list("user__email", "accrued_fine").iterator(
+        chunk_size=settings.DAILY_REPORT_CHUNK_SIZE
+    )
+
+    def user_lines():
+        for line in overdue_report_lines(counted(rows)):
+            stats["users"] += 1
+            yield line
+
+    messages = telegram.pack_lines(
+        user_lines(),
+        settings.TELEGRAM_MESSAGE_LIMIT,
+        header="list of people that have to return book till tomorrow 23:59:",
+        footer="good bye!",
+    )
+    notifications = []
+    first_message = None
+    chunks = 0
+    with transaction.atomic():
+        for message in messages:
+            first_message = first_message or message
+            chunks += 1
+            notifications.append(Notification(text=message))
+            if len(notifications) >= settings.NOTIFICATION_BATCH_SIZE:
+                Notification.objects.bulk_create(notifications)
+                notifications = []
+        if not stats["rows"]:
+            first_message = "No borrowings overdue today!"
+            chunks = 1
+            notifications = [Notification(text=first_message)]
+        Notification.objects.bulk_create(notifications)
+        transaction.on_commit(deliver_notifications.delay)
+
+    stats.update(
+        chunks=chunks,
+        duration_ms=round((time.monotonic() - started) * 1000, 1),
+    )
+    logger.info("Daily overdue report: %s", stats)
+    return {"message": first_message, **stats}
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from payments_service.models import Payment
+from payments_service.models import Payment, StripeEvent
 
 admin.site.register(Payment)
+admin.site.register(StripeEvent)
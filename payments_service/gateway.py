@@ -0,0 +1,131 @@
+import asyncio
+import time
+import uuid
+from typing import NamedTuple
+
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+
+class CheckoutSession(NamedTuple):
+    id: str
+    url: str
+
+
+class StripeGateway:
+    """
+    Creates checkout sessions through the Stripe API. The `a` prefixed
+    methods are for async views and go through Stripe's async HTTP client.
+    """
+
+    def create_checkout_session(
+        self,
+        line_items: list,
+        success_url: str,
+        cancel_url: str,
+        idempotency_key: str,
+    ) -> CheckoutSession:
+        session = stripe.checkout.Session.create(
+            payment_method_types=["card"],
+            line_items=line_items,
+            mode="payment",
+            success_url=success_url,
+            cancel_url=cancel_url,
+            idempotency_key=idempotency_key,
+        )
+        return CheckoutSession(session.id, session.url)
+
+    def expire_checkout_session(self, session_id: str) -> None:
+        try:
+            stripe.checkout.Session.expire(session_id)
+        except stripe.InvalidRequestError:
+            # Already expired or completed.
+            pass
+
+    async def aexpire_checkout_session(self, session_id: str) -> None:
+        try:
+            await stripe.checkout.Session.expire_async(session_id)
+        except stripe.InvalidRequestError:
+            pass
+
+    def session_is_paid(self, session_id: str) -> bool:
+        session = stripe.checkout.Session.retrieve(session_id)
+        return session.payment_status in ("paid", "no_payment_required")
+
+    async def asession_is_paid(self, session_id: str) -> bool:
+        session = await stripe.checkout.Session.retrieve_async(session_id)
+        return session.payment_status in ("paid", "no_payment_required")
+
+
+class FakeStripeGateway:
+    """
+    In-process stand-in for Stripe used by tests and local benchmarks.
+    Like Stripe, it returns the same session for a repeated idempotency key.
+    Every call waits `latency` seconds to stand in for the round trip. Known
+    sessions count as paid until they are expired; `complete` pays one for
+    good, so it can no longer be expired.
+    """
+    sessions = {}
+    latency = 0.0
+
+    def find(self, session_id: str):
+        for entry in self.sessions.values():
+            if entry["session"].id == session_id:
+                return entry
+        return None
+
+    def complete(self, session_id: str) -> None:
+        self.find(session_id)["completed"] = True
+
+    def create_checkout_session(
+        self,
+        line_items: list,
+        success_url: str,
+        cancel_url: str,
+        idempotency_key: str,
+    ) -> CheckoutSession:
+        time.sleep(self.latency)
+        if idempotency_key not in self.sessions:
+            session_id = f"cs_test_{uuid.uuid4().hex}"
+            self.sessions[idempotency_key] = {
+                "session": CheckoutSession(
+                    session_id, f"https://checkout.stripe.test/pay/{session_id}"
+                ),
+                "line_items": line_items,
+                "success_url": success_url,
+                "cancel_url": cancel_url,
+            }
+        return self.sessions[idempotency_key]["session"]
+
+    def expire_checkout_session(self, session_id: str) -> None:
+        time.sleep(self.latency)
+        entry = self.find(session_id)
+        if entry is not None and not entry.get("completed"):
+            entry["expired"] = True
+
+    async def aexpire_checkout_session(self, session_id: str) -> None:
+        await asyncio.sleep(self.latency)
+        entry = self.find(session_id)
+        if entry is not None and not entry.get("completed"):
+            entry["expired"] = True
+
+    def session_is_paid(self, session_id: str) -> bool:
+        time.sleep(self.latency)
+        entry = self.find(session_id)
+        if entry is None:
+            return False
+        return entry.get("completed", False) or not entry.get("expired")
+
+    async def asession_is_paid(self, session_id: str) -> bool:
+        await asyncio.sleep(self.latency)
+        entry = self.find(session_id)
+        if entry is None:
+            return False
+        return entry.get("completed", False) or not entry.get("expired")
+
+
+def get_payment_gateway():
+    return import_string(settings.PAYMENT_GATEWAY)()
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0004_hot_filter_indexes"),
+        ("payments_service", "0002_alter_payment_session_id"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["borrowing", "status"], name="payment_borrowing_status_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="borrowing",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="borrow_service.borrow",
+            ),
+        ),
+    ]
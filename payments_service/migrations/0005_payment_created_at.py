@@ -0,0 +1,32 @@
+# Generated by Django 5.0.8 on 2026-10-18 21:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments_service", "0004_stripe_event_inbox"),
+    ]
+
+    operations = [
+        # Payments created before the column existed start their payment
+        # window when it is added.
+        migrations.AddField(
+            model_name="payment",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING"), ("type", "PAYMENT")),
+                fields=["created_at"],
+                name="payment_pending_created_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.0.8 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+COLUMNS = (
+    "id, status, type, session_url, session_id, money_to_pay, borrowing_id,"
+    " user_id, created_at, version, updated_at"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0007_borrow_history"),
+        ("payments_service", "0006_row_version"),
+    ]
+
+    operations = [
+        # Partitioned by year of creation, filled together with
+        # borrow_service_borrow_history. The user of the borrow is copied
+        # along so a user's history is read from one index.
+        migrations.RunSQL(
+            """
+            CREATE TABLE payments_service_payment_history (
+                id bigint NOT NULL,
+                status varchar(20) NOT NULL,
+                type varchar(20) NOT NULL,
+                session_url varchar(500) NOT NULL,
+                session_id varchar(500) NOT NULL,
+                money_to_pay numeric(10, 2) NOT NULL,
+                borrowing_id bigint NOT NULL,
+                user_id bigint NOT NULL,
+                created_at timestamp with time zone NOT NULL,
+                version integer NOT NULL,
+                updated_at timestamp with time zone NOT NULL,
+                archived_at timestamp with time zone NOT NULL DEFAULT now(),
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            CREATE INDEX payment_history_user_idx
+                ON payments_service_payment_history (user_id, id);
+            CREATE INDEX payment_history_borrowing_idx
+                ON payments_service_payment_history (borrowing_id);
+            """,
+            "DROP TABLE payments_service_payment_history",
+        ),
+        migrations.RunSQL(
+            f"""
+            CREATE VIEW payments_service_payment_record AS
+                SELECT
+                    payment.id, payment.status, payment.type,
+                    payment.session_url, payment.session_id,
+                    payment.money_to_pay, payment.borrowing_id, borrow.user_id,
+                    payment.created_at, payment.version, payment.updated_at,
+                    false AS archived
+                FROM payments_service_payment AS payment
+                JOIN borrow_service_borrow AS borrow
+                    ON borrow.id = payment.borrowing_id
+                UNION ALL
+                SELECT {COLUMNS}, true FROM payments_service_payment_history
+            """,
+            "DROP VIEW payments_service_payment_record",
+        ),
+        migrations.CreateModel(
+            name="PaymentRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("PENDING", "Pending"), ("PAID", "Paid")],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[("PAYMENT", "Payment"), ("FINE", "Fine")],
+                        max_length=20,
+                    ),
+                ),
+                ("session_url", models.URLField(max_length=500)),
+                ("session_id", models.CharField(max_length=500)),
+                ("money_to_pay", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("created_at", models.DateTimeField()),
+                ("version", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField()),
+                ("archived", models.BooleanField()),
+            ],
+            options={
+                "db_table": "payments_service_payment_record",
+                "managed": False,
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.8 on 2026-10-18 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrow_service", "0009_drop_reservation_expiry_index"),
+        ("payments_service", "0007_payment_history"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["session_id"],
+                name="payment_pending_session_idx",
+            ),
+        ),
+    ]
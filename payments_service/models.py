@@ -1,9 +1,11 @@
+from django.contrib.auth import get_user_model
 from django.db import models
 
-from borrow_service.models import Borrow
+from borrow_service.models import Borrow, BorrowRecord
+from library_service.versioning import VersionedModel
 
 
-class Payment(models.Model):
+class Payment(VersionedModel):
     class Status(models.TextChoices):
         PENDING = "PENDING"
         PAID = "PAID"
@@ -14,7 +16,85 @@ class Payment(models.Model):
 
     status = models.CharField(max_length=20, choices=Status.choices)
     type = models.CharField(max_length=20, choices=Type.choices)
-    borrowing = models.ForeignKey(Borrow, on_delete=models.CASCADE)
+    borrowing = models.ForeignKey(Borrow, on_delete=models.CASCADE, db_index=False)
     session_url = models.URLField(max_length=500)
     session_id = models.CharField(max_length=500)
     money_to_pay = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["borrowing", "status"],
+                name="payment_borrowing_status_idx",
+            ),
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status="PENDING", type="PAYMENT"),
+                name="payment_pending_created_idx",
+            ),
+            models.Index(
+                fields=["session_id"],
+                condition=models.Q(status="PENDING"),
+                name="payment_pending_session_idx",
+            ),
+        ]
+
+
+class PaymentRecord(models.Model):
+    """
+    Read-only view of every payment, hot and archived, see `BorrowRecord`.
+    Carries the user of the borrow so history is filtered without a join.
+    """
+    status = models.CharField(max_length=20, choices=Payment.Status.choices)
+    type = models.CharField(max_length=20, choices=Payment.Type.choices)
+    borrowing = models.ForeignKey(
+        BorrowRecord, on_delete=models.DO_NOTHING, related_name="+"
+    )
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.DO_NOTHING, related_name="+"
+    )
+    session_url = models.URLField(max_length=500)
+    session_id = models.CharField(max_length=500)
+    money_to_pay = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    version = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = "payments_service_payment_record"
+
+
+class StripeEvent(models.Model):
+    """
+    A Stripe webhook event waiting in the inbox. Events are stored once per
+    Stripe event id and applied in batches by a Celery worker.
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING"
+        PROCESSED = "PROCESSED"
+        IGNORED = "IGNORED"
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    session_id = models.CharField(max_length=500, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status="PENDING"),
+                name="stripe_event_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} - {self.type} - {self.status}"
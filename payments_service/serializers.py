@@ -2,9 +2,14 @@ from rest_framework import serializers
 
 from payments_service.models import Payment
 from borrow_service.serializers import BorrowRetrieveSerializer
+from library_service.serializers import EagerLoadingMixin, TimedSerializerMixin
 
 
-class PaymentListSerializer(serializers.ModelSerializer):
+class PaymentListSerializer(TimedSerializerMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    # Only the ETag reads the borrowing and its book.
+    select_related_fields = ("borrowing__book",)
+    deferred_fields = ("borrowing__book__search_vector",)
+
     class Meta:
         model = Payment
         fields = (
@@ -18,8 +23,10 @@ class PaymentListSerializer(serializers.ModelSerializer):
         )
 
 
-class PaymentRetrieveSerializer(serializers.ModelSerializer):
+class PaymentRetrieveSerializer(TimedSerializerMixin, EagerLoadingMixin, serializers.ModelSerializer):
     borrowing = BorrowRetrieveSerializer(read_only=True)
+    select_related_fields = ("borrowing__book", "borrowing__user")
+    deferred_fields = ("borrowing__book__search_vector",)
 
     class Meta:
         model = Payment
@@ -0,0 +1,220 @@
+"""
+Applying the outcome of checkout sessions.
+
+Both the browser redirects and the Stripe webhook settle payments through
+these functions. They lock the payments that are still pending and apply
+them with set-based updates in one transaction, so a session reported more
+than once, or by both channels, is only applied once.
+"""
+import datetime
+import itertools
+import logging
+from collections import Counter, defaultdict
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from borrow_service.models import Borrow
+from borrow_service.reservations import confirm_holds, release_holds, return_copies
+from notifications_service.views import queue_telegram_message
+from payments_service.gateway import get_payment_gateway
+from payments_service.models import Payment
+from user_service.summary import adjust_summary
+
+logger = logging.getLogger(__name__)
+
+
+def borrowed_message(borrows: list) -> str:
+    if len(borrows) == 1:
+        borrow = borrows[0]
+        return (
+            f"{borrow.user.email}\nhas borrowed book: `{borrow.book.title}`"
+            f"\ntill {borrow.expected_return_date}"
+        )
+    lines = [
+        f"`{borrow.book.title}` till {borrow.expected_return_date}"
+        for borrow in borrows
+    ]
+    return f"{borrows[0].user.email}\nhas borrowed {len(borrows)} books:\n" + "\n".join(lines)
+
+
+def returned_message(borrows: list) -> str:
+    if len(borrows) == 1:
+        borrow = borrows[0]
+        return (
+            f"{borrow.user.email}\nhas returned book: `{borrow.book.title}`"
+            f"\nexpected return date is : {borrow.expected_return_date}"
+            f"\nactual return date is : {borrow.actual_return_date}"
+        )
+    lines = [
+        f"`{borrow.book.title}` expected return date is : {borrow.expected_return_date}"
+        for borrow in borrows
+    ]
+    return (
+        f"{borrows[0].user.email}\nhas returned {len(borrows)} books "
+        f"on {borrows[0].actual_return_date}:\n" + "\n".join(lines)
+    )
+
+
+def lock_pending(payments: list, **filters) -> list:
+    """
+    Locks the payments that are still pending and returns them in id order.
+    A concurrent settlement of the same payments waits and then finds none.
+    """
+    pending = set(
+        Payment.objects.select_for_update()
+        .filter(
+            pk__in=[payment.pk for payment in payments],
+            status=Payment.Status.PENDING,
+            **filters,
+        )
+        .values_list("id", flat=True)
+    )
+    return sorted(
+        (payment for payment in payments if payment.pk in pending),
+        key=lambda payment: payment.pk,
+    )
+
+
+def settle_payments(payments: list) -> list:
+    """
+    Marks the pending payments among `payments` as paid with one UPDATE:
+    held copies of paid borrows are confirmed, borrows whose fines are paid
+    are returned and one notification is queued per checkout session.
+    Payments need `borrowing__book` and `borrowing__user` loaded. Returns
+    the payments that were settled.
+    """
+    with transaction.atomic():
+        settled = lock_pending(payments)
+        if not settled:
+            return []
+        Payment.objects.filter(
+            pk__in=[payment.pk for payment in settled]
+        ).update(status=Payment.Status.PAID)
+        rentals = [p.borrowing for p in settled if p.type == Payment.Type.PAYMENT]
+        fined = [p.borrowing for p in settled if p.type == Payment.Type.FINE]
+        if rentals:
+            confirm_holds(rentals)
+        if fined:
+            return_copies(fined, datetime.date.today())
+
+        fines_by_user = defaultdict(int)
+        for payment in settled:
+            payment.status = Payment.Status.PAID
+            if payment.type == Payment.Type.FINE:
+                fines_by_user[payment.borrowing.user_id] += payment.money_to_pay
+        for user_id, amount in fines_by_user.items():
+            adjust_summary(user_id, unpaid_fines=-amount)
+
+        sessions = itertools.groupby(
+            sorted(settled, key=lambda p: (p.session_id, p.type, p.pk)),
+            key=lambda p: (p.session_id or p.pk, p.type),
+        )
+        for (_, payment_type), group in sessions:
+            borrows = [payment.borrowing for payment in group]
+            if payment_type == Payment.Type.FINE:
+                queue_telegram_message(returned_message(borrows))
+            else:
+                queue_telegram_message(borrowed_message(borrows))
+    return settled
+
+
+def discard_payments(payments: list) -> dict:
+    """
+    Deletes the borrows of unpaid rental payments, e.g. of a cancelled or
+    expired checkout, together with the payments, and puts their held
+    copies back. Returns how many payments were discarded and copies
+    released.
+    """
+    with transaction.atomic():
+        discarded = lock_pending(payments, type=Payment.Type.PAYMENT)
+        if not discarded:
+            return {"payments": 0, "copies": 0}
+        borrows = [payment.borrowing for payment in discarded]
+        released = release_holds(borrows)
+        Borrow.objects.filter(pk__in=[borrow.pk for borrow in borrows]).delete()
+        active = Counter(b.user_id for b in borrows if b.actual_return_date is None)
+        for user_id, count in Counter(borrow.user_id for borrow in borrows).items():
+            adjust_summary(user_id, active=-active[user_id], lifetime=-count)
+    return {"payments": len(discarded), "copies": released}
+
+
+def expire_sessions(session_ids) -> tuple[set, set]:
+    """
+    Expires checkout sessions at Stripe so they can no longer be paid, then
+    asks which of them were paid before that. Stripe refuses to expire a
+    completed session, so the answer is final. Returns the paid sessions and
+    the ones Stripe could not be asked about.
+    """
+    gateway = get_payment_gateway()
+    paid, unknown = set(), set()
+    for session_id in sorted(session_ids):
+        try:
+            gateway.expire_checkout_session(session_id)
+            if gateway.session_is_paid(session_id):
+                paid.add(session_id)
+        except stripe.StripeError:
+            logger.warning("Could not expire checkout session %s", session_id, exc_info=True)
+            unknown.add(session_id)
+    return paid, unknown
+
+
+def expire_pending_payments(now=None, batch_size: int = 500) -> dict:
+    """
+    Reclaims rental payments still pending `PAYMENT_HOLD_TTL` after they were
+    created, oldest first in batches of `batch_size` found through the
+    partial index on pending payments. The checkout sessions of a batch are
+    expired at Stripe first: payments of a session paid in the meantime,
+    whose webhook is late, are settled and the others discarded with
+    set-based updates. Payments of sessions Stripe could not be asked about
+    are left for the next run. Returns what was settled, reclaimed and
+    skipped, and how many sessions were expired.
+    """
+    cutoff = (now or timezone.now()) - settings.PAYMENT_HOLD_TTL
+    stats = {"payments": 0, "copies": 0, "settled": 0, "skipped": 0, "sessions": 0}
+    after = Q()
+    while True:
+        batch = list(
+            Payment.objects.select_related("borrowing__book", "borrowing__user")
+            .filter(
+                after,
+                status=Payment.Status.PENDING,
+                type=Payment.Type.PAYMENT,
+                created_at__lte=cutoff,
+            )
+            .order_by("created_at", "id")[:batch_size]
+        )
+        if not batch:
+            break
+        last = batch[-1]
+        after = Q(created_at__gt=last.created_at) | Q(
+            created_at=last.created_at, id__gt=last.id
+        )
+        sessions = {payment.session_id for payment in batch if payment.session_id}
+        paid, unknown = expire_sessions(sessions)
+        with transaction.atomic():
+            # A session stored after the batch was loaded has not been
+            # expired, so its payments wait for the next run.
+            current = dict(
+                Payment.objects.select_for_update()
+                .filter(pk__in=[payment.pk for payment in batch])
+                .values_list("id", "session_id")
+            )
+            ready = [
+                payment for payment in batch
+                if current.get(payment.pk) == payment.session_id
+                and payment.session_id not in unknown
+            ]
+            settled = settle_payments([p for p in ready if p.session_id in paid])
+            reclaimed = discard_payments([p for p in ready if p.session_id not in paid])
+        stats["payments"] += reclaimed["payments"]
+        stats["copies"] += reclaimed["copies"]
+        stats["settled"] += len(settled)
+        stats["skipped"] += sum(1 for p in batch if p.pk in current) - len(ready)
+        stats["sessions"] += len(sessions) - len(unknown)
+        if len(batch) < batch_size:
+            break
+    return stats
@@ -0,0 +1,233 @@
+import hashlib
+import logging
+import time
+
+import stripe
+from celery import shared_task
+from django.conf import settings
+from django.core.signing import Signer
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from payments_service.gateway import get_payment_gateway
+from payments_service.models import Payment, StripeEvent
+from payments_service.settlement import (
+    discard_payments,
+    expire_pending_payments,
+    settle_payments,
+)
+
+logger = logging.getLogger(__name__)
+
+PAID_EVENTS = {
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+}
+EXPIRED_EVENTS = {"checkout.session.expired"}
+
+
+def checkout_line_item(payment: Payment) -> dict:
+    if payment.type == Payment.Type.FINE:
+        name = "fine for overdue"
+    else:
+        name = payment.borrowing.book.title
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": name,
+            },
+            "unit_amount": int(payment.money_to_pay) * 100,
+        },
+        "quantity": 1,
+    }
+
+
+def cancel_signature(payment_id: int) -> str:
+    """
+    Signs the cancel url of a checkout, so only the patron sent back from
+    Stripe can cancel it, not anyone counting payment ids.
+    """
+    return Signer(salt="payments.cancel").signature(str(payment_id))
+
+
+def is_cancel_signature(payment_id: int, signature: str) -> bool:
+    return constant_time_compare(cancel_signature(payment_id), signature)
+
+
+def checkout_redirect_urls(payment: Payment) -> tuple[str, str]:
+    base_url = settings.PAYMENT_REDIRECT_BASE_URL
+    if payment.type == Payment.Type.FINE:
+        return (
+            f"{base_url}/api/v1/success/fine/{payment.id}/",
+            f"{base_url}/api/v1/cancel/fine/",
+        )
+    return (
+        f"{base_url}/api/v1/success/payment/{payment.id}/",
+        f"{base_url}/api/v1/cancel/payment/{payment.id}/"
+        f"?signature={cancel_signature(payment.id)}",
+    )
+
+
+def open_checkout_session(payments: list, idempotency_key: str) -> str:
+    """
+    Creates one Stripe checkout session with a line item per payment and
+    stores it on all of them. The first payment's redirect urls are used;
+    its success and cancel views settle the whole session. A session
+    opened for payments discarded in the meantime is expired right away.
+    """
+    success_url, cancel_url = checkout_redirect_urls(payments[0])
+    gateway = get_payment_gateway()
+    session = gateway.create_checkout_session(
+        line_items=[checkout_line_item(payment) for payment in payments],
+        success_url=success_url,
+        cancel_url=cancel_url,
+        idempotency_key=idempotency_key,
+    )
+    updated = Payment.objects.filter(
+        pk__in=[payment.pk for payment in payments], session_id=""
+    ).update(
+        session_id=session.id,
+        session_url=session.url,
+    )
+    if not updated and not Payment.objects.filter(
+        pk__in=[payment.pk for payment in payments]
+    ).exists():
+        # The checkout was discarded while the session was being created.
+        gateway.expire_checkout_session(session.id)
+    return session.id
+
+
+@shared_task(
+    autoretry_for=(stripe.APIConnectionError, stripe.RateLimitError),
+    retry_backoff=True,
+    max_retries=5,
+)
+def create_checkout_session(payment_id: int):
+    """
+    Creates the Stripe checkout session of a pending payment and stores its
+    url and id. The idempotency key is derived from the payment, so retried
+    or duplicated tasks always get the same session back from Stripe.
+    """
+    payment = Payment.objects.select_related("borrowing__book").get(pk=payment_id)
+    if payment.session_id:
+        return payment.session_id
+
+    return open_checkout_session(
+        [payment], idempotency_key=f"checkout-session-payment-{payment.id}"
+    )
+
+
+@shared_task(
+    autoretry_for=(stripe.APIConnectionError, stripe.RateLimitError),
+    retry_backoff=True,
+    max_retries=5,
+)
+def create_combined_checkout_session(payment_ids: list[int]):
+    """
+    Creates a single checkout session covering several pending payments, e.g.
+    a stack of books borrowed at once. The idempotency key is derived from
+    the set of payments.
+    """
+    payments = list(
+        Payment.objects.select_related("borrowing__book")
+        .filter(pk__in=payment_ids)
+        .order_by("id")
+    )
+    if not payments:
+        return None
+    if all(payment.session_id for payment in payments):
+        return payments[0].session_id
+
+    digest = hashlib.sha256(
+        ",".join(str(payment.id) for payment in payments).encode()
+    ).hexdigest()[:16]
+    return open_checkout_session(
+        payments,
+        idempotency_key=f"checkout-session-payments-{payments[0].id}-{digest}",
+    )
+
+
+def is_paid(event: StripeEvent) -> bool:
+    if event.type not in PAID_EVENTS:
+        return False
+    # Delayed payment methods complete the session unpaid and report the
+    # payment later with async_payment_succeeded.
+    session = event.payload["data"].get("object", {})
+    return session.get("payment_status", "paid") != "unpaid"
+
+
+def process_event_batch(batch_size: int) -> dict:
+    """
+    Applies a batch of pending inbox events in one transaction: the
+    payments of every paid session are settled and the unpaid borrows of
+    every expired session discarded, each with set-based updates. Their
+    payments are found through the partial index on pending session ids, so
+    a batch costs O(batch size). Events of other types are marked as ignored.
+    """
+    with transaction.atomic():
+        batch = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=StripeEvent.Status.PENDING)
+            .order_by("id")[:batch_size]
+        )
+        paid = {event.session_id for event in batch if is_paid(event)}
+        expired = {
+            event.session_id for event in batch if event.type in EXPIRED_EVENTS
+        } - paid
+        payments = list(
+            Payment.objects.select_related("borrowing__book", "borrowing__user")
+            .filter(session_id__in=paid | expired, status=Payment.Status.PENDING)
+        )
+        settled = settle_payments([p for p in payments if p.session_id in paid])
+        discarded = discard_payments([p for p in payments if p.session_id in expired])
+
+        handled = [
+            event.id for event in batch
+            if is_paid(event)
+            or (event.type in EXPIRED_EVENTS and event.session_id in expired)
+        ]
+        now = timezone.now()
+        StripeEvent.objects.filter(id__in=handled).update(
+            status=StripeEvent.Status.PROCESSED, processed_at=now
+        )
+        StripeEvent.objects.filter(
+            id__in=[event.id for event in batch]
+        ).exclude(id__in=handled).update(
+            status=StripeEvent.Status.IGNORED, processed_at=now
+        )
+    return {
+        "events": len(batch),
+        "ignored": len(batch) - len(handled),
+        "payments_settled": len(settled),
+        "payments_discarded": discarded["payments"],
+    }
+
+
+@shared_task(bind=True)
+def process_stripe_events(self):
+    """
+    Drains a batch of the Stripe event inbox and reschedules itself while
+    full batches keep coming.
+    """
+    metrics = process_event_batch(settings.STRIPE_EVENT_BATCH_SIZE)
+    logger.info("Stripe events: %s", metrics)
+    if metrics["events"] == settings.STRIPE_EVENT_BATCH_SIZE:
+        self.delay()
+    return metrics
+
+
+@shared_task
+def sweep_expired_payments() -> dict:
+    """
+    Reclaims abandoned checkouts: rental payments left pending past the
+    payment window have their Stripe sessions expired, then are deleted with
+    their borrows and held copies go back on the shelf. Sessions paid just
+    before the window closed are settled instead.
+    """
+    started = time.monotonic()
+    stats = expire_pending_payments(batch_size=settings.PAYMENT_SWEEP_BATCH_SIZE)
+    stats["duration_s"] = round(time.monotonic() - started, 3)
+    logger.info("Expired payment sweep: %s", stats)
+    return stats
@@ -1,15 +1,37 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+import stripe
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from book_service.models import Book
-from borrow_service.models import Borrow
-from payments_service.models import Payment
+from borrow_service.models import Borrow, Reservation
+from borrow_service.reservations import reserve_books
+from library_service.benchmark import run_latency_benchmark
+from library_service.testing import QueryBudgetMixin
+from notifications_service.models import Notification
+from payments_service.gateway import FakeStripeGateway
+from payments_service.models import Payment, StripeEvent
+from payments_service.tasks import (
+    cancel_signature,
+    create_checkout_session,
+    open_checkout_session,
+    sweep_expired_payments,
+)
+from payments_service.webhooks import sign_payload
 
 payment_url = reverse("payment_service:payments-list")
+webhook_url = reverse("payment_service:stripe-webhook")
 
 
 def create_borrow(book, user) -> Borrow:
@@ -48,6 +70,15 @@ def detail_url(borrow_id):
     return reverse("payment_service:payments-retrieve", args=[borrow_id])
 
 
+def checkout_url(payment_id):
+    return reverse("payment_service:payments-checkout", args=[payment_id])
+
+
+def cancel_url(payment_id):
+    url = reverse("payment_service:payments-cancel", args=[payment_id])
+    return f"{url}?signature={cancel_signature(payment_id)}"
+
+
 class TestUnauthenticatedUserPayments(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -108,3 +139,425 @@ class TestAuthenticatedUserPayment(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         res = self.client.get(url3)
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unchanged_payment_is_not_modified(self):
+        payment = create_payment(1, create_borrow(create_book(1), self.user))
+        url = detail_url(payment.pk)
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Payment.objects.filter(pk=payment.pk).update(status="PENDING")
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "PENDING")
+        # A conditional GET of someone else's payment is still a 404.
+        other = create_payment(2, create_borrow(create_book(2), self.user2))
+        res = self.client.get(detail_url(other.pk), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_replaced_payment_is_modified(self):
+        book = create_book(1)
+        payment = create_payment(1, create_borrow(book, self.user))
+        etag = self.client.get(payment_url)["ETag"]
+
+        # A cancelled checkout followed by a new borrow: the new rows start
+        # at the same versions as the deleted ones.
+        payment.borrowing.delete()
+        replacement = create_payment(2, create_borrow(book, self.user))
+        res = self.client.get(payment_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["id"] for row in res.data], [replacement.id])
+
+
+@override_settings(PAYMENT_GATEWAY="payments_service.gateway.FakeStripeGateway")
+class TestCheckoutSessionPipeline(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = create_book(1)
+
+    def borrow_book(self):
+        return_date = datetime.date.today() + datetime.timedelta(days=2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.client.post(
+                reverse("borrow_service:borrows"),
+                {"book": self.book.id, "expected_return_date": str(return_date)},
+            )
+        return res, callbacks
+
+    def test_borrow_returns_pending_payment_immediately(self):
+        with patch("payments_service.views.create_checkout_session.delay") as delay:
+            res, callbacks = self.borrow_book()
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data["status"], "PENDING")
+        self.assertEqual(res.data["session_url"], "")
+        self.assertEqual(res["Location"], checkout_url(res.data["id"]))
+        delay.assert_called_once_with(res.data["id"])
+
+    def test_checkout_waits_for_session_then_redirects(self):
+        res, _ = self.borrow_book()
+        payment_id = res.data["id"]
+
+        res = self.client.get(checkout_url(payment_id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res["Retry-After"], "1")
+
+        create_checkout_session(payment_id)
+
+        payment = Payment.objects.get(pk=payment_id)
+        res = self.client.get(checkout_url(payment_id))
+        self.assertEqual(res.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(res["Location"], payment.session_url)
+
+    def test_retried_task_reuses_session(self):
+        res, _ = self.borrow_book()
+        payment_id = res.data["id"]
+
+        session_id = create_checkout_session(payment_id)
+        Payment.objects.filter(pk=payment_id).update(session_id="", session_url="")
+        self.assertEqual(create_checkout_session(payment_id), session_id)
+
+        session = FakeStripeGateway.sessions[
+            f"checkout-session-payment-{payment_id}"
+        ]
+        self.assertEqual(session["line_items"][0]["price_data"]["unit_amount"], 2000)
+
+    def test_success_requires_a_paid_session(self):
+        res, _ = self.borrow_book()
+        payment_id = res.data["id"]
+        success_url = reverse("payment_service:payments-success", args=[payment_id])
+
+        res = self.client.get(success_url)
+        self.assertEqual(res.status_code, status.HTTP_402_PAYMENT_REQUIRED)
+
+        create_checkout_session(payment_id)
+        with patch("notifications_service.views.deliver_notifications.delay"):
+            res = self.client.get(success_url)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Payment.objects.get(pk=payment_id).status, "PAID")
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_cancel_expires_the_stripe_session(self):
+        res, _ = self.borrow_book()
+        payment_id = res.data["id"]
+        create_checkout_session(payment_id)
+
+        res = self.client.get(
+            reverse("payment_service:payments-cancel", args=[payment_id])
+        )
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = self.client.get(cancel_url(payment_id))
+
+        self.assertEqual(res.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertFalse(Payment.objects.filter(pk=payment_id).exists())
+        session = FakeStripeGateway.sessions[f"checkout-session-payment-{payment_id}"]
+        self.assertTrue(session["expired"])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 100)
+
+    def test_cancel_of_a_paid_session_settles_it(self):
+        res, _ = self.borrow_book()
+        payment_id = res.data["id"]
+        session_id = create_checkout_session(payment_id)
+        # Paid at Stripe, the webhook still waiting in the inbox.
+        FakeStripeGateway().complete(session_id)
+
+        with patch("notifications_service.views.deliver_notifications.delay"):
+            res = self.client.get(cancel_url(payment_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Payment.objects.get(pk=payment_id).status, "PAID")
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 99)
+
+
+class TestPaymentQueryBudget(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = create_book(1)
+        self.payments = []
+
+    def seed(self, size):
+        for _ in range(size):
+            borrow = create_borrow(self.book, self.user)
+            self.payments.append(create_payment(len(self.payments), borrow))
+
+    def test_list_payments(self):
+        self.assertQueryBudget(1, lambda: self.client.get(payment_url), self.seed)
+
+    def test_list_payments_paginated(self):
+        self.assertQueryBudget(
+            1, lambda: self.client.get(payment_url, {"page_size": 100}), self.seed
+        )
+
+    def test_retrieve_payment(self):
+        self.assertQueryBudget(
+            1, lambda: self.client.get(detail_url(self.payments[-1].pk)), self.seed
+        )
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class TestStripeWebhook(TestCase):
+    fixture_path = settings.BASE_DIR / "benchmarks" / "stripe_webhook_events.jsonl"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.books = [create_book(pk) for pk in range(4)]
+        self.due = datetime.date.today() + datetime.timedelta(days=2)
+
+    def rent(self, books, session_id) -> list:
+        borrows = reserve_books(
+            [book.id for book in books], user=self.user, expected_return_date=self.due
+        )
+        return Payment.objects.bulk_create(
+            Payment(
+                status="PENDING", type="PAYMENT", borrowing=borrow,
+                session_id=session_id, money_to_pay=20,
+            )
+            for borrow in borrows
+        )
+
+    def post_event(self, payload: str, signature=None):
+        return self.client.post(
+            webhook_url,
+            data=payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature or sign_payload(payload, "whsec_test"),
+        )
+
+    def inventory(self) -> list:
+        return list(Book.objects.order_by("id").values_list("inventory", flat=True))
+
+    def test_rejects_unsigned_events(self):
+        payload = self.fixture_path.read_text().splitlines()[0]
+
+        res = self.post_event(payload, signature=sign_payload(payload, "whsec_other"))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_redelivered_event_is_stored_once(self):
+        payload = self.fixture_path.read_text().splitlines()[0]
+
+        with patch(
+            "payments_service.webhooks.process_stripe_events.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                self.assertEqual(self.post_event(payload).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(StripeEvent.objects.get().session_id, "cs_test_fixture_rental")
+        self.assertEqual(delay.call_count, 2)
+
+    def test_replayed_fixture_settles_each_session_once(self):
+        rentals = self.rent(self.books[:2], "cs_test_fixture_rental")
+        abandoned = self.rent(self.books[2:3], "cs_test_fixture_abandoned")
+        self.rent(self.books[3:], "cs_test_fixture_async")
+        overdue = Borrow.objects.create(
+            book=self.books[0], user=self.user,
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=1),
+        )
+        fine = Payment.objects.create(
+            status="PENDING", type="FINE", borrowing=overdue,
+            session_id="cs_test_fixture_fine", money_to_pay=2,
+        )
+
+        out = StringIO()
+        call_command("benchmark_webhooks", str(self.fixture_path), stdout=out)
+
+        self.assertIn("Processed 6 events", out.getvalue())
+        self.assertEqual(
+            set(Payment.objects.values_list("status", flat=True)), {"PAID"}
+        )
+        self.assertFalse(Borrow.objects.filter(pk=abandoned[0].borrowing_id).exists())
+        self.assertEqual(
+            Reservation.objects.filter(status=Reservation.Status.CONFIRMED).count(), 3
+        )
+        overdue.refresh_from_db()
+        self.assertEqual(overdue.actual_return_date, datetime.date.today())
+        self.assertEqual(self.inventory(), [100, 99, 100, 99])
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(
+            dict(StripeEvent.objects.values_list("event_id", "status")),
+            {
+                "evt_fixture_rental": "PROCESSED",
+                "evt_fixture_fine": "PROCESSED",
+                "evt_fixture_abandoned": "PROCESSED",
+                "evt_fixture_async_completed": "IGNORED",
+                "evt_fixture_async_succeeded": "PROCESSED",
+                "evt_fixture_charge": "IGNORED",
+            },
+        )
+
+        # Replays and late browser redirects find nothing left to apply.
+        call_command("benchmark_webhooks", str(self.fixture_path), stdout=StringIO())
+        with patch("notifications_service.views.deliver_notifications.delay"):
+            self.client.get(
+                reverse("payment_service:payments-success", args=[rentals[0].id])
+            )
+            self.client.get(reverse("payment_service:fine-success", args=[fine.id]))
+
+        self.assertEqual(self.inventory(), [100, 99, 100, 99])
+        self.assertEqual(Notification.objects.count(), 3)
+
+
+@override_settings(PAYMENT_GATEWAY="payments_service.gateway.FakeStripeGateway")
+class TestExpiredPaymentSweep(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.book = create_book(1)
+        self.due = datetime.date.today() + datetime.timedelta(days=2)
+        self.gateway = FakeStripeGateway()
+
+    def open_session(self, key: str) -> str:
+        return self.gateway.create_checkout_session(
+            line_items=[], success_url="", cancel_url="", idempotency_key=key
+        ).id
+
+    def rent(self, count, session_id, age=datetime.timedelta()) -> list:
+        borrows = reserve_books(
+            [self.book.id] * count, user=self.user, expected_return_date=self.due
+        )
+        payments = Payment.objects.bulk_create(
+            Payment(
+                status="PENDING", type="PAYMENT", borrowing=borrow,
+                session_id=session_id, money_to_pay=20,
+            )
+            for borrow in borrows
+        )
+        Payment.objects.filter(pk__in=[p.pk for p in payments]).update(
+            created_at=timezone.now() - age
+        )
+        return payments
+
+    def test_reclaims_abandoned_checkouts(self):
+        session_id = self.open_session(f"sweep-abandoned-{self.id()}")
+        abandoned = self.rent(2, session_id, age=datetime.timedelta(hours=25))
+        fresh = self.rent(1, "cs_fresh", age=datetime.timedelta(hours=1))
+        legacy = Borrow.objects.create(
+            book=self.book, user=self.user, expected_return_date=self.due
+        )
+        Payment.objects.create(
+            status="PENDING", type="PAYMENT", borrowing=legacy, money_to_pay=20
+        )
+        Payment.objects.filter(borrowing=legacy).update(
+            created_at=timezone.now() - datetime.timedelta(days=3)
+        )
+        fine = Payment.objects.create(
+            status="PENDING", type="FINE", borrowing=fresh[0].borrowing, money_to_pay=2
+        )
+        Payment.objects.filter(pk=fine.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=3)
+        )
+
+        stats = sweep_expired_payments()
+
+        self.assertEqual(
+            {key: stats[key] for key in ("payments", "copies", "settled", "sessions")},
+            {"payments": 3, "copies": 2, "settled": 0, "sessions": 1},
+        )
+        self.assertTrue(self.gateway.find(session_id)["expired"])
+        self.assertFalse(
+            Borrow.objects.filter(
+                pk__in=[abandoned[0].borrowing_id, abandoned[1].borrowing_id, legacy.pk]
+            ).exists()
+        )
+        self.assertEqual(
+            set(Payment.objects.values_list("id", flat=True)), {fresh[0].id, fine.id}
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 99)
+        self.assertEqual(sweep_expired_payments()["payments"], 0)
+
+    def test_paid_session_with_late_webhook_is_settled(self):
+        session_id = self.open_session(f"sweep-paid-{self.id()}")
+        self.gateway.complete(session_id)
+        payments = self.rent(2, session_id, age=datetime.timedelta(hours=25))
+
+        with patch("notifications_service.views.deliver_notifications.delay"):
+            stats = sweep_expired_payments()
+
+        self.assertEqual((stats["settled"], stats["payments"]), (2, 0))
+        self.assertEqual(
+            set(Payment.objects.filter(pk__in=[p.pk for p in payments])
+                .values_list("status", flat=True)),
+            {"PAID"},
+        )
+        self.assertEqual(
+            set(Reservation.objects.values_list("status", flat=True)), {"CONFIRMED"}
+        )
+
+    def test_sessions_stripe_cannot_expire_are_kept(self):
+        session_id = self.open_session(f"sweep-unreachable-{self.id()}")
+        payment = self.rent(1, session_id, age=datetime.timedelta(hours=25))[0]
+
+        with patch.object(
+            FakeStripeGateway,
+            "expire_checkout_session",
+            side_effect=stripe.APIConnectionError("down"),
+        ), self.assertLogs("payments_service.settlement", "WARNING"):
+            stats = sweep_expired_payments()
+
+        self.assertEqual((stats["skipped"], stats["payments"]), (1, 0))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "PENDING")
+
+    def test_session_opened_for_a_discarded_checkout_is_expired(self):
+        payment = self.rent(1, "", age=datetime.timedelta(hours=25))[0]
+        payment = Payment.objects.select_related("borrowing__book").get(pk=payment.pk)
+        sweep_expired_payments()
+
+        session_id = open_checkout_session([payment], f"sweep-late-{self.id()}")
+
+        self.assertTrue(self.gateway.find(session_id)["expired"])
+
+    def test_sweep_queries_do_not_grow_with_expired_payments(self):
+        self.rent(1, "cs_one", age=datetime.timedelta(hours=25))
+        with CaptureQueriesContext(connection) as one:
+            sweep_expired_payments()
+        self.rent(20, "cs_many", age=datetime.timedelta(hours=25))
+        with CaptureQueriesContext(connection) as many:
+            stats = sweep_expired_payments()
+
+        self.assertEqual(stats["payments"], 20)
+        self.assertEqual(len(many), len(one))
+
+
+class TestLatencyBenchmark(TransactionTestCase):
+    def test_event_loop_keeps_more_requests_in_flight(self):
+        report = run_latency_benchmark(
+            requests=6, threads=2, concurrency=6, stripe_latency=0.2
+        )
+
+        self.assertEqual(report["modes"]["threads"]["requests"], 6)
+        self.assertEqual(report["modes"]["asyncio"]["requests"], 6)
+        self.assertFalse(Payment.objects.filter(status="PENDING").exists())
+        self.assertGreater(
+            report["modes"]["asyncio"]["in_flight"],
+            report["modes"]["threads"]["in_flight"],
+        )
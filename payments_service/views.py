@@ -1,194 +1,336 @@
-import datetime
+import asyncio
 
 import stripe
-from django.conf import settings
+from adrf.decorators import api_view as async_api_view
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
 from django.http import Http404
-from django.shortcuts import redirect
-from drf_spectacular.utils import extend_schema
+from django.shortcuts import aget_object_or_404, redirect
+from django.urls import reverse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import status
-from rest_framework.decorators import api_view
-from rest_framework.generics import GenericAPIView
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+)
+from rest_framework.exceptions import APIException
+from rest_framework.generics import GenericAPIView, get_object_or_404
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from borrow_service.models import Borrow
+from borrow_service.archive import include_history
 from borrow_service.serializers import BorrowCreateSerializer, BorrowRetrieveSerializer
-from notifications_service.views import send_message_to_telegram_group
-from payments_service.models import Payment
+from library_service.pagination import IdCursorPagination, StreamingListMixin
+from library_service.versioning import ConditionalReadMixin
+from payments_service.gateway import get_payment_gateway
+from payments_service.models import Payment, PaymentRecord
 from payments_service.serializers import (
     PaymentListSerializer,
     PaymentRetrieveSerializer,
 )
+from payments_service.settlement import discard_payments, settle_payments
+from payments_service.tasks import (
+    create_checkout_session,
+    create_combined_checkout_session,
+    is_cancel_signature,
+)
+from payments_service.webhooks import receive_event
+
+
+HISTORY_PARAMETER = OpenApiParameter(
+    "include_history",
+    OpenApiTypes.BOOL,
+    description="Also read payments that were moved to the history tables",
+)
+
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+def payments_queryset(request, serializer_class):
+    """
+    The payments the user may read, hot only unless `include_history=true`.
+    """
+    if include_history(request):
+        queryset = PaymentRecord.objects.all()
+        if not request.user.is_staff:
+            queryset = queryset.filter(user=request.user)
+    else:
+        queryset = Payment.objects.all()
+        if not request.user.is_staff:
+            queryset = queryset.filter(borrowing__user=request.user)
+    return serializer_class.setup_eager_loading(queryset)
 
 
-class PaymentListView(ListModelMixin, GenericAPIView):
+class PaymentListView(
+    ConditionalReadMixin, StreamingListMixin, ListModelMixin, GenericAPIView
+):
     """
     A view for listing all payment records associated with the authenticated user.
     """
     queryset = Payment.objects.all()
     serializer_class = PaymentListSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
+    etag_fields = ("version", "borrowing__version", "borrowing__book__version")
 
     def get_queryset(self):
-        queryset = Payment.objects.all()
-        if not self.request.user.is_staff:
-            queryset = queryset.filter(borrowing__user=self.request.user)
-
-        return queryset
+        return payments_queryset(self.request, self.get_serializer_class())
 
     @extend_schema(
         summary="get all your patments",
+        parameters=[HISTORY_PARAMETER],
         responses={200: BorrowCreateSerializer(many=True)}
     )
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
-class PaymentRetrieveView(RetrieveModelMixin, GenericAPIView):
+class PaymentRetrieveView(ConditionalReadMixin, RetrieveModelMixin, GenericAPIView):
     """
     A view to retrieve a specific payment record associated with the authenticated user.
     """
     serializer_class = PaymentRetrieveSerializer
     permission_classes = (IsAuthenticated,)
+    etag_fields = (
+        "version",
+        "borrowing__version",
+        "borrowing__book__version",
+        "borrowing__user__email",
+    )
+
+    def get_queryset(self):
+        return payments_queryset(self.request, self.get_serializer_class())
 
     def get_object(self, *args, **kwargs):
-        queryset = Payment.objects.all()
-        if not self.request.user.is_staff:
-            queryset = queryset.filter(borrowing__user=self.request.user)
         try:
-            return queryset.get(pk=self.kwargs["pk"])
-        except Payment.DoesNotExist:
+            return self.get_queryset().get(pk=self.kwargs["pk"])
+        except (Payment.DoesNotExist, PaymentRecord.DoesNotExist):
             raise Http404
 
     @extend_schema(
         summary="get one of your payments",
+        parameters=[HISTORY_PARAMETER],
         responses={200: BorrowCreateSerializer(many=False)}
     )
     def get(self, request, *args, **kwargs):
         return self.retrieve(request, *args, **kwargs)
 
 
-def create_payment_session(payment):
-    """
-    Creates a Stripe checkout session for a payment and redirects the user to the Stripe payment page.
-    """
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": payment.borrowing.book.title,
-                    },
-                    "unit_amount": int(payment.money_to_pay) * 100,
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url=f"http://127.0.0.1:8000/api/v1/success/payment/{payment.id}/",
-        cancel_url=f"http://127.0.0.1:8000/api/v1/cancel/payment/{payment.id}/",
+def schedule_checkout(payments: list) -> str:
+    """
+    Schedules creation of one Stripe checkout session for the payments once
+    they are committed and returns the url clients follow to reach it.
+    """
+    if len(payments) == 1:
+        payment_id = payments[0].id
+        transaction.on_commit(lambda: create_checkout_session.delay(payment_id))
+    else:
+        payment_ids = [payment.id for payment in payments]
+        transaction.on_commit(
+            lambda: create_combined_checkout_session.delay(payment_ids)
+        )
+    return reverse("payment_service:payments-checkout", args=[payments[0].id])
+
+
+def start_checkout(payment: Payment) -> Response:
+    """
+    Schedules creation of the Stripe checkout session once the payment is
+    committed and immediately answers with the pending payment. Clients follow
+    the `Location` header to be redirected to Stripe when the session is ready.
+    """
+    location = schedule_checkout([payment])
+    serializer = PaymentListSerializer(payment)
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": location},
     )
 
-    payment.session_url = session.url
-    payment.session_id = session.id
-    payment.save()
 
-    return redirect(session.url)
+def session_payments(payment: Payment) -> list:
+    """
+    The payment together with every other pending payment of its checkout
+    session, so a combined checkout is settled in one go. The session is
+    looked up through the partial index on pending session ids.
+    """
+    queryset = Payment.objects.select_related("borrowing__book", "borrowing__user")
+    if payment.session_id:
+        queryset = queryset.filter(
+            Q(pk=payment.pk)
+            | Q(session_id=payment.session_id, status=Payment.Status.PENDING)
+        )
+    else:
+        queryset = queryset.filter(pk=payment.pk)
+    return list(queryset.order_by("id"))
 
 
+@extend_schema(
+    summary="redirect to the Stripe checkout of one of your payments",
+    responses={202: PaymentListSerializer(many=False)}
+)
 @api_view(["GET"])
-def success_payment_session(request, payment_id: int):
-    """
-    Handles the success of a Stripe payment session, reduces the inventory of the book,
-    updates the payment status, and notifies the Telegram group.
-    """
-    payment = Payment.objects.get(pk=payment_id)
-    borrow = payment.borrowing
-    book = borrow.book
-    book.inventory -= 1
-    book.save()
-    payment.status = "PAID"
-    payment.save()
-    send_message_to_telegram_group(
-        f"{request.user.email}\nhas borrowed book: `{book.title}`\ntill {borrow.expected_return_date}"
+@permission_classes([IsAuthenticated])
+def checkout_payment_session(request, payment_id: int):
+    """
+    Redirects to the Stripe checkout page of a payment. While the session is
+    still being created it answers 202 with a `Retry-After` header.
+    """
+    queryset = Payment.objects.all()
+    if not request.user.is_staff:
+        queryset = queryset.filter(borrowing__user=request.user)
+    payment = get_object_or_404(queryset, pk=payment_id)
+    if payment.session_url:
+        return redirect(payment.session_url)
+
+    serializer = PaymentListSerializer(payment)
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Retry-After": "1"},
     )
-    serializer = BorrowCreateSerializer(borrow)
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-@api_view(["GET"])
-def cancel_payment_session(request, payment_id: int):
+class PaymentRequired(APIException):
+    status_code = status.HTTP_402_PAYMENT_REQUIRED
+    default_detail = "The checkout session has not been paid."
+    default_code = "payment_required"
+
+
+class StripeUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Could not reach Stripe, try again."
+    default_code = "stripe_unavailable"
+
+
+async def session_is_paid(payment: Payment) -> bool:
+    """
+    Asks Stripe whether the checkout session of the payment has been paid.
+    Payments already settled, e.g. by the webhook, need no round trip.
+    """
+    if payment.status == Payment.Status.PAID:
+        return True
+    if not payment.session_id:
+        return False
+    return await get_payment_gateway().asession_is_paid(payment.session_id)
+
+
+async def settle_session(payment_id: int) -> list:
+    """
+    Settles the checkout session of a payment once Stripe confirms it was
+    paid and returns its borrows. The session payments are loaded while
+    Stripe is asked, so the request waits for the slower of the two.
+    """
+    payment = await aget_object_or_404(Payment, pk=payment_id)
+    try:
+        payments, paid = await asyncio.gather(
+            sync_to_async(session_payments)(payment),
+            session_is_paid(payment),
+        )
+    except stripe.StripeError:
+        raise StripeUnavailable
+    if not paid:
+        raise PaymentRequired
+    await sync_to_async(settle_payments)(payments)
+    return [payment.borrowing for payment in payments]
+
+
+async def expire_session(payment: Payment) -> bool:
+    """
+    Expires the Stripe checkout session of a pending payment so it can no
+    longer be paid, then tells whether it was paid before that. Stripe
+    refuses to expire a completed session, so the answer is final.
+    """
+    if payment.status != Payment.Status.PENDING:
+        return payment.status == Payment.Status.PAID
+    if not payment.session_id:
+        return False
+    gateway = get_payment_gateway()
+    await gateway.aexpire_checkout_session(payment.session_id)
+    return await gateway.asession_is_paid(payment.session_id)
+
+
+@async_api_view(["GET"])
+async def success_payment_session(request, payment_id: int):
+    """
+    Handles the success of a Stripe payment session: once Stripe confirms
+    the payment, confirms the held copies of every borrow paid in the
+    session, marks the payments as paid and sends one notification to the
+    Telegram group. A session already settled, e.g. by the webhook, is left
+    as it is.
+    """
+    borrows = await settle_session(payment_id)
+    serializer = BorrowCreateSerializer(borrows, many=True)
+    data = serializer.data if len(borrows) > 1 else serializer.data[0]
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["GET"])
+async def cancel_payment_session(request, payment_id: int):
     """
-    Handles the cancellation of a Stripe payment session and deletes the associated borrow record.
+    Handles the cancellation of a Stripe payment session: expires the
+    session at Stripe while its payments are loaded, then deletes the
+    unpaid borrow records of the session, putting their held copies back.
+    A session that was paid meanwhile, with its webhook not applied yet, is
+    settled instead. The url is signed, see `cancel_signature`.
     """
-    payment = Payment.objects.get(pk=payment_id)
-    borrow = Borrow.objects.get(id=payment.borrowing.id)
-    borrow.delete()
+    if not is_cancel_signature(payment_id, request.query_params.get("signature", "")):
+        raise Http404
+    payment = await aget_object_or_404(Payment, pk=payment_id)
+    try:
+        payments, paid = await asyncio.gather(
+            sync_to_async(session_payments)(payment),
+            expire_session(payment),
+        )
+    except stripe.StripeError:
+        # Nothing is discarded; the sweeper reclaims the checkout later.
+        raise StripeUnavailable
+    if paid:
+        await sync_to_async(settle_payments)(payments)
+        return Response(
+            {"success": "This checkout has already been paid"},
+            status=status.HTTP_200_OK,
+        )
+    await sync_to_async(discard_payments)(payments)
     return Response(
         {"success": "FAIL. You have 24 hours to pay for that book"},
         status=status.HTTP_502_BAD_GATEWAY,
     )
 
 
-def create_fine_session(payment):
-    """
-    Creates a Stripe checkout session for a fine payment and redirects the user to the Stripe payment page.
-    """
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": "fine for overdue",
-                    },
-                    "unit_amount": int(payment.money_to_pay) * 100,
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url=f"http://127.0.0.1:8000/api/v1/success/fine/{payment.id}/",
-        cancel_url="http://127.0.0.1:8000/api/v1/cancel/fine/",
-    )
-
-    payment.session_url = session.url
-    payment.session_id = session.id
-    payment.save()
-
-    return redirect(session.url)
+@async_api_view(["GET"])
+async def success_fine_session(request, payment_id: int):
+    """
+    Handles the success of a fine payment session: once Stripe confirms the
+    payment, returns every borrow fined in the session, marks the fines as
+    paid and notifies the Telegram group once. A session already settled is
+    left as it is.
+    """
+    borrows = await settle_session(payment_id)
+    serializer = BorrowRetrieveSerializer(borrows, many=True)
+    data = serializer.data if len(borrows) > 1 else serializer.data[0]
+    return Response(data, status=status.HTTP_202_ACCEPTED)
 
 
-@api_view(["GET"])
-def success_fine_session(request, payment_id: int):
-    """
-    Handles the success of a fine payment session, updates the inventory and borrowing records,
-    and notifies the Telegram group about the book return.
-    """
-    payment = Payment.objects.get(pk=payment_id)
-    payment.borrowing.book.inventory += 1
-    payment.borrowing.book.save()
-    payment.borrowing.actual_return_date = datetime.date.today()
-    payment.borrowing.save()
-    payment.status = "PAID"
-    payment.save()
-    send_message_to_telegram_group(
-        f"{request.user.email}\nhas returned book: "
-        f"`{payment.borrowing.book.title}`\nexpected return date is : "
-        f"{payment.borrowing.expected_return_date}\nactual return date is : {payment.borrowing.actual_return_date}"
-    )
-    serializer = BorrowRetrieveSerializer(payment.borrowing)
-    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+@extend_schema(exclude=True)
+@api_view(["POST"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def stripe_webhook(request):
+    """
+    Receives Stripe webhook events. The signature is verified and the event
+    is stored in the inbox once per event id; a Celery worker applies it.
+    """
+    try:
+        receive_event(request.body, request.headers.get("Stripe-Signature", ""))
+    except (ValueError, stripe.SignatureVerificationError) as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(status=status.HTTP_200_OK)
 
 
-@api_view(["GET"])
-def cancel_fine_session(request):
+@async_api_view(["GET"])
+async def cancel_fine_session(request):
     """
     Handles the cancellation of a fine payment session.
     """
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.translation import gettext_lazy as _
 
+from user_service.models import BorrowingSummary
+
 
 @admin.register(get_user_model())
 class UserAdmin(DjangoUserAdmin):
@@ -22,3 +24,16 @@ class UserAdmin(DjangoUserAdmin):
     list_display = ("email", "first_name", "last_name", "is_staff")
     search_fields = ("email", "first_name", "last_name")
     ordering = ("email",)
+
+
+@admin.register(BorrowingSummary)
+class BorrowingSummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        "user", "active_borrows", "overdue_borrows", "unpaid_fines", "lifetime_borrows"
+    )
+    list_select_related = ("user",)
+    search_fields = ("user__email",)
+    readonly_fields = (
+        "user", "active_borrows", "overdue_borrows", "unpaid_fines",
+        "lifetime_borrows", "updated_at",
+    )
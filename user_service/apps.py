@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UserServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user_service"
+
+    def ready(self):
+        from user_service import signals  # noqa: F401
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+CACHED_USER_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+def user_cache_key(user_id) -> str:
+    return f"auth:user:{user_id}"
+
+
+def invalidate_cached_user(user_id) -> None:
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves users from a short-lived cache entry
+    instead of loading them from Postgres on every request. Entries are
+    dropped whenever the user is saved or deleted, so staff and active flags
+    never lag behind the database by more than a write.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = user_cache_key(user_id)
+        cached = cache.get(key)
+        if cached is None:
+            user = super().get_user(validated_token)
+            cache.set(
+                key,
+                {field: getattr(user, field) for field in CACHED_USER_FIELDS},
+                settings.AUTH_USER_CACHE_TTL,
+            )
+            return user
+
+        # from_db() expects values in model field order; other fields stay
+        # deferred and are loaded on first access.
+        field_names = [
+            field.attname for field in self.user_model._meta.concrete_fields
+            if field.attname in cached
+        ]
+        user = self.user_model.from_db(
+            "default", field_names, [cached[name] for name in field_names]
+        )
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
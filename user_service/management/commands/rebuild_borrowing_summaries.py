@@ -0,0 +1,27 @@
+import time
+
+from django.core.management import BaseCommand
+
+from user_service.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-user borrowing summaries from the borrow and "
+        "payment tables, e.g. after a backfill or to repair drifted counters"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users",
+            help="Only rebuild this user's summary, may be repeated",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_summaries(options["users"], batch_size=options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {written} borrowing summaries in {elapsed:.2f}s")
+        )
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.8 on 2026-10-18 19:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_service", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BorrowingSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="borrowing_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("active_borrows", models.PositiveIntegerField(default=0)),
+                ("overdue_borrows", models.PositiveIntegerField(default=0)),
+                (
+                    "unpaid_fines",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("lifetime_borrows", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "borrowing summaries",
+            },
+        ),
+    ]
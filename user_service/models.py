@@ -47,3 +47,28 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+
+class BorrowingSummary(models.Model):
+    """
+    Per-user borrowing counters kept up to date by the borrow, return and
+    payment code paths, so they can be read without scanning borrows and
+    payments. `rebuild_summaries` recomputes them from those tables.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="borrowing_summary",
+    )
+    active_borrows = models.PositiveIntegerField(default=0)
+    overdue_borrows = models.PositiveIntegerField(default=0)
+    unpaid_fines = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    lifetime_borrows = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "borrowing summaries"
+
+    def __str__(self):
+        return f"{self.user} - {self.active_borrows} active"
@@ -1,8 +1,12 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from library_service.serializers import TimedSerializerMixin
+from user_service.models import BorrowingSummary
 
-class UserUpdateSerializer(serializers.ModelSerializer):
+
+class UserUpdateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ("id", "email", "first_name", "last_name", "password", "is_staff")
@@ -18,7 +22,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         return instance
 
 
-class UserCreateSerializer(serializers.ModelSerializer):
+class UserCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ("id", "email", "password", "is_staff")
@@ -27,3 +31,30 @@ class UserCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         return get_user_model().objects.create_user(**validated_data)
+
+
+class BorrowingSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = BorrowingSummary
+        fields = (
+            "active_borrows",
+            "overdue_borrows",
+            "unpaid_fines",
+            "lifetime_borrows",
+            "updated_at",
+        )
+
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """
+    Embeds the email, staff and active flags in issued tokens so clients
+    and services can read them without looking the user up.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["email"] = user.email
+        token["is_staff"] = user.is_staff
+        token["is_active"] = user.is_active
+        return token
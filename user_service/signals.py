@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user_service.authentication import invalidate_cached_user
+from user_service.models import BorrowingSummary
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=get_user_model())
+def create_borrowing_summary(sender, instance, created, raw=False, **kwargs):
+    # Request paths then never fall back to rebuilding a missing summary.
+    if created and not raw:
+        BorrowingSummary.objects.create(user=instance)
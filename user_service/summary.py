@@ -0,0 +1,132 @@
+"""
+Maintenance of the per-user `BorrowingSummary` counters.
+
+A summary is created with its user. The borrow, return and payment code
+paths apply deltas with `adjust_summary` in the same transaction as their
+own writes. `rebuild_summaries` recomputes
+the counters from `Borrow` and `Payment` with one set-based statement per
+batch of users; it runs nightly, which also moves borrows that fell due into
+the overdue count, and from the `rebuild_borrowing_summaries` command.
+Lifetime totals include the borrows archived to the history tables.
+"""
+import datetime
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from user_service.models import BorrowingSummary, User
+
+
+def adjust_summary(
+    user_id: int,
+    active: int = 0,
+    overdue: int = 0,
+    lifetime: int = 0,
+    unpaid_fines: Decimal | int = 0,
+) -> None:
+    """
+    Adds the deltas to a user's counters with a single UPDATE. A user without
+    a summary yet gets one rebuilt from scratch, which already includes the
+    change being recorded.
+    """
+    # Keeps the expression a decimal whichever number type is passed.
+    unpaid_fines = Decimal(str(unpaid_fines))
+    updated = BorrowingSummary.objects.filter(user_id=user_id).update(
+        active_borrows=Greatest(F("active_borrows") + active, 0),
+        overdue_borrows=Greatest(F("overdue_borrows") + overdue, 0),
+        lifetime_borrows=Greatest(F("lifetime_borrows") + lifetime, 0),
+        unpaid_fines=Greatest(F("unpaid_fines") + unpaid_fines, 0),
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        rebuild_summaries([user_id])
+
+
+def rebuild_statement(user_filter: str) -> str:
+    Borrow = apps.get_model("borrow_service", "Borrow")
+    BorrowRecord = apps.get_model("borrow_service", "BorrowRecord")
+    Payment = apps.get_model("payments_service", "Payment")
+    quote = connection.ops.quote_name
+    summary = quote(BorrowingSummary._meta.db_table)
+    user = quote(User._meta.db_table)
+    borrow = quote(Borrow._meta.db_table)
+    borrow_record = quote(BorrowRecord._meta.db_table)
+    payment = quote(Payment._meta.db_table)
+    return f"""
+        INSERT INTO {summary} (
+            user_id, active_borrows, overdue_borrows, unpaid_fines,
+            lifetime_borrows, updated_at
+        )
+        SELECT
+            account.id,
+            coalesce(borrows.active, 0),
+            coalesce(borrows.overdue, 0),
+            coalesce(fines.unpaid, 0),
+            coalesce(borrows.lifetime, 0),
+            %(now)s
+        FROM {user} AS account
+        -- Lateral, so only the borrows and fines of the users being
+        -- rebuilt are aggregated, through the user id indexes.
+        CROSS JOIN LATERAL (
+            SELECT
+                count(*) FILTER (WHERE actual_return_date IS NULL) AS active,
+                count(*) FILTER (
+                    WHERE actual_return_date IS NULL
+                        AND expected_return_date < %(today)s
+                ) AS overdue,
+                count(*) AS lifetime
+            FROM {borrow_record}
+            WHERE user_id = account.id
+        ) AS borrows
+        CROSS JOIN LATERAL (
+            SELECT sum(payment.money_to_pay) AS unpaid
+            FROM {payment} AS payment
+            JOIN {borrow} AS borrow ON borrow.id = payment.borrowing_id
+            WHERE borrow.user_id = account.id
+                AND payment.type = 'FINE' AND payment.status = 'PENDING'
+        ) AS fines
+        WHERE {user_filter}
+        ON CONFLICT (user_id) DO UPDATE SET
+            active_borrows = EXCLUDED.active_borrows,
+            overdue_borrows = EXCLUDED.overdue_borrows,
+            unpaid_fines = EXCLUDED.unpaid_fines,
+            lifetime_borrows = EXCLUDED.lifetime_borrows,
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def rebuild_summaries(user_ids: list[int] | None = None, batch_size: int = 5000, today=None) -> int:
+    """
+    Recomputes the summaries of the given users, or of every user in id
+    ranges of `batch_size` with one transaction per range. Borrows due before
+    `today` count as overdue. Returns the number of summaries written.
+    """
+    params = {"now": timezone.now(), "today": today or datetime.date.today()}
+    written = 0
+    with connection.cursor() as cursor:
+        if user_ids is not None:
+            cursor.execute(
+                rebuild_statement("account.id = ANY(%(ids)s)"),
+                {**params, "ids": list(user_ids)},
+            )
+            return cursor.rowcount
+
+        statement = rebuild_statement(
+            "account.id >= %(start)s AND account.id < %(stop)s"
+        )
+        user = connection.ops.quote_name(User._meta.db_table)
+        cursor.execute(f"SELECT min(id), max(id) FROM {user}")
+        first, last = cursor.fetchone()
+        if first is None:
+            return 0
+        for start in range(first, last + 1, batch_size):
+            with transaction.atomic():
+                cursor.execute(
+                    statement, {**params, "start": start, "stop": start + batch_size}
+                )
+                written += cursor.rowcount
+    return written
@@ -0,0 +1,17 @@
+import logging
+
+from celery import shared_task
+
+from user_service.summary import rebuild_summaries
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def rebuild_borrowing_summaries() -> int:
+    """
+    Reconciles every borrowing summary with the borrow and payment tables.
+    """
+    written = rebuild_summaries()
+    logger.info("Rebuilt %s borrowing summaries", written)
+    return written
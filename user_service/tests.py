@@ -1,3 +1,250 @@
-from django.test import TestCase
+import datetime
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from book_service.models import Book
+from borrow_service.models import Borrow
+from borrow_service.reservations import reserve_book
+from payments_service.tasks import (
+    cancel_signature,
+    create_checkout_session,
+    create_combined_checkout_session,
+)
+from user_service.models import BorrowingSummary
+from user_service.summary import rebuild_summaries
+from user_service.views import UpdateRetrieveUserView
+
+manage_url = reverse("user_service:manage")
+summary_url = reverse("user_service:summary")
+
+
+class TestCachedJWTAuthentication(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+
+    def test_login_token_embeds_claims(self):
+        res = self.client.post(
+            reverse("user_service:login"),
+            {"email": "test123@gmail.com", "password": "test123"},
+        )
+
+        token = AccessToken(res.data["access"])
+        self.assertEqual(token["email"], "test123@gmail.com")
+        self.assertFalse(token["is_staff"])
+        self.assertTrue(token["is_active"])
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.client.get(manage_url)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(manage_url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["email"], "test123@gmail.com")
+
+    def test_profile_update_invalidates_cache(self):
+        self.client.get(manage_url)
+
+        res = self.client.patch(manage_url, {"first_name": "Taras"})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(manage_url)
+        self.assertEqual(res.data["first_name"], "Taras")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, "test123@gmail.com")
+        self.assertTrue(self.user.check_password("test123"))
+
+    def test_unchanged_profile_is_not_modified(self):
+        etag = self.client.get(manage_url)["ETag"]
+
+        with self.assertNumQueries(0):
+            res = self.client.get(manage_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(manage_url, {"first_name": "Taras"})
+        res = self.client.get(manage_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res["ETag"], etag)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(manage_url)
+
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(manage_url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BenchmarkJWTAuthenticationQueries(TestCase):
+    """
+    Compares the queries of 50 authenticated requests with the stock
+    simplejwt backend and with the cached backend.
+    """
+    requests = 50
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = get_user_model().objects.create_user("test123@gmail.com", "test123")
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+        )
+
+    def run_requests(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(self.requests):
+                self.client.get(manage_url)
+        return len(queries)
+
+    def test_cached_backend_saves_a_query_per_request(self):
+        with patch.object(
+            UpdateRetrieveUserView, "authentication_classes", [JWTAuthentication]
+        ):
+            stock_queries = self.run_requests()
+        cached_queries = self.run_requests()
+
+        self.assertEqual(stock_queries, self.requests)
+        self.assertEqual(cached_queries, 1)
+
+
+@override_settings(PAYMENT_GATEWAY="payments_service.gateway.FakeStripeGateway")
+class TestBorrowingSummary(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "test123@gmail.com",
+            "test123"
+        )
+        self.client.force_authenticate(self.user)
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}", author="Author", cover="HARD",
+                inventory=10, daily_fee=1,
+            )
+            for i in range(3)
+        ]
+        self.due = datetime.date.today() + datetime.timedelta(days=5)
+
+    def summary(self) -> dict:
+        return self.client.get(summary_url).data
+
+    def assert_summary(self, **expected):
+        summary = self.summary()
+        summary.pop("updated_at")
+        self.assertEqual({field: summary[field] for field in expected}, expected)
+        # Incremental maintenance must agree with a rebuild from scratch.
+        rebuild_summaries([self.user.id])
+        rebuilt = self.summary()
+        rebuilt.pop("updated_at")
+        self.assertEqual(rebuilt, summary)
+
+    def test_summary_follows_borrows_returns_and_fines(self):
+        with patch(
+            "payments_service.views.create_combined_checkout_session.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse("borrow_service:borrows-bulk"),
+                {
+                    "books": [self.books[0].id, self.books[1].id],
+                    "expected_return_date": self.due,
+                },
+                format="json",
+            )
+        self.assert_summary(active_borrows=2, lifetime_borrows=2, unpaid_fines="0.00")
+
+        create_combined_checkout_session([payment["id"] for payment in res.data])
+        self.client.get(reverse("payment_service:payments-success", args=[res.data[0]["id"]]))
+        late = reserve_book(
+            self.books[2].id,
+            user=self.user,
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=3),
+        )
+        # Borrows that fell due are counted by the nightly rebuild.
+        rebuild_summaries()
+        self.assert_summary(active_borrows=3, overdue_borrows=1, lifetime_borrows=3)
+
+        with patch(
+            "payments_service.views.create_checkout_session.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse("borrow_service:return_borrowed_book", args=[late.id])
+            )
+        self.assert_summary(active_borrows=3, overdue_borrows=1, unpaid_fines="6.00")
+
+        create_checkout_session(res.data["id"])
+        with patch(
+            "notifications_service.views.deliver_notifications.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse("payment_service:fine-success", args=[res.data["id"]]))
+            self.client.get(reverse("payment_service:fine-success", args=[res.data["id"]]))
+        self.assert_summary(
+            active_borrows=2, overdue_borrows=0, unpaid_fines="0.00", lifetime_borrows=3
+        )
+
+    def test_cancelled_checkout_discards_borrows(self):
+        with patch(
+            "payments_service.views.create_checkout_session.delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse("borrow_service:borrows"),
+                {"book": self.books[0].id, "expected_return_date": self.due},
+            )
+        self.assert_summary(active_borrows=1, lifetime_borrows=1)
+
+        url = reverse("payment_service:payments-cancel", args=[res.data["id"]])
+        self.client.get(f"{url}?signature={cancel_signature(res.data['id'])}")
+
+        self.assert_summary(active_borrows=0, lifetime_borrows=0)
+
+    def test_new_user_has_a_summary(self):
+        self.assertTrue(BorrowingSummary.objects.filter(user=self.user).exists())
+
+    def test_missing_summary_is_built_on_first_read(self):
+        # Users created before summaries were added with them.
+        BorrowingSummary.objects.filter(user=self.user).delete()
+        Borrow.objects.create(
+            book=self.books[0], user=self.user, expected_return_date=self.due
+        )
+
+        self.assertEqual(self.summary()["active_borrows"], 1)
+        with self.assertNumQueries(1):
+            self.summary()
+
+    def test_rebuild_command_covers_every_user(self):
+        other = get_user_model().objects.create_user("other@gmail.com", "other123")
+        for user in (self.user, other):
+            Borrow.objects.create(
+                book=self.books[0], user=user, expected_return_date=self.due
+            )
+
+        call_command("rebuild_borrowing_summaries", "--batch-size", "1", stdout=StringIO())
+
+        self.assertEqual(
+            list(BorrowingSummary.objects.order_by("user_id").values_list(
+                "user_id", "active_borrows", "lifetime_borrows"
+            )),
+            [(self.user.id, 1, 1), (other.id, 1, 1)],
+        )
@@ -1,8 +1,16 @@
 from drf_spectacular.utils import extend_schema
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.generics import CreateAPIView, RetrieveUpdateAPIView
+from rest_framework.generics import CreateAPIView, RetrieveAPIView, RetrieveUpdateAPIView
 
-from user_service.serializers import UserCreateSerializer, UserUpdateSerializer
+from library_service.versioning import etag_matches, make_etag, not_modified
+
+from user_service.models import BorrowingSummary
+from user_service.serializers import (
+    BorrowingSummarySerializer,
+    UserCreateSerializer,
+    UserUpdateSerializer,
+)
+from user_service.summary import rebuild_summaries
 
 
 class CreateUserView(CreateAPIView):
@@ -22,19 +30,31 @@ class CreateUserView(CreateAPIView):
 class UpdateRetrieveUserView(RetrieveUpdateAPIView):
     """
     A view for retrieving and updating the authenticated user's profile.
+    The profile comes from the authentication cache, so its ETag is derived
+    from the rendered fields without a query.
     """
     serializer_class = UserUpdateSerializer
     permission_classes = (IsAuthenticated,)
+    etag_fields = ("id", "email", "first_name", "last_name", "is_staff")
 
     def get_object(self):
         return self.request.user
 
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        etag = make_etag(request, [[getattr(user, field) for field in self.etag_fields]])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response = super().retrieve(request, *args, **kwargs)
+        response["ETag"] = etag
+        return response
+
     @extend_schema(
         summary="retrieve your profile",
         responses={200: UserUpdateSerializer(many=False)}
     )
     def get(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        return self.retrieve(request, *args, **kwargs)
 
     @extend_schema(
         summary="update your profile",
@@ -49,3 +69,27 @@ class UpdateRetrieveUserView(RetrieveUpdateAPIView):
     )
     def patch(self, request, *args, **kwargs):
         return super().partial_update(request, *args, **kwargs)
+
+
+class BorrowingSummaryView(RetrieveAPIView):
+    """
+    A view for the authenticated user's active and overdue borrows, unpaid
+    fines and lifetime borrow count, read from the maintained summary.
+    """
+    serializer_class = BorrowingSummarySerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_object(self):
+        user = self.request.user
+        try:
+            return BorrowingSummary.objects.get(user=user)
+        except BorrowingSummary.DoesNotExist:
+            rebuild_summaries([user.id])
+            return BorrowingSummary.objects.get(user=user)
+
+    @extend_schema(
+        summary="get a summary of your borrows and unpaid fines",
+        responses={200: BorrowingSummarySerializer(many=False)}
+    )
+    def get(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)